@@ -0,0 +1,214 @@
+"""
+Lookup of the DataAccessGrant of a beneficiary and application, for the
+DataAccessGrantPermission check of every FHIR call.
+
+Answers are kept in two layers, when DATA_ACCESS_GRANT_CACHE_ENABLED:
+
+* a per-process LRU of up to DATA_ACCESS_GRANT_CACHE_SIZE
+  (beneficiary_id, application_id) pairs,
+* the DATA_ACCESS_GRANT_CACHE_ALIAS cache, shared by the processes.
+
+A granted pair is kept DATA_ACCESS_GRANT_POSITIVE_TTL seconds and a pair
+without a grant DATA_ACCESS_GRANT_NEGATIVE_TTL seconds.
+
+Shared entries are stored with the generation of their pair, read
+before the database. Saving or deleting a DataAccessGrant, and
+remove_application_user_pair_tokens_data_access, replace the generation
+of the pair and drop it from the LRU of the process doing it, again once
+the transaction commits. An answer read before a revocation committed
+is then stored under the old generation and never used. The LRU of the
+other processes can not be reached, so its entries are kept
+DATA_ACCESS_GRANT_REVOCATION_BOUND seconds at most: a revoked grant is
+never honored longer than that, unless the generation could not be
+replaced (logged as an error). Grants moved with QuerySet.update() send
+no signal, they are seen after the TTLs.
+
+Off by default. With the database cache backend a shared lookup, and
+more so a miss, costs more queries than the single grant query it
+replaces, use a memory cache (e.g. memcached) for
+DATA_ACCESS_GRANT_CACHE_ALIAS.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import DataAccessGrant
+
+logger = logging.getLogger('hhs_server.%s' % __name__)
+
+KEY_PREFIX = "grant"
+GENERATION_PREFIX = "grant_generation"
+
+
+def is_enabled():
+    return getattr(settings, 'DATA_ACCESS_GRANT_CACHE_ENABLED', False)
+
+
+def get_cache():
+    return caches[getattr(settings, 'DATA_ACCESS_GRANT_CACHE_ALIAS', 'default')]
+
+
+def grant_key(beneficiary_id, application_id):
+    return "%s:%s:%s" % (KEY_PREFIX, beneficiary_id, application_id)
+
+
+def generation_key(beneficiary_id, application_id):
+    return "%s:%s:%s" % (GENERATION_PREFIX, beneficiary_id, application_id)
+
+
+class GrantIndex(object):
+    """
+    Thread safe two layer cache of DataAccessGrant lookups.
+    """
+
+    def __init__(self, size=None, positive_ttl=None, negative_ttl=None, revocation_bound=None, clock=time.monotonic):
+        self._size = size
+        self._positive_ttl = positive_ttl
+        self._negative_ttl = negative_ttl
+        self._revocation_bound = revocation_bound
+        self.clock = clock
+        self._lock = threading.Lock()
+        # (beneficiary_id, application_id) -> (allowed, expires at)
+        self._entries = OrderedDict()
+        self._pid = os.getpid()
+        self._counters = {"local_hits": 0, "shared_hits": 0, "queries": 0, "invalidations": 0}
+
+    # Read late, so override_settings applies to the module instance
+    @property
+    def size(self):
+        return self._size if self._size is not None else getattr(settings, 'DATA_ACCESS_GRANT_CACHE_SIZE', 10000)
+
+    @property
+    def positive_ttl(self):
+        if self._positive_ttl is not None:
+            return self._positive_ttl
+        return getattr(settings, 'DATA_ACCESS_GRANT_POSITIVE_TTL', 5 * 60)
+
+    @property
+    def negative_ttl(self):
+        if self._negative_ttl is not None:
+            return self._negative_ttl
+        return getattr(settings, 'DATA_ACCESS_GRANT_NEGATIVE_TTL', 30)
+
+    @property
+    def revocation_bound(self):
+        if self._revocation_bound is not None:
+            return self._revocation_bound
+        return getattr(settings, 'DATA_ACCESS_GRANT_REVOCATION_BOUND', 10)
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _local_get(self, pair):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Entries of the parent process are not invalidated here
+                self._entries.clear()
+                self._pid = os.getpid()
+            entry = self._entries.get(pair)
+            if entry is None:
+                return None
+            if entry[1] <= self.clock():
+                del self._entries[pair]
+                return None
+            self._entries.move_to_end(pair)
+            self._counters["local_hits"] += 1
+            return entry[0]
+
+    def _local_set(self, pair, allowed, ttl):
+        ttl = min(ttl, self.revocation_bound)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[pair] = (allowed, self.clock() + ttl)
+            self._entries.move_to_end(pair)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def has_grant(self, beneficiary_id, application_id):
+        if not is_enabled():
+            return self._query(beneficiary_id, application_id)
+
+        pair = (beneficiary_id, application_id)
+        allowed = self._local_get(pair)
+        if allowed is not None:
+            return allowed
+
+        key, gen_key = grant_key(*pair), generation_key(*pair)
+        try:
+            cache = get_cache()
+            values = cache.get_many([key, gen_key])
+            generation = values.get(gen_key)
+            if generation is None:
+                cache.add(gen_key, uuid.uuid4().hex, None)
+                generation = cache.get(gen_key)
+        except Exception as e:
+            logger.warning("Failed to read the grant cache: %r" % e)
+            values, generation = {}, None
+        entry = values.get(key)
+        if generation is not None and entry is not None and entry[1] == generation:
+            allowed = entry[0]
+            self._count("shared_hits")
+            # The shared entry age is not known, the local one is bounded anyway
+            self._local_set(pair, allowed, self.positive_ttl if allowed else self.negative_ttl)
+            return allowed
+
+        allowed = self._query(beneficiary_id, application_id)
+        ttl = self.positive_ttl if allowed else self.negative_ttl
+        if generation is not None:
+            try:
+                cache.set(key, (allowed, generation), ttl)
+            except Exception as e:
+                logger.warning("Failed to write the grant cache: %r" % e)
+        self._local_set(pair, allowed, ttl)
+        return allowed
+
+    def _query(self, beneficiary_id, application_id):
+        self._count("queries")
+        return DataAccessGrant.objects.filter(beneficiary_id=beneficiary_id, application_id=application_id).exists()
+
+    def _forget(self, beneficiary_id, application_id):
+        pair = (beneficiary_id, application_id)
+        with self._lock:
+            self._entries.pop(pair, None)
+            self._counters["invalidations"] += 1
+        try:
+            # Answers read under the previous generation are never used again
+            get_cache().set(generation_key(*pair), uuid.uuid4().hex, None)
+        except Exception as e:
+            logger.error("Failed to invalidate the grant cache of beneficiary %s and application %s: %r"
+                         % (beneficiary_id, application_id, e))
+
+    def invalidate(self, beneficiary_id, application_id):
+        """
+        Forget the pair now and once the current transaction commits.
+        """
+        if not is_enabled():
+            return
+        self._forget(beneficiary_id, application_id)
+        transaction.on_commit(lambda: self._forget(beneficiary_id, application_id))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters,
+                        entries=len(self._entries),
+                        size=self.size,
+                        positive_ttl=self.positive_ttl,
+                        negative_ttl=self.negative_ttl,
+                        revocation_bound=self.revocation_bound,
+                        enabled=is_enabled())
+
+
+grant_index = GrantIndex()
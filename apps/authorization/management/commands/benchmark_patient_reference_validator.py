@@ -0,0 +1,57 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework import exceptions
+
+from apps.authorization.permissions import is_resource_for_patient, PatientReferenceValidator
+from apps.fhir.bluebutton.streaming import iter_bundle
+from apps.fhir.server.mock_bfd import eob_bundle
+
+FHIR_ID = '-20140000008325'
+
+
+def recursive(content):
+    return is_resource_for_patient(json.loads(content.decode('utf-8')), FHIR_ID)
+
+
+def validator(content):
+    return PatientReferenceValidator(FHIR_ID).validate(json.loads(content.decode('utf-8')))
+
+
+def streamed(content):
+    for _ in iter_bundle([content], PatientReferenceValidator(FHIR_ID).feed):
+        pass
+    return True
+
+
+class Command(BaseCommand):
+    help = ('Compare the recursive patient check on a parsed Bundle with the '
+            'single pass PatientReferenceValidator, parsed and streamed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=50, help="entries per Bundle")
+        parser.add_argument('--runs', type=int, default=200, help="checks per case")
+
+    def handle(self, *args, **options):
+        count = options['count']
+        cases = [('match', None), ('mismatch first', 0), ('mismatch last', count - 1)]
+
+        self.stdout.write("Bundle: %s entries, timings in ms per check (parse included)" % count)
+        self.stdout.write("%16s %12s %12s %12s" % ('case', 'recursive', 'validator', 'streamed'))
+        for name, mismatch in cases:
+            bundle = eob_bundle(FHIR_ID, count=count)
+            if mismatch is not None:
+                bundle['entry'][mismatch]['resource']['patient']['reference'] = 'Patient/-20140000000001'
+            content = json.dumps(bundle).encode('utf-8')
+
+            timings = []
+            for check in (recursive, validator, streamed):
+                start = time.perf_counter()
+                for _ in range(options['runs']):
+                    try:
+                        check(content)
+                    except exceptions.NotFound:
+                        pass
+                timings.append(1000 * (time.perf_counter() - start) / options['runs'])
+            self.stdout.write("%16s %12.3f %12.3f %12.3f" % (name, *timings))
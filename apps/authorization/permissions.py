@@ -1,5 +1,6 @@
 from rest_framework import (permissions, exceptions)
-from .models import DataAccessGrant
+from apps.fhir.bluebutton.identity import get_identity
+from .grant_index import grant_index
 
 
 class DataAccessGrantPermission(permissions.BasePermission):
@@ -7,17 +8,17 @@ class DataAccessGrantPermission(permissions.BasePermission):
     Permission check for a Grant related to the token used.
     """
     def has_permission(self, request, view):
-        return DataAccessGrant.objects.filter(
-            beneficiary=request.auth.user,
-            application=request.auth.application,
-        ).exists()
+        identity = get_identity(request)
+        if identity is not None:
+            return grant_index.has_grant(identity.beneficiary.pk, identity.application.pk)
+        return grant_index.has_grant(request.auth.user_id, request.auth.application_id)
 
     def has_object_permission(self, request, view, obj):
         # Now check that the user has permission to access the data
         # Patient resources were taken care of above
         # Return 404 on error to avoid notifying unauthorized user the object exists
 
-        return is_resource_for_patient(obj, request.crosswalk.fhir_id)
+        return PatientReferenceValidator(request.crosswalk.fhir_id).validate(obj)
 
 
 def is_resource_for_patient(obj, patient_id):
@@ -47,3 +48,81 @@ def is_resource_for_patient(obj, patient_id):
     except Exception:
         return False
     return True
+
+
+class PatientReferenceValidator(object):
+    """
+    Single pass check that a backend response belongs to a beneficiary.
+
+    Gives the same verdicts as is_resource_for_patient: NotFound is raised
+    for a resource of another patient or of an unsupported type, False is
+    returned for a malformed one. A Bundle can be checked as a whole with
+    validate() or one event at a time with feed(), as its members arrive
+    from a stream (see apps.fhir.bluebutton.streaming). Both stop at the
+    first mismatch.
+    """
+
+    # Resource types referencing the patient, and the referencing element
+    REFERENCE_ELEMENTS = {
+        'Coverage': 'beneficiary',
+        'ExplanationOfBenefit': 'patient',
+    }
+
+    def __init__(self, patient_id):
+        self.patient_id = patient_id
+        self.resource_type = None
+        self.valid = True
+
+    def check_resource(self, obj):
+        try:
+            resource_type = obj['resourceType']
+            if resource_type in self.REFERENCE_ELEMENTS:
+                reference_id = obj[self.REFERENCE_ELEMENTS[resource_type]]['reference'].split('/')[1]
+            elif resource_type == 'Patient':
+                reference_id = obj['id']
+            elif resource_type == 'Bundle':
+                for entry in obj.get('entry', []):
+                    # Malformed resources within a Bundle do not fail it
+                    self.check_resource(entry['resource'])
+                return True
+            else:
+                raise exceptions.NotFound()
+
+            if reference_id != self.patient_id:
+                raise exceptions.NotFound()
+
+        except exceptions.NotFound:
+            raise
+        except Exception:
+            return False
+        return True
+
+    def validate(self, obj):
+        return self.check_resource(obj)
+
+    def feed(self, event, value=None):
+        """
+        Take the next event of a streamed Bundle: ("resourceType", value),
+        ("entry", entry) for each Bundle.entry, other top level members
+        as (name, value), and ("end", None). Return False once the Bundle
+        is known to be malformed.
+        """
+        if not self.valid:
+            return False
+
+        if event == 'resourceType':
+            if value != 'Bundle':
+                # Only Bundles are checked one entry at a time
+                raise exceptions.NotFound()
+            self.resource_type = value
+        elif event == 'entry':
+            try:
+                resource = value['resource']
+            except Exception:
+                self.valid = False
+            else:
+                self.check_resource(resource)
+        elif event == 'end':
+            self.valid = self.resource_type == 'Bundle'
+
+        return self.valid
@@ -1,8 +1,13 @@
+from apps.dot_ext import token_cache
 from apps.dot_ext.signals import beneficiary_authorized_application
+from apps.fhir.bluebutton.cache import purge_user
 from oauth2_provider.models import get_access_token_model, get_refresh_token_model
+from django.core.exceptions import ObjectDoesNotExist
 from django.db.models.signals import (
     post_delete,
+    post_save,
 )
+from .grant_index import grant_index
 from .models import DataAccessGrant, ArchivedDataAccessGrant
 
 AccessToken = get_access_token_model()
@@ -40,5 +45,26 @@ def archive_removed_grant(sender, instance=None, **kwargs):
         beneficiary=instance.beneficiary)
 
 
+def purge_cached_fhir_responses(sender, instance=None, **kwargs):
+    # Works for both DataAccessGrant and AccessToken instances
+    try:
+        purge_user(instance.user)
+    except ObjectDoesNotExist:
+        pass
+
+
+def invalidate_cached_tokens(sender, instance=None, **kwargs):
+    token_cache.invalidate_application(instance.application_id, instance.beneficiary_id)
+
+
+def invalidate_grant_index(sender, instance=None, **kwargs):
+    grant_index.invalidate(instance.beneficiary_id, instance.application_id)
+
+
+post_save.connect(invalidate_grant_index, sender='authorization.DataAccessGrant')
+post_delete.connect(invalidate_grant_index, sender='authorization.DataAccessGrant')
+post_delete.connect(invalidate_cached_tokens, sender='authorization.DataAccessGrant')
 post_delete.connect(revoke_associated_tokens, sender='authorization.DataAccessGrant')
 post_delete.connect(archive_removed_grant, sender='authorization.DataAccessGrant')
+post_delete.connect(purge_cached_fhir_responses, sender='authorization.DataAccessGrant')
+post_delete.connect(purge_cached_fhir_responses, sender=AccessToken)
@@ -0,0 +1,76 @@
+from django.core.cache import caches
+from django.test import override_settings
+from oauth2_provider.models import get_application_model
+
+from apps.dot_ext.utils import remove_application_user_pair_tokens_data_access
+from apps.fhir.server.tests.test_breaker import FakeClock
+from apps.test import BaseApiTest
+from ..grant_index import grant_index, GrantIndex
+from ..models import DataAccessGrant
+
+Application = get_application_model()
+
+
+@override_settings(DATA_ACCESS_GRANT_CACHE_ENABLED=True)
+class TestGrantIndex(BaseApiTest):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.clock = FakeClock()
+        self.index = GrantIndex(size=2, positive_ttl=300, negative_ttl=30, revocation_bound=10, clock=self.clock)
+        self.user = self._create_user('anna', '123456')
+        self.application = self._create_application('an app', grant_type=Application.GRANT_AUTHORIZATION_CODE)
+
+    def test_cached_answers(self):
+        DataAccessGrant.objects.create(beneficiary=self.user, application=self.application)
+        with self.assertNumQueries(1):
+            self.assertTrue(self.index.has_grant(self.user.pk, self.application.pk))
+            self.assertTrue(self.index.has_grant(self.user.pk, self.application.pk))
+        self.assertFalse(self.index.has_grant(self.user.pk, 0))
+        stats = self.index.stats()
+        self.assertEqual((stats['queries'], stats['local_hits']), (2, 1))
+
+    def test_local_entries_are_bounded(self):
+        grant = DataAccessGrant.objects.create(beneficiary=self.user, application=self.application)
+        self.assertTrue(self.index.has_grant(self.user.pk, self.application.pk))
+        # Revoked by another process, only the shared cache is invalidated
+        DataAccessGrant.objects.filter(pk=grant.pk).delete()
+        caches['default'].clear()
+        self.assertTrue(self.index.has_grant(self.user.pk, self.application.pk))
+        self.clock.now += 10
+        self.assertFalse(self.index.has_grant(self.user.pk, self.application.pk))
+
+    def test_signals_invalidate(self):
+        grant_index.clear()
+        self.assertFalse(grant_index.has_grant(self.user.pk, self.application.pk))
+        grant = DataAccessGrant.objects.create(beneficiary=self.user, application=self.application)
+        self.assertTrue(grant_index.has_grant(self.user.pk, self.application.pk))
+        grant.delete()
+        self.assertFalse(grant_index.has_grant(self.user.pk, self.application.pk))
+
+    def test_remove_pair_invalidates(self):
+        grant_index.clear()
+        DataAccessGrant.objects.create(beneficiary=self.user, application=self.application)
+        self.assertTrue(grant_index.has_grant(self.user.pk, self.application.pk))
+        remove_application_user_pair_tokens_data_access(self.application, self.user)
+        self.assertFalse(grant_index.has_grant(self.user.pk, self.application.pk))
+
+    def test_least_recently_used_evicted(self):
+        for application_id in (1, 2, 3):
+            self.index.has_grant(self.user.pk, application_id)
+        self.assertEqual(self.index.stats()['entries'], 2)
+
+    def test_answer_read_before_revocation_not_shared(self):
+        DataAccessGrant.objects.create(beneficiary=self.user, application=self.application)
+        query = self.index._query
+
+        def revoked_while_querying(beneficiary_id, application_id):
+            allowed = query(beneficiary_id, application_id)
+            self.index._forget(beneficiary_id, application_id)
+            return allowed
+
+        self.index._query = revoked_while_querying
+        self.assertTrue(self.index.has_grant(self.user.pk, self.application.pk))
+        other = GrantIndex(size=2, positive_ttl=300, negative_ttl=30, revocation_bound=10, clock=self.clock)
+        other.has_grant(self.user.pk, self.application.pk)
+        self.assertEqual(other.stats()['shared_hits'], 0)
@@ -0,0 +1,88 @@
+import copy
+import json
+
+from django.test import SimpleTestCase
+from rest_framework import exceptions
+
+from apps.fhir.bluebutton.streaming import iter_bundle
+from apps.fhir.server.mock_bfd import coverage_resource, eob_bundle, patient_resource
+from ..permissions import is_resource_for_patient, PatientReferenceValidator
+
+FHIR_ID = '-20140000008325'
+OTHER_FHIR_ID = '-20140000000001'
+
+
+def verdict(check, obj):
+    try:
+        return check(obj)
+    except exceptions.NotFound:
+        return 'NotFound'
+
+
+def streamed(obj):
+    validator = PatientReferenceValidator(FHIR_ID)
+    valid = [True]
+
+    def on_event(event, value):
+        valid[0] = valid[0] and validator.feed(event, value)
+
+    list(iter_bundle([json.dumps(obj).encode('utf-8')], on_event))
+    return valid[0]
+
+
+def cases():
+    bundle = eob_bundle(FHIR_ID, count=3)
+    yield 'patient', patient_resource(FHIR_ID)
+    yield 'other patient', patient_resource(OTHER_FHIR_ID)
+    yield 'coverage', coverage_resource(FHIR_ID, 'A')
+    yield 'other coverage', coverage_resource(OTHER_FHIR_ID, 'A')
+    yield 'bundle', bundle
+    yield 'empty bundle', {'resourceType': 'Bundle'}
+    yield 'unsupported type', {'resourceType': 'Organization', 'id': FHIR_ID}
+    yield 'not an object', ['resourceType']
+    yield 'missing reference', {'resourceType': 'Coverage', 'beneficiary': {}}
+    yield 'reference without type', {'resourceType': 'ExplanationOfBenefit', 'patient': {'reference': FHIR_ID}}
+
+    other = copy.deepcopy(bundle)
+    other['entry'][1]['resource']['patient']['reference'] = 'Patient/' + OTHER_FHIR_ID
+    yield 'bundle with other patient', other
+
+    missing = copy.deepcopy(bundle)
+    del missing['entry'][1]['resource']
+    yield 'bundle entry without resource', missing
+
+    malformed = copy.deepcopy(bundle)
+    del malformed['entry'][1]['resource']['patient']
+    yield 'bundle with malformed resource', malformed
+
+    unsupported = copy.deepcopy(bundle)
+    unsupported['entry'][1]['resource']['resourceType'] = 'Organization'
+    yield 'bundle with unsupported type', unsupported
+
+    nested = copy.deepcopy(bundle)
+    nested['entry'].append({'resource': {'resourceType': 'Bundle', 'entry': [{}]}})
+    yield 'bundle with malformed nested bundle', nested
+
+
+class TestPatientReferenceValidator(SimpleTestCase):
+
+    def test_same_verdicts_as_is_resource_for_patient(self):
+        for name, obj in cases():
+            with self.subTest(name):
+                expected = verdict(lambda o: is_resource_for_patient(o, FHIR_ID), obj)
+                self.assertEqual(verdict(PatientReferenceValidator(FHIR_ID).validate, obj), expected)
+
+    def test_streamed_bundles_get_the_same_verdicts(self):
+        for name, obj in cases():
+            if not isinstance(obj, dict) or obj.get('resourceType') != 'Bundle':
+                continue
+            with self.subTest(name):
+                expected = verdict(lambda o: is_resource_for_patient(o, FHIR_ID), obj)
+                self.assertEqual(verdict(streamed, obj), expected)
+
+    def test_stops_at_first_mismatch(self):
+        validator = PatientReferenceValidator(FHIR_ID)
+        bundle = eob_bundle(OTHER_FHIR_ID, count=2)
+        self.assertTrue(validator.feed('resourceType', 'Bundle'))
+        with self.assertRaises(exceptions.NotFound):
+            validator.feed('entry', bundle['entry'][0])
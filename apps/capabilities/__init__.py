@@ -0,0 +1 @@
+default_app_config = 'apps.capabilities.app.CapabilitiesConfig'
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class CapabilitiesConfig(AppConfig):
+    name = 'apps.capabilities'
+    verbose_name = 'Capabilities'
+
+    def ready(self):
+        from . import signals  # noqa
@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.capabilities.models import ProtectedCapability
+from apps.capabilities.permissions import capabilities_allow, get_token_capabilities
+from apps.capabilities.routes import RouteTable
+
+
+class SimpleToken(object):
+
+    def __init__(self, scope):
+        self.scope = scope
+
+
+def per_request(token, method, path):
+    return capabilities_allow(get_token_capabilities(token), method, path)
+
+
+class Command(BaseCommand):
+    help = ('Compare the per request ProtectedCapability query and regex checks '
+            'with the compiled routing table, for the capabilities in the database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scope', default=None, help="token scopes, all of them by default")
+        parser.add_argument('--runs', type=int, default=2000, help="checks per case")
+
+    def handle(self, *args, **options):
+        token = SimpleToken(options['scope'] or " ".join(ProtectedCapability.objects.values_list('slug', flat=True)))
+        capabilities = get_token_capabilities(token)
+        if not capabilities:
+            raise CommandError("No protected resources for scopes %r, see create_blue_button_scopes" % token.scope)
+
+        # Last protected path of the scopes, and one none protects
+        method, path = capabilities[-1]
+        cases = [('allowed', path), ('denied', '/v1/unprotected/path')]
+
+        table = RouteTable()
+        table.build()
+
+        self.stdout.write("Scopes: %s (%d protected paths), timings in us per check" % (token.scope, len(capabilities)))
+        self.stdout.write("%10s %14s %14s %14s" % ('case', 'per request', 'no query', 'compiled'))
+        for name, request_path in cases:
+            timings = []
+            checks = (
+                lambda: per_request(token, method, request_path),
+                # The regex part of the per request check alone
+                lambda: capabilities_allow(capabilities, method, request_path),
+                lambda: table.allows(token.scope, method, request_path),
+            )
+            for check in checks:
+                start = time.perf_counter()
+                for _ in range(options['runs']):
+                    check()
+                timings.append(1000000 * (time.perf_counter() - start) / options['runs'])
+            self.stdout.write("%10s %14.2f %14.2f %14.2f" % (name, *timings))
@@ -6,6 +6,7 @@ from rest_framework.exceptions import APIException
 from waffle import switch_is_active
 
 from .models import ProtectedCapability
+from .routes import is_enabled as routes_enabled, route_table
 
 
 class BBCapabilitiesPermissionTokenScopeMissingException(APIException):
@@ -13,6 +14,40 @@ class BBCapabilitiesPermissionTokenScopeMissingException(APIException):
     status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
 
 
+def get_token_capabilities(token):
+    """
+    Return the (method, path) pairs protected by the token scopes.
+    """
+    capabilities = []
+    scopes = ProtectedCapability.objects.filter(
+        slug__in=token.scope.split()
+    ).values_list('protected_resources', flat=True).all()
+    for scope in scopes:
+        capabilities.extend(json.loads(scope))
+    return capabilities
+
+
+def capabilities_allow(capabilities, method, request_path):
+    for capability_method, path in capabilities:
+        if capability_method != method:
+            continue
+        if path == request_path:
+            return True
+        if re.fullmatch(path, request_path) is not None:
+            return True
+    return False
+
+
+def token_allows(token, method, request_path):
+    """
+    Whether the token scopes protect (method, request_path), with the
+    compiled routing table when enabled.
+    """
+    if routes_enabled():
+        return route_table.allows(token.scope, method, request_path)
+    return capabilities_allow(get_token_capabilities(token), method, request_path)
+
+
 class TokenHasProtectedCapability(permissions.BasePermission):
 
     def has_permission(self, request, view):
@@ -25,18 +60,7 @@ class TokenHasProtectedCapability(permissions.BasePermission):
             return True
 
         if hasattr(token, "scope"):  # OAuth 2
-            scopes = list(ProtectedCapability.objects.filter(
-                slug__in=token.scope.split()
-            ).values_list('protected_resources', flat=True).all())
-            for scope in scopes:
-                for method, path in json.loads(scope):
-                    if method != request.method:
-                        continue
-                    if path == request.path:
-                        return True
-                    if re.fullmatch(path, request.path) is not None:
-                        return True
-            return False
+            return token_allows(token, request.method, request.path)
         else:
             # BB2-237: Replaces ASSERT with exception. We should never reach here.
             mesg = ("TokenHasScope requires the `oauth2_provider.rest_framework.OAuth2Authentication`"
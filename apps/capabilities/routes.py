@@ -0,0 +1,201 @@
+"""
+Compiled routing table of the ProtectedCapability scopes, for the
+TokenHasProtectedCapability check of every protected request.
+
+All ProtectedCapability rows are loaded once per process into a map of
+scope -> method -> protected paths. The paths of a token scopes and a
+method are compiled into a single alternation the first time they are
+checked, so a check is a dict lookup plus one regex match, with the
+verdicts of capabilities_allow: a path matches when equal to a protected
+path or when fully matched by it as a regular expression. A protected
+path that is not a valid regular expression is logged and rejected.
+
+Saving or deleting a ProtectedCapability drops the table of the process
+doing it and bumps a version in the CAPABILITY_ROUTES_CACHE_ALIAS cache.
+Other processes compare that version at most every
+CAPABILITY_ROUTES_CHECK_INTERVAL seconds and rebuild their table when it
+changed.
+"""
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import ProtectedCapability
+
+logger = logging.getLogger('hhs_server.%s' % __name__)
+
+VERSION_KEY = "capability_routes:version"
+
+# Compiled (scopes, method) matchers kept per table, tokens share few scope sets
+MAX_MATCHERS = 1024
+
+
+def is_enabled():
+    return getattr(settings, 'CAPABILITY_ROUTES_CACHE_ENABLED', True)
+
+
+def get_cache():
+    return caches[getattr(settings, 'CAPABILITY_ROUTES_CACHE_ALIAS', 'default')]
+
+
+def check_interval():
+    return getattr(settings, 'CAPABILITY_ROUTES_CHECK_INTERVAL', 30)
+
+
+class PathMatcher(object):
+    """
+    Full match of a request path against a set of protected paths.
+    """
+
+    def __init__(self, paths):
+        alternatives = []
+        separate = []
+        for path in sorted(set(paths)):
+            try:
+                pattern = re.compile(path)
+            except re.error as e:
+                # Protects nothing, rather than being read as a literal path
+                logger.error("Invalid protected path %r rejected: %s" % (path, e))
+                continue
+            if pattern.groups:
+                # Group numbers and names would clash within an alternation
+                separate.append(pattern)
+            else:
+                alternatives.append("(?:%s)" % path)
+            if pattern.fullmatch(path) is None:
+                alternatives.append(re.escape(path))
+
+        self.patterns = separate
+        if alternatives:
+            self.patterns.insert(0, re.compile("|".join(alternatives)))
+
+    def match(self, path):
+        for pattern in self.patterns:
+            if pattern.fullmatch(path) is not None:
+                return True
+        return False
+
+
+class Routes(object):
+    """
+    The protected paths of every scope and method, as loaded at a version.
+    """
+
+    def __init__(self, version, paths):
+        self.version = version
+        # scope -> method -> [path]
+        self.paths = paths
+        # (scopes, method) -> PathMatcher
+        self.matchers = {}
+
+    @classmethod
+    def load(cls, version):
+        paths = {}
+        rows = ProtectedCapability.objects.values_list('slug', 'protected_resources')
+        for slug, protected_resources in rows:
+            try:
+                resources = json.loads(protected_resources)
+            except ValueError as e:
+                logger.warning("Invalid protected resources of scope %s: %s" % (slug, e))
+                continue
+            methods = paths.setdefault(slug, {})
+            for method, path in resources:
+                methods.setdefault(method, []).append(path)
+        return cls(version, paths)
+
+    def matcher(self, scopes, method):
+        key = (scopes, method)
+        matcher = self.matchers.get(key)
+        if matcher is None:
+            paths = []
+            for scope in scopes.split():
+                paths.extend(self.paths.get(scope, {}).get(method, ()))
+            matcher = PathMatcher(paths)
+            if len(self.matchers) >= MAX_MATCHERS:
+                self.matchers = {}
+            self.matchers[key] = matcher
+        return matcher
+
+
+class RouteTable(object):
+    """
+    Thread safe per-process Routes, rebuilt when their version changes.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._routes = None
+        self._checked_at = None
+        self._counters = {"builds": 0, "checks": 0}
+
+    def _shared_version(self):
+        try:
+            return get_cache().get(VERSION_KEY)
+        except Exception as e:
+            logger.warning("Failed to read the capability routes version: %r" % e)
+            return None
+
+    def routes(self):
+        routes = self._routes
+        now = self.clock()
+        if routes is not None and now - self._checked_at < check_interval():
+            return routes
+
+        with self._lock:
+            routes = self._routes
+            if routes is not None and now - self._checked_at < check_interval():
+                return routes
+            # Read before the rows, a change made while loading is seen next time
+            version = self._shared_version()
+            if routes is None or routes.version != version:
+                routes = Routes.load(version)
+                self._routes = routes
+                self._counters["builds"] += 1
+            self._counters["checks"] += 1
+            self._checked_at = now
+            return routes
+
+    def build(self):
+        """
+        Load the table now, e.g. when a worker warms up. Return the number of scopes.
+        """
+        return len(self.routes().paths)
+
+    def allows(self, scopes, method, path):
+        return self.routes().matcher(scopes, method).match(path)
+
+    def _forget(self):
+        with self._lock:
+            self._routes = None
+        try:
+            get_cache().set(VERSION_KEY, uuid.uuid4().hex, None)
+        except Exception as e:
+            logger.error("Failed to publish the capability routes version: %r" % e)
+
+    def invalidate(self):
+        """
+        Drop the table now and once the current transaction commits.
+        """
+        self._forget()
+        transaction.on_commit(self._forget)
+
+    def stats(self):
+        with self._lock:
+            routes = self._routes
+            return dict(self._counters,
+                        version=routes.version if routes is not None else None,
+                        scopes=len(routes.paths) if routes is not None else 0,
+                        matchers=len(routes.matchers) if routes is not None else 0,
+                        check_interval=check_interval(),
+                        enabled=is_enabled())
+
+
+route_table = RouteTable()
@@ -0,0 +1,14 @@
+from django.db.models.signals import (
+    post_delete,
+    post_save,
+)
+
+from .routes import route_table
+
+
+def rebuild_capability_routes(sender, **kwargs):
+    route_table.invalidate()
+
+
+post_save.connect(rebuild_capability_routes, sender='capabilities.ProtectedCapability')
+post_delete.connect(rebuild_capability_routes, sender='capabilities.ProtectedCapability')
@@ -1,12 +1,15 @@
 import json
 
 from django.contrib.auth.models import Group
-from django.test import TestCase
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
 from waffle.testutils import override_switch
 
 from apps.capabilities.permissions import BBCapabilitiesPermissionTokenScopeMissingException
+from apps.fhir.server.tests.test_breaker import FakeClock
 from .models import ProtectedCapability
 from .permissions import TokenHasProtectedCapability
+from .routes import PathMatcher, route_table, RouteTable, VERSION_KEY
 
 
 class SimpleToken(object):
@@ -124,3 +127,81 @@ class TestTokenHasProtectedCapabilityScopesSwitchFalse(TestCase):
         perm = TokenHasProtectedCapability()
         # Note that this is allowed with the scopes switch False/Off
         self.assertTrue(perm.has_permission(request, None))
+
+
+@override_settings(CAPABILITY_ROUTES_CACHE_ENABLED=True)
+class TestTokenHasProtectedCapabilityCompiledRoutes(TestTokenHasProtectedCapabilityScopesSwitchTrue):
+    def setUp(self):
+        caches['default'].clear()
+        super().setUp()
+
+    def test_saved_capability_rebuilds(self):
+        request = SimpleRequest("unused")
+        request.method = "POST"
+        request.path = "/other"
+
+        perm = TokenHasProtectedCapability()
+        self.assertFalse(perm.has_permission(request, None))
+        capability = ProtectedCapability.objects.get(slug="unused")
+        capability.protected_resources = json.dumps([["POST", "/other"]])
+        capability.save()
+        self.assertTrue(perm.has_permission(request, None))
+
+
+class TestPathMatcher(SimpleTestCase):
+    def test_regular_expressions(self):
+        matcher = PathMatcher([r"/v1/fhir/Patient/[\-0-9]+", "/v1/fhir/Patient/?", "/v1/connect/userinfo"])
+        self.assertTrue(matcher.match("/v1/fhir/Patient/-20140000008325"))
+        self.assertTrue(matcher.match("/v1/fhir/Patient"))
+        self.assertTrue(matcher.match("/v1/connect/userinfo"))
+        self.assertFalse(matcher.match("/v1/fhir/Patient/-20140000008325/x"))
+        self.assertEqual(len(matcher.patterns), 1)
+
+    def test_equal_paths_always_match(self):
+        matcher = PathMatcher(["/path?x=1"])
+        self.assertTrue(matcher.match("/path?x=1"))
+
+    def test_invalid_paths_rejected(self):
+        with self.assertLogs('hhs_server.apps.capabilities.routes', 'ERROR'):
+            matcher = PathMatcher(["/broken[", "/path"])
+        self.assertFalse(matcher.match("/broken["))
+        self.assertTrue(matcher.match("/path"))
+
+    def test_groups_kept_apart(self):
+        matcher = PathMatcher([r"/(?P<id>a)/(?P=id)", r"/(?P<id>b)/(?P=id)"])
+        self.assertTrue(matcher.match("/b/b"))
+        self.assertFalse(matcher.match("/a/b"))
+
+
+@override_settings(CAPABILITY_ROUTES_CACHE_ENABLED=True, CAPABILITY_ROUTES_CHECK_INTERVAL=30)
+class TestRouteTable(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.group = Group.objects.create(name="test")
+        ProtectedCapability.objects.create(title="a", slug="a", group=self.group,
+                                           protected_resources=json.dumps([["GET", "/a"]]))
+        self.clock = FakeClock()
+        self.table = RouteTable(clock=self.clock)
+
+    def test_single_query(self):
+        self.assertEqual(self.table.build(), 1)
+        with self.assertNumQueries(0):
+            self.assertTrue(self.table.allows("a b", "GET", "/a"))
+            self.assertFalse(self.table.allows("a b", "POST", "/a"))
+            self.assertFalse(self.table.allows("b", "GET", "/a"))
+
+    def test_changed_by_another_process(self):
+        self.assertFalse(self.table.allows("b", "GET", "/b"))
+        # Saved elsewhere, only the shared version is bumped for this table
+        ProtectedCapability.objects.create(title="b", slug="b", group=self.group,
+                                           protected_resources=json.dumps([["GET", "/b"]]))
+        self.assertIsNotNone(caches['default'].get(VERSION_KEY))
+        self.assertFalse(self.table.allows("b", "GET", "/b"))
+        self.clock.now += 30
+        self.assertTrue(self.table.allows("b", "GET", "/b"))
+        self.assertEqual(self.table.stats()['builds'], 2)
+
+    def test_module_table_invalidated(self):
+        route_table.build()
+        ProtectedCapability.objects.filter(slug="a").delete()
+        self.assertEqual(route_table.build(), 0)
@@ -0,0 +1,124 @@
+"""
+Write-behind of the Application first_active and last_active times.
+
+Every authenticated FHIR call marks its application active. Instead of
+saving the application row on each call, the earliest and latest call
+times per application are kept in memory and written by a timer
+APPLICATION_ACTIVITY_FLUSH_INTERVAL seconds after the first call not yet
+written, with one UPDATE per application:
+
+UPDATE ... SET last_active = GREATEST(COALESCE(last_active, %s), %s),
+               first_active = COALESCE(first_active, %s)
+
+so the metrics views are at most the flush interval behind, and workers
+writing the same row never move last_active back. The pending times are
+also written at exit. With an interval of 0 every call is written
+immediately.
+"""
+import atexit
+import logging
+import os
+import threading
+
+from django.db import connections
+from django.db.models import DateTimeField, F, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.conf import settings
+from django.utils import timezone
+from oauth2_provider.models import get_application_model
+
+logger = logging.getLogger('hhs_server.%s' % __name__)
+
+
+class ApplicationActivity(object):
+    """
+    Thread safe pending activity times of the applications served by a process.
+    """
+
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        # application id -> [first, last]
+        self._pending = {}
+        self._timer = None
+        self._pid = os.getpid()
+        self._counters = {"calls": 0, "flushes": 0, "updates": 0, "failures": 0}
+
+    def record(self, application_id, when=None):
+        when = when or timezone.now()
+        with self._lock:
+            self._counters["calls"] += 1
+        if not self.flush_interval:
+            self._write({application_id: [when, when]})
+            return
+
+        with self._lock:
+            if self._pid != os.getpid():
+                # The parent process writes its own times
+                self._pending = {}
+                self._timer = None
+                self._pid = os.getpid()
+            times = self._pending.get(application_id)
+            if times is None:
+                self._pending[application_id] = [when, when]
+            elif when > times[1]:
+                times[1] = when
+            schedule = self._timer is None
+            if schedule:
+                self._timer = threading.Timer(self.flush_interval, self._flush_in_background)
+                self._timer.daemon = True
+        if schedule:
+            self._timer.start()
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        finally:
+            # The timer thread has its own database connection
+            connections.close_all()
+
+    def flush(self):
+        with self._lock:
+            pending = self._pending
+            timer = self._timer
+            self._pending = {}
+            self._timer = None
+        if timer is not None and timer is not threading.current_thread():
+            # Flushed before the timer, e.g. at exit
+            timer.cancel()
+        if pending and not self._write(pending):
+            # Kept for the next flush, writing a time twice is harmless
+            with self._lock:
+                for application_id, (first, last) in pending.items():
+                    times = self._pending.setdefault(application_id, [first, last])
+                    times[0] = min(times[0], first)
+                    times[1] = max(times[1], last)
+
+    def _write(self, pending):
+        Application = get_application_model()
+        updates = 0
+        try:
+            for application_id, (first, last) in pending.items():
+                first = Value(first, output_field=DateTimeField())
+                last = Value(last, output_field=DateTimeField())
+                updates += Application.objects.filter(pk=application_id).update(
+                    last_active=Greatest(Coalesce(F('last_active'), last), last),
+                    first_active=Coalesce(F('first_active'), first))
+        except Exception as e:
+            logger.warning("Failed to write the activity of %d applications: %r" % (len(pending), e))
+            with self._lock:
+                self._counters["failures"] += 1
+            return False
+        with self._lock:
+            self._counters["flushes"] += 1
+            self._counters["updates"] += updates
+        return True
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, pending=len(self._pending), flush_interval=self.flush_interval)
+
+
+application_activity = ApplicationActivity(getattr(settings, 'APPLICATION_ACTIVITY_FLUSH_INTERVAL', 10))
+
+atexit.register(application_activity.flush)
@@ -1,14 +1,18 @@
 import logging
+from django.contrib.auth import get_user_model
 from django.dispatch import Signal
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from oauth2_provider.models import get_application_model, get_access_token_model
 from libs.mail import Mailer
+from . import token_cache
+from .admin import MyAccessToken
 from .models import ArchivedToken
 from libs.decorators import waffle_function_switch
 
 
 Application = get_application_model()
 Token = get_access_token_model()
+User = get_user_model()
 
 logger = logging.getLogger('hhs_server.%s' % __name__)
 
@@ -66,5 +70,26 @@ def outreach_first_api_call(sender, instance=None, **kwargs):
                      (instance.application.user.username, instance.application.user.email))
 
 
+def invalidate_cached_token(sender, instance=None, **kwargs):
+    token_cache.invalidate([instance.token])
+
+
+def invalidate_cached_application_tokens(sender, instance=None, created=False, **kwargs):
+    # e.g. deactivated or renamed
+    if not created:
+        token_cache.invalidate_application(instance.pk)
+
+
+def invalidate_cached_user_tokens(sender, instance=None, created=False, update_fields=None, **kwargs):
+    # e.g. deactivated, last_login updates leave is_active alone
+    if not created and (update_fields is None or 'is_active' in update_fields):
+        token_cache.invalidate_user(instance.pk)
+
+
 post_save.connect(outreach_first_application, sender=Application)
 pre_save.connect(outreach_first_api_call, sender=Token)
+post_save.connect(invalidate_cached_token, sender=Token)
+post_delete.connect(invalidate_cached_token, sender=Token)
+post_delete.connect(invalidate_cached_token, sender=MyAccessToken)
+post_save.connect(invalidate_cached_application_tokens, sender=Application)
+post_save.connect(invalidate_cached_user_tokens, sender=User)
@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+from django.utils import timezone
+
+from apps.test import BaseApiTest
+from ..activity import ApplicationActivity
+
+
+class TestApplicationActivity(BaseApiTest):
+
+    def setUp(self):
+        self.application = self._create_application('an app')
+        self.now = timezone.now()
+
+    def refresh(self):
+        self.application.refresh_from_db()
+        return self.application.first_active, self.application.last_active
+
+    def test_batched(self):
+        activity = ApplicationActivity(flush_interval=3600)
+        activity.record(self.application.pk, self.now)
+        activity.record(self.application.pk, self.now + timedelta(seconds=5))
+        activity.record(self.application.pk, self.now + timedelta(seconds=2))
+        self.assertEqual(self.refresh(), (None, None))
+        self.assertEqual(activity.stats()['pending'], 1)
+
+        activity.flush()
+        self.assertEqual(self.refresh(), (self.now, self.now + timedelta(seconds=5)))
+        self.assertEqual(activity.stats()['updates'], 1)
+
+    def test_times_never_move_back(self):
+        activity = ApplicationActivity(flush_interval=0)
+        activity.record(self.application.pk, self.now)
+        # e.g. written late by another worker
+        activity.record(self.application.pk, self.now - timedelta(seconds=30))
+        self.assertEqual(self.refresh(), (self.now, self.now))
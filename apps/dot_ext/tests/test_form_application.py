@@ -1,5 +1,9 @@
+import shutil
+import tempfile
+
 from django.conf import settings
 from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.test import override_settings
 
 from PIL import Image
 from io import BytesIO
@@ -205,6 +209,13 @@ class TestRegisterApplicationForm(BaseApiTest):
         """
         regression test: BB2-66: Fix-logo-display-in-Published-Applications-API
         """
+        # Uploaded logos go to a temporary MEDIA_ROOT, removed afterwards
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media_root_settings = override_settings(MEDIA_ROOT=media_root)
+        media_root_settings.enable()
+        self.addCleanup(media_root_settings.disable)
+
         greetings_group = self._create_group('Greetings')
         # create user and add it to the read group
         user = self._create_user('hello.world', '123hello456')
@@ -0,0 +1,82 @@
+import json
+
+from django.core.cache import caches
+from django.db import connection
+from django.test import override_settings
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from httmock import all_requests, HTTMock
+from oauth2_provider.models import get_access_token_model
+
+from apps.authorization.models import DataAccessGrant
+from apps.test import BaseApiTest
+from .. import token_cache
+
+AccessToken = get_access_token_model()
+
+FHIR_ID = '-20140000008325'
+
+
+@override_settings(TOKEN_CACHE_ENABLED=True)
+class TestTokenCache(BaseApiTest):
+
+    def setUp(self):
+        self.read_capability = self._create_capability('Read', [])
+        self.write_capability = self._create_capability('Write', [])
+        self.client = Client()
+        caches['default'].clear()
+        self.token = self.create_token('John', 'Smith')
+
+    def _read_patient(self):
+        @all_requests
+        def catchall(url, req):
+            return {'status_code': 200, 'content': json.dumps({'resourceType': 'Patient', 'id': FHIR_ID})}
+
+        with HTTMock(catchall):
+            return self.client.get(
+                reverse('bb_oauth_fhir_patient_read_or_update_or_delete', kwargs={'resource_id': FHIR_ID}),
+                Authorization="Bearer %s" % self.token)
+
+    def test_hit_resolves_without_token_queries(self):
+        self.assertEqual(self._read_patient().status_code, 200)
+        snapshot = token_cache.lookup(self.token)
+        self.assertEqual(snapshot.fhir_id, FHIR_ID)
+        self.assertEqual(snapshot.application_id, AccessToken.objects.get(token=self.token).application_id)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self._read_patient().status_code, 200)
+        tables = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('oauth2_provider_accesstoken', tables)
+        self.assertNotIn('bluebutton_crosswalk', tables)
+
+    def test_revoke_invalidates(self):
+        self._read_patient()
+        self.assertIsNotNone(token_cache.lookup(self.token))
+        AccessToken.objects.get(token=self.token).revoke()
+        self.assertIsNone(token_cache.lookup(self.token))
+        self.assertEqual(self._read_patient().status_code, 401)
+
+    def test_application_deactivation_invalidates(self):
+        self._read_patient()
+        self.assertIsNotNone(token_cache.lookup(self.token))
+        application = AccessToken.objects.get(token=self.token).application
+        application.active = False
+        application.save()
+        self.assertIsNone(token_cache.lookup(self.token))
+        self.assertEqual(self._read_patient().status_code, 403)
+
+    def test_grant_deletion_invalidates(self):
+        self._read_patient()
+        self.assertIsNotNone(token_cache.lookup(self.token))
+        access_token = AccessToken.objects.get(token=self.token)
+        DataAccessGrant.objects.get(beneficiary=access_token.user, application=access_token.application).delete()
+        self.assertIsNone(token_cache.lookup(self.token))
+
+    def test_user_deactivation_invalidates(self):
+        self._read_patient()
+        self.assertIsNotNone(token_cache.lookup(self.token))
+        user = AccessToken.objects.get(token=self.token).user
+        user.is_active = False
+        user.save()
+        self.assertIsNone(token_cache.lookup(self.token))
@@ -0,0 +1,182 @@
+"""
+Opt-in cache of resolved bearer tokens for the resource (FHIR) API,
+when TOKEN_CACHE_ENABLED.
+
+Resolving a bearer token loads the AccessToken, its application and
+user, the user crosswalk and the application developer. The values the
+API uses are cached as an immutable TokenSnapshot in the
+TOKEN_CACHE_ALIAS cache, keyed by a SHA-256 of the token, for
+TOKEN_CACHE_TTL seconds at most and never past the token expiry.
+
+On a hit, OAuth2ResourceOwner authenticates the request without a
+database query, with detached model instances built from the snapshot
+(see to_models). Only the snapshot fields are loaded on them, so they
+must not be saved.
+
+The cache entries of a token are removed when it is saved or deleted
+(e.g. revoked), of every token of an application when it is saved (e.g.
+deactivated), of every token of a beneficiary when its is_active flag
+may have changed, and of every token of a beneficiary and application when
+their DataAccessGrant is deleted, see the dot_ext and authorization
+signals. Changes made with QuerySet.update() send no signal, they are
+seen after TOKEN_CACHE_TTL.
+
+With the database cache backend each lookup is still a query, use a
+memory cache (e.g. memcached) for TOKEN_CACHE_ALIAS.
+"""
+import hashlib
+import logging
+
+from collections import namedtuple
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils import timezone
+from oauth2_provider.models import get_access_token_model, get_application_model
+
+from apps.fhir.bluebutton.models import Crosswalk
+
+logger = logging.getLogger('hhs_server.%s' % __name__)
+
+KEY_PREFIX = "token"
+
+TokenSnapshot = namedtuple('TokenSnapshot', [
+    'token_id',
+    'expires',
+    'scope',
+    'application_id',
+    'application_name',
+    'application_active',
+    'require_demographic_scopes',
+    'developer_id',
+    'developer_username',
+    'user_id',
+    'username',
+    'fhir_id',
+])
+
+
+def is_enabled():
+    return getattr(settings, 'TOKEN_CACHE_ENABLED', False)
+
+
+def get_cache():
+    return caches[getattr(settings, 'TOKEN_CACHE_ALIAS', 'default')]
+
+
+def token_key(token):
+    return "%s:%s" % (KEY_PREFIX, hashlib.sha256(str(token).encode('utf-8')).hexdigest())
+
+
+def snapshot_of(access_token, crosswalk):
+    application = access_token.application
+    return TokenSnapshot(
+        token_id=access_token.pk,
+        expires=access_token.expires,
+        scope=access_token.scope,
+        application_id=application.pk,
+        application_name=application.name,
+        application_active=application.active,
+        require_demographic_scopes=application.require_demographic_scopes,
+        developer_id=application.user_id,
+        developer_username=application.user.username,
+        user_id=access_token.user_id,
+        username=access_token.user.username,
+        fhir_id=crosswalk.fhir_id,
+    )
+
+
+def _detached(instance):
+    # Looks loaded from the database, so nothing tries to insert it
+    instance._state.adding = False
+    instance._state.db = 'default'
+    return instance
+
+
+def to_models(snapshot, token):
+    """
+    Return the (user, access_token) of a snapshot, with the application,
+    developer and crosswalk set on them.
+    """
+    User = get_user_model()
+    user = _detached(User(pk=snapshot.user_id, username=snapshot.username))
+    user.crosswalk = _detached(Crosswalk(user=user, _fhir_id=snapshot.fhir_id))
+    developer = _detached(User(pk=snapshot.developer_id, username=snapshot.developer_username))
+    application = _detached(get_application_model()(
+        pk=snapshot.application_id,
+        name=snapshot.application_name,
+        active=snapshot.application_active,
+        require_demographic_scopes=snapshot.require_demographic_scopes,
+        user=developer,
+        # Not generated, they are not used on the resource API
+        client_id='',
+        client_secret=''))
+    access_token = _detached(get_access_token_model()(
+        pk=snapshot.token_id,
+        token=token,
+        expires=snapshot.expires,
+        scope=snapshot.scope,
+        application=application,
+        user=user))
+    return user, access_token
+
+
+def lookup(token):
+    """
+    The TokenSnapshot of an unexpired token, or None.
+    """
+    try:
+        snapshot = get_cache().get(token_key(token))
+    except Exception as e:
+        logger.warning("Failed to read the token cache: %r" % e)
+        return None
+    if snapshot is None or snapshot.expires <= timezone.now():
+        return None
+    return snapshot
+
+
+def store(access_token, crosswalk):
+    ttl = min(getattr(settings, 'TOKEN_CACHE_TTL', 300),
+              int((access_token.expires - timezone.now()).total_seconds()))
+    if ttl <= 0:
+        return
+    try:
+        get_cache().set(token_key(access_token.token), snapshot_of(access_token, crosswalk), ttl)
+    except Exception as e:
+        logger.warning("Failed to write the token cache: %r" % e)
+
+
+def invalidate(tokens):
+    """
+    Remove the cache entries of the token strings.
+    """
+    if not is_enabled():
+        return
+    keys = [token_key(token) for token in tokens]
+    if not keys:
+        return
+    try:
+        get_cache().delete_many(keys)
+    except Exception as e:
+        logger.warning("Failed to invalidate %d token cache entries: %r" % (len(keys), e))
+
+
+def invalidate_user(user_id):
+    """
+    Remove the cache entries of the tokens of a beneficiary.
+    """
+    if not is_enabled():
+        return
+    invalidate(get_access_token_model().objects.filter(user_id=user_id).values_list('token', flat=True))
+
+
+def invalidate_application(application_id, user_id=None):
+    """
+    Remove the cache entries of the tokens of an application, and user when given.
+    """
+    if not is_enabled():
+        return
+    tokens = get_access_token_model().objects.filter(application_id=application_id)
+    if user_id is not None:
+        tokens = tokens.filter(user_id=user_id)
+    invalidate(tokens.values_list('token', flat=True))
@@ -1,6 +1,8 @@
 from django.db import transaction
 from oauth2_provider.models import AccessToken, RefreshToken
+from apps.authorization.grant_index import grant_index
 from apps.authorization.models import DataAccessGrant
+from apps.fhir.bluebutton.cache import purge_user
 from oauth2_provider.models import get_application_model
 from rest_framework.exceptions import PermissionDenied
 from django.contrib.auth import get_user_model
@@ -40,6 +42,12 @@ def remove_application_user_pair_tokens_data_access(application, user):
         # Delete refresh token records
         refresh_token_delete_cnt = RefreshToken.objects.filter(application=application, user=user).delete()[0]
 
+        # Also when there was no grant, a cached one must not outlive the tokens
+        grant_index.invalidate(user.pk, application.pk)
+
+    # Demographic data the beneficiary no longer shares must not be served from cache
+    purge_user(user)
+
     return data_access_grant_delete_cnt, access_token_delete_cnt, refresh_token_delete_cnt
 
 
@@ -1,4 +1,4 @@
-from apps.fhir.bluebutton.models import Crosswalk
+from apps.fhir.bluebutton.models import Crosswalk, ExportJob
 from django.contrib import admin
 
 
@@ -15,3 +15,20 @@ class CrosswalkAdmin(admin.ModelAdmin):
 
 
 admin.site.register(Crosswalk, CrosswalkAdmin)
+
+
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'get_user_username', 'application', 'status', 'transaction_time', 'completed_at')
+    list_filter = ('status', )
+    search_fields = ('user__username', 'fhir_id')
+    raw_id_fields = ("user", "application")
+    readonly_fields = ('checkpoint', 'error', 'transaction_time', 'updated_at', 'completed_at')
+
+    def get_user_username(self, obj):
+        return obj.user.username
+
+    get_user_username.admin_order_field = "user__username"
+    get_user_username.short_description = "User Name"
+
+
+admin.site.register(ExportJob, ExportJobAdmin)
@@ -1,10 +1,19 @@
 from oauth2_provider.contrib.rest_framework import authentication
-from django.utils import timezone
+
+from apps.dot_ext import token_cache
+from apps.dot_ext.activity import application_activity
+from .identity import Identity, set_identity
+from .utils import get_access_token_from_request
 
 
 class OAuth2ResourceOwner(authentication.OAuth2Authentication):
     def authenticate(self, request):
-        user_auth_tuple = super(OAuth2ResourceOwner, self).authenticate(request)
+        token = (get_access_token_from_request(request) or None) if token_cache.is_enabled() else None
+        snapshot = token_cache.lookup(token) if token else None
+        if snapshot is not None:
+            user_auth_tuple = token_cache.to_models(snapshot, token)
+        else:
+            user_auth_tuple = super(OAuth2ResourceOwner, self).authenticate(request)
 
         # fix until https://github.com/jazzband/django-oauth-toolkit/commit/f86dfb8a7f20065850fe3b3629e18723658f835d is stable
         if not hasattr(request, 'oauth2_error'):
@@ -16,12 +25,13 @@ class OAuth2ResourceOwner(authentication.OAuth2Authentication):
             if not hasattr(user, 'crosswalk'):
                 return None
             request.crosswalk = user.crosswalk
+            set_identity(request, Identity(access_token, user.crosswalk))
+
+            if token and snapshot is None:
+                token_cache.store(access_token, user.crosswalk)
 
-            # Update Application activity metric datetime fields
-            access_token.application.last_active = timezone.now()
-            if access_token.application.first_active is None:
-                access_token.application.first_active = access_token.application.last_active
-            access_token.application.save()
+            # Update Application activity metric datetime fields, written in batches
+            application_activity.record(access_token.application_id)
 
             return user, access_token
         return None
@@ -0,0 +1,228 @@
+"""
+Backend FHIR call latency and response size histograms.
+
+With FHIR_BACKEND_METRICS_ENABLED, every post_fetch of FhirDataView is
+observed into fixed bucket histograms labeled by resource type,
+interaction (read or search), application id and HTTP status. Observing
+is a bisect and a few additions under a lock, the cache is never written
+from the request thread.
+
+A background thread of each worker process writes its cumulative
+snapshot to the FHIR_BACKEND_METRICS_CACHE_ALIAS cache every
+FHIR_BACKEND_METRICS_FLUSH_INTERVAL seconds. A worker registers its
+snapshot key in one of WORKER_SLOTS slot keys, taken with the atomic
+cache add, so no shared list is read and written back. Snapshots and
+slots expire FHIR_BACKEND_METRICS_TTL seconds after the last write, so
+stopped workers drop out. aggregate() merges the snapshots of all
+workers.
+
+Off by default. Flushes are cache writes every interval from every
+worker, use a memory cache (e.g. memcached) for
+FHIR_BACKEND_METRICS_CACHE_ALIAS rather than the database cache.
+"""
+import bisect
+import logging
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+from apps.fhir.server.client import resource_type_of
+
+logger = logging.getLogger('hhs_server.%s' % __name__)
+
+KEY_PREFIX = "fhir_backend_metrics"
+# Most worker processes seen within FHIR_BACKEND_METRICS_TTL, restarts included
+WORKER_SLOTS = 1024
+
+# Upper bounds, the last bucket counts everything above the last bound
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024)
+
+LABELS = ("resource_type", "interaction", "application_id", "status")
+
+
+def is_enabled():
+    return getattr(settings, 'FHIR_BACKEND_METRICS_ENABLED', False)
+
+
+def get_cache():
+    return caches[getattr(settings, 'FHIR_BACKEND_METRICS_CACHE_ALIAS', 'default')]
+
+
+def slot_key(number):
+    return "%s:slot:%d" % (KEY_PREFIX, number)
+
+
+def interaction_of(url, resource_type):
+    """
+    read for a backend URL with a resource id after the resource type, else search.
+    """
+    path = url.split('?', 1)[0]
+    _, found, rest = path.partition('/%s/' % resource_type)
+    return 'read' if found and rest.strip('/') else 'search'
+
+
+class Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def to_dict(self):
+        return {"counts": list(self.counts), "sum": self.sum}
+
+
+class Series(object):
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.size = Histogram(SIZE_BUCKETS)
+
+    def to_dict(self):
+        return {"latency": self.latency.to_dict(), "size": self.size.to_dict()}
+
+
+class MetricsRegistry(object):
+    """
+    Thread safe histograms of a worker process, by label values.
+    """
+
+    def __init__(self, flush_interval=10, ttl=24 * 60 * 60):
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._series = {}
+        self._slot = None
+        self._pid = None
+
+    def observe(self, labels, latency, size):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Counts of the parent process are not this worker's, nor is its flush thread
+                self._series = {}
+                self._slot = None
+                self._pid = os.getpid()
+                threading.Thread(target=self._flush_forever, name='backend-metrics-flush',
+                                 daemon=True).start()
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = Series()
+            series.latency.observe(latency)
+            series.size.observe(size)
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+            # The connection of a database cache would stay open between flushes
+            connections.close_all()
+
+    def observe_response(self, response):
+        """
+        Observe a backend response sent with post_fetch.
+        """
+        request = response.request
+        resource_type = resource_type_of(request.url)
+        labels = (resource_type,
+                  interaction_of(request.url, resource_type),
+                  request.headers.get('BlueButton-ApplicationId') or '',
+                  str(response.status_code))
+        # Streamed responses record the size forwarded, their content is not kept
+        size = getattr(response, 'streamed_size', None)
+        if size is None:
+            size = len(response.content)
+        self.observe(labels, response.elapsed.total_seconds(), size)
+
+    def snapshot(self):
+        with self._lock:
+            return [{"labels": list(labels), **series.to_dict()} for labels, series in self._series.items()]
+
+    def worker_key(self):
+        return "%s:%s:%s" % (KEY_PREFIX, socket.gethostname(), os.getpid())
+
+    def flush(self):
+        cache = get_cache()
+        key = self.worker_key()
+        try:
+            cache.set(key, {"series": self.snapshot(), "updated": time.time()}, self.ttl)
+            self.register(cache, key)
+        except Exception as e:
+            logger.warning("Failed to write the backend metrics to the cache: %r" % e)
+
+    def register(self, cache, key):
+        """
+        Keep the slot holding the snapshot key of this worker, or take a
+        free one. Slots are only taken with add, never overwritten.
+        """
+        if self._slot is not None and cache.get(slot_key(self._slot)) == key:
+            cache.touch(slot_key(self._slot), self.ttl)
+            return
+        for number in range(WORKER_SLOTS):
+            if cache.add(slot_key(number), key, self.ttl):
+                self._slot = number
+                return
+        logger.warning("No free backend metrics slot, %s is not aggregated" % key)
+
+    def clear(self):
+        with self._lock:
+            self._series = {}
+
+
+def merge(snapshots):
+    """
+    Sum of worker snapshots, by label values.
+    """
+    merged = {}
+    for snapshot in snapshots:
+        for series in snapshot["series"]:
+            labels = tuple(series["labels"])
+            total = merged.setdefault(labels, {
+                "latency": {"counts": [0] * (len(LATENCY_BUCKETS) + 1), "sum": 0},
+                "size": {"counts": [0] * (len(SIZE_BUCKETS) + 1), "sum": 0},
+            })
+            for name in ("latency", "size"):
+                total[name]["counts"] = [a + b for a, b in zip(total[name]["counts"], series[name]["counts"])]
+                total[name]["sum"] += series[name]["sum"]
+    return merged
+
+
+def aggregate():
+    """
+    Histograms of all workers that wrote a snapshot recently.
+    """
+    registry.flush()
+    cache = get_cache()
+    workers = set(cache.get_many([slot_key(number) for number in range(WORKER_SLOTS)]).values())
+    snapshots = list(cache.get_many(workers).values())
+    result = []
+    for labels, histograms in sorted(merge(snapshots).items()):
+        count = sum(histograms["latency"]["counts"])
+        result.append({
+            **dict(zip(LABELS, labels)),
+            "count": count,
+            "latency_avg_ms": round(histograms["latency"]["sum"] * 1000 / count, 3) if count else 0.0,
+            "latency_buckets": histograms["latency"]["counts"],
+            "size_avg": round(histograms["size"]["sum"] / count) if count else 0,
+            "size_total": histograms["size"]["sum"],
+            "size_buckets": histograms["size"]["counts"],
+        })
+    return {
+        "workers": len(snapshots),
+        "latency_bounds": list(LATENCY_BUCKETS),
+        "size_bounds": list(SIZE_BUCKETS),
+        "series": result,
+    }
+
+
+registry = MetricsRegistry(flush_interval=getattr(settings, 'FHIR_BACKEND_METRICS_FLUSH_INTERVAL', 10),
+                           ttl=getattr(settings, 'FHIR_BACKEND_METRICS_TTL', 24 * 60 * 60))
@@ -0,0 +1,149 @@
+"""
+Opt-in cache of FHIR responses per beneficiary.
+
+Entries hold the post-permission out_data of FhirDataView.fetch_data, keyed on
+the beneficiary fhir_id, the backend URL relative to its endpoint (resource
+type and id, so every endpoint shares the entries) and the normalized backend
+query parameters. Every key also contains a per-beneficiary
+generation token, so deleting the token purges all of that beneficiary's
+entries at once on any cache backend.
+
+FHIR_RESPONSE_CACHE_ALIAS must name a cache shared by all workers (e.g. the
+database or memcached cache) for purges to reach every worker.
+"""
+import hashlib
+import json
+import logging
+import threading
+import uuid
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from apps.fhir.server.router import load_balancer
+from .search_parameters import canonical_query
+
+logger = logging.getLogger('hhs_server.%s' % __name__)
+
+KEY_PREFIX = "fhir_response"
+GENERATION_PREFIX = "fhir_response_gen"
+
+# Former name of canonical_query
+normalize_query = canonical_query
+
+
+class CacheStats(object):
+    """
+    Per process hit, miss and byte counters by resource type.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(lambda: {"hits": 0, "misses": 0, "hit_bytes": 0, "stored_bytes": 0})
+
+    def record(self, resource_type, hit=False, miss=False, hit_bytes=0, stored_bytes=0):
+        with self._lock:
+            counters = self._counters[resource_type]
+            counters["hits"] += int(hit)
+            counters["misses"] += int(miss)
+            counters["hit_bytes"] += hit_bytes
+            counters["stored_bytes"] += stored_bytes
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for resource_type, counters in self._counters.items():
+                lookups = counters["hits"] + counters["misses"]
+                result[resource_type] = dict(counters)
+                result[resource_type]["hit_rate"] = round(counters["hits"] / lookups, 4) if lookups else 0.0
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+
+cache_stats = CacheStats()
+
+
+def is_enabled():
+    return getattr(settings, 'FHIR_RESPONSE_CACHE_ENABLED', False)
+
+
+def get_cache():
+    return caches[getattr(settings, 'FHIR_RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def get_ttl(resource_type):
+    return getattr(settings, 'FHIR_RESPONSE_CACHE_TTL', {}).get(resource_type, 0)
+
+
+def _generation_key(fhir_id):
+    return "%s:%s" % (GENERATION_PREFIX, fhir_id)
+
+
+def _generation(cache, fhir_id):
+    key = _generation_key(fhir_id)
+    generation = cache.get(key)
+    if generation is None:
+        generation = uuid.uuid4().hex
+        cache.add(key, generation, None)
+        # Unreadable when not stored (e.g. dummy cache or eviction), the
+        # entries of this request are then not found again
+        generation = cache.get(key) or generation
+    return generation
+
+
+def build_key(cache, fhir_id, url, params):
+    digest = hashlib.sha256("\n".join([
+        _generation(cache, fhir_id),
+        fhir_id,
+        load_balancer.relative_url(url),
+        canonical_query(params),
+    ]).encode('utf-8')).hexdigest()
+    return "%s:%s" % (KEY_PREFIX, digest)
+
+
+def get_response(fhir_id, resource_type, url, params):
+    """
+    Return (cache_key, cached out_data or None).
+    The key is None when the resource type is not cached.
+    """
+    if not is_enabled() or not get_ttl(resource_type):
+        return None, None
+
+    cache = get_cache()
+    key = build_key(cache, fhir_id, url, params)
+    content = cache.get(key)
+    if content is None:
+        cache_stats.record(resource_type, miss=True)
+        return key, None
+
+    cache_stats.record(resource_type, hit=True, hit_bytes=len(content))
+    return key, json.loads(content)
+
+
+def set_response(key, resource_type, out_data):
+    if key is None:
+        return
+    content = json.dumps(out_data)
+    get_cache().set(key, content, get_ttl(resource_type))
+    cache_stats.record(resource_type, stored_bytes=len(content))
+
+
+def purge_beneficiary(fhir_id):
+    """
+    Invalidate every cached response of the beneficiary.
+    """
+    if not fhir_id:
+        return
+    get_cache().delete(_generation_key(fhir_id))
+    logger.debug("Purged FHIR response cache for beneficiary %s" % fhir_id)
+
+
+def purge_user(user):
+    crosswalk = getattr(user, 'crosswalk', None) if user is not None else None
+    if crosswalk is not None:
+        purge_beneficiary(crosswalk.fhir_id)
@@ -0,0 +1,271 @@
+"""
+Precomputed CapabilityStatement for /v1/fhir/metadata.
+
+The backend metadata is fetched, filtered to the supported resource types
+and encoded once per process, then served from those bytes with an ETag
+and a Cache-Control max-age of FHIR_METADATA_MAX_AGE seconds. The oauth
+security element depends on the issuer, so the encoded document is kept
+per issuer.
+
+A request served a copy older than FHIR_METADATA_REFRESH_INTERVAL seconds
+starts a refresh in a background thread. If the refresh fails, the last
+good copy is kept and the refresh is retried after
+FHIR_METADATA_RETRY_INTERVAL seconds. Only the first requests of a
+process, without any copy yet, wait on the backend, for a single fetch:
+one request fetches, the others wait for its copy or its error.
+"""
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.utils.http import quote_etag
+from requests import RequestException
+
+from apps.fhir import fastjson
+from apps.fhir.server import connection as backend_connection
+from apps.fhir.server.client import get_backend_client
+from apps.wellknown.views import base_issuer
+from . import constants
+from .exceptions import UpstreamServerException
+from .utils import FhirServerVerify, get_resourcerouter, build_oauth_resource
+
+logger = logging.getLogger('hhs_server.%s' % __name__)
+
+
+def is_enabled():
+    return getattr(settings, 'FHIR_METADATA_CACHE_ENABLED', True)
+
+
+def max_age():
+    return getattr(settings, 'FHIR_METADATA_MAX_AGE', 300)
+
+
+class MetadataUnavailable(Exception):
+    """
+    The backend metadata could not be fetched and there is no copy.
+    """
+
+    def __init__(self, status_code, content):
+        super().__init__(status_code)
+        self.status_code = status_code
+        self.content = content
+
+
+def conformance_filter(text_block):
+    """ Filter FHIR Conformance Statement based on
+        supported ResourceTypes
+    """
+
+    resource_names = constants.ALLOWED_RESOURCE_TYPES
+    ct = 0
+    if text_block:
+        if 'rest' in text_block:
+            for k in text_block['rest']:
+                for i, v in k.items():
+                    if i == 'resource':
+                        supp_resources = get_supported_resources(v, resource_names)
+                        text_block['rest'][ct]['resource'] = supp_resources
+                ct += 1
+        else:
+            text_block = ""
+    else:
+        text_block = ""
+
+    return text_block
+
+
+def get_supported_resources(resources, resource_names):
+    """ Filter resources for resource type matches """
+
+    resource_list = []
+
+    # if resource 'type in resource_names add resource to resource_list
+    for item in resources:
+        for k, v in item.items():
+            if k == 'type':
+                if v in resource_names:
+                    item['interaction'] = [{"code": "read"}, {"code": "search-type"}]
+                    resource_list.append(item)
+
+    return resource_list
+
+
+def fetch_statement():
+    """
+    Fetch and filter the backend CapabilityStatement.
+    """
+    resource_router = get_resourcerouter()
+    call_to = resource_router.fhir_url
+    if call_to.endswith('/'):
+        call_to += 'metadata'
+    else:
+        call_to += '/metadata'
+
+    try:
+        r = get_backend_client().get(call_to,
+                                     params={'_format': 'json'},
+                                     cert=backend_connection.certs(url=call_to),
+                                     timeout=resource_router.wait_time,
+                                     verify=FhirServerVerify(url=call_to))
+    except (RequestException, UpstreamServerException) as e:
+        logger.warning("Failed to fetch the backend metadata: %r" % e)
+        raise MetadataUnavailable(502, fastjson.dumps({'detail': 'An error occurred contacting the upstream server'}))
+
+    if r.status_code >= 300:
+        logger.warning("Failed to fetch the backend metadata: status %s" % r.status_code)
+        raise MetadataUnavailable(r.status_code, r.content)
+
+    # Objects keep the backend member order
+    od = conformance_filter(fastjson.loads(r.content))
+    if not od:
+        logger.warning("The backend metadata has no rest element")
+        raise MetadataUnavailable(502, fastjson.dumps({'detail': 'An error occurred contacting the upstream server'}))
+    # Fix format values
+    od['format'] = ['application/json', 'application/fhir+json']
+    return od
+
+
+def encode_statement(statement, security):
+    od = dict(statement)
+    od['rest'] = [dict(rest) for rest in statement['rest']]
+    # Append Security to ConformanceStatement
+    od['rest'][0]['security'] = security
+    content = fastjson.dumps(od)
+    return content, quote_etag(hashlib.sha256(content).hexdigest())
+
+
+class CapabilityStatement(object):
+    """
+    Thread safe copy of the filtered CapabilityStatement of a process.
+    """
+
+    def __init__(self, refresh_interval, retry_interval):
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._statement = None
+        self._documents = {}
+        # Time of the last good copy and of the last refresh attempt
+        self._fetched_at = None
+        self._attempted_at = None
+        self._refreshing = False
+        # Held while fetching, so a process fetches one copy at a time
+        self._fetch_lock = threading.Lock()
+        self._last_error = None
+        self._counters = {"served": 0, "refreshes": 0, "failures": 0}
+
+    def get(self, request):
+        """
+        Return the (content, ETag) of the statement for the issuer of request.
+        """
+        issuer = base_issuer(request)
+        with self._lock:
+            statement = self._statement
+            documents = self._documents
+            self._counters["served"] += 1
+        if statement is None:
+            # No copy yet, this request has to wait on the backend
+            statement, documents = self._fetch_first(time.monotonic())
+        else:
+            self._schedule_refresh()
+
+        document = documents.get(issuer)
+        if document is None:
+            document = encode_statement(statement, build_oauth_resource(request, format_type="json"))
+            with self._lock:
+                # Kept unless a refresh replaced the statement meanwhile
+                if self._statement is statement:
+                    self._documents[issuer] = document
+        return document
+
+    def _schedule_refresh(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._refreshing:
+                return
+            if now - self._fetched_at < self.refresh_interval or now - self._attempted_at < self.retry_interval:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, name='capability-statement-refresh',
+                         daemon=True).start()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except MetadataUnavailable:
+            # Logged in fetch_statement, the last good copy is kept
+            pass
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _fetch_first(self, requested_at):
+        with self._fetch_lock:
+            with self._lock:
+                statement = self._statement
+                documents = self._documents
+                # Failed while this request waited for the fetch
+                failed = self._last_error is not None and self._attempted_at >= requested_at
+            if statement is None:
+                if failed:
+                    raise self._last_error
+                self._refresh()
+                with self._lock:
+                    statement = self._statement
+                    documents = self._documents
+        return statement, documents
+
+    def refresh(self):
+        """
+        Replace the statement with a new backend copy, raises
+        MetadataUnavailable if it can not be fetched and there is no copy.
+        """
+        with self._fetch_lock:
+            self._refresh()
+
+    def _refresh(self):
+        # Called with the fetch lock held
+        with self._lock:
+            self._attempted_at = time.monotonic()
+            self._counters["refreshes"] += 1
+        try:
+            statement = fetch_statement()
+        except MetadataUnavailable as e:
+            with self._lock:
+                self._counters["failures"] += 1
+                self._last_error = e
+                if self._statement is not None:
+                    return
+            raise
+        with self._lock:
+            self._statement = statement
+            self._documents = {}
+            self._fetched_at = time.monotonic()
+            self._last_error = None
+
+    def clear(self):
+        with self._lock:
+            self._statement = None
+            self._documents = {}
+            self._fetched_at = None
+            self._attempted_at = None
+            self._last_error = None
+            for counter in self._counters:
+                self._counters[counter] = 0
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            stats = dict(self._counters)
+            stats["age"] = round(now - self._fetched_at, 3) if self._fetched_at is not None else None
+            stats["issuers"] = len(self._documents)
+            stats["refreshing"] = self._refreshing
+            stats["config"] = {"refresh_interval": self.refresh_interval, "retry_interval": self.retry_interval}
+            return stats
+
+
+capability_statement = CapabilityStatement(
+    refresh_interval=getattr(settings, 'FHIR_METADATA_REFRESH_INTERVAL', 3600),
+    retry_interval=getattr(settings, 'FHIR_METADATA_RETRY_INTERVAL', 30))
@@ -0,0 +1,154 @@
+"""
+Negotiated gzip and brotli compression of FHIR responses.
+
+FhirCompressionMiddleware compresses responses under FHIR_COMPRESSION_PATHS
+with the encoding the client prefers in Accept-Encoding. Brotli is offered
+only when the brotli package is installed. Buffered bodies smaller than
+FHIR_COMPRESSION_MIN_SIZE bytes are sent as they are, streamed bodies (see
+apps.fhir.bluebutton.streaming) are compressed chunk by chunk and flushed
+after each chunk, so the client still gets entries as they arrive.
+
+Strong ETags are made weak, as with Django's GZipMiddleware, since the
+encoded bytes differ from the body the ETag was computed over.
+"""
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def is_enabled():
+    return getattr(settings, 'FHIR_COMPRESSION_ENABLED', True)
+
+
+def get_level(encoding):
+    if encoding == 'br':
+        return getattr(settings, 'FHIR_COMPRESSION_BROTLI_LEVEL', 4)
+    return getattr(settings, 'FHIR_COMPRESSION_GZIP_LEVEL', 6)
+
+
+def available_encodings():
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def parse_accept_encoding(header):
+    """
+    Return {coding: q} of an Accept-Encoding header.
+    """
+    codings = {}
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[coding] = q
+    return codings
+
+
+def negotiate_encoding(header):
+    """
+    Return the supported encoding with the highest q value in an
+    Accept-Encoding header, brotli first on a tie, or None.
+    """
+    codings = parse_accept_encoding(header)
+    best, best_q = None, 0.0
+    for encoding in available_encodings():
+        q = codings.get(encoding, codings.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class Compressor(object):
+    """
+    Incremental compressor of one response body.
+    """
+
+    def __init__(self, encoding, level):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=level)
+        else:
+            # wbits 31 writes the gzip header and trailer, with mtime 0
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def flush(self):
+        # Emit everything compressed so far without ending the stream
+        if self.encoding == 'br':
+            return self._compressor.flush()
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def compress(encoding, level, content):
+    compressor = Compressor(encoding, level)
+    return compressor.compress(content) + compressor.finish()
+
+
+def compress_stream(encoding, level, chunks):
+    compressor = Compressor(encoding, level)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class FhirCompressionMiddleware(MiddlewareMixin):
+
+    def process_response(self, request, response):
+        if not is_enabled():
+            return response
+        if not any(request.path.startswith(path) for path in getattr(settings, 'FHIR_COMPRESSION_PATHS', [])):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        if response.has_header('Content-Encoding') or response.status_code in (204, 304):
+            return response
+        if not response.streaming and len(response.content) < getattr(settings, 'FHIR_COMPRESSION_MIN_SIZE', 1024):
+            return response
+
+        encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+        level = get_level(encoding)
+
+        if response.streaming:
+            response.streaming_content = compress_stream(encoding, level, response.streaming_content)
+            del response['Content-Length']
+        else:
+            compressed = compress(encoding, level, response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,85 @@
+"""
+ETag and conditional GET support for FhirDataView responses.
+
+The ETag is a SHA-256 over the beneficiary fhir_id, the media type and the
+rendered response body, so it is the same for an identical body whether it
+came from the backend, the response cache or a prefetch, and never matches
+a body served to another beneficiary. Streamed responses are not rendered
+here, they carry the backend ETag, when BFD sends one, scoped the same way.
+
+If-None-Match and If-Modified-Since are checked with Django's
+get_conditional_response, a match returns 304 Not Modified without a body.
+"""
+import hashlib
+import threading
+
+from collections import defaultdict
+from django.conf import settings
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe, quote_etag
+
+
+class ConditionalStats(object):
+    """
+    Per process response and 304 Not Modified counters by resource type.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(lambda: {"responses": 0, "conditional": 0, "not_modified": 0})
+
+    def record(self, resource_type, conditional=False, not_modified=False):
+        with self._lock:
+            counters = self._counters[resource_type]
+            counters["responses"] += 1
+            counters["conditional"] += int(conditional)
+            counters["not_modified"] += int(not_modified)
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for resource_type, counters in self._counters.items():
+                result[resource_type] = dict(counters)
+                result[resource_type]["not_modified_rate"] = (
+                    round(counters["not_modified"] / counters["responses"], 4) if counters["responses"] else 0.0)
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+
+conditional_stats = ConditionalStats()
+
+
+def is_enabled():
+    return getattr(settings, 'FHIR_CONDITIONAL_GET_ENABLED', True)
+
+
+def build_etag(fhir_id, media_type, content):
+    """
+    Strong ETag over a response body, or a backend ETag, of a beneficiary.
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    digest = hashlib.sha256()
+    digest.update(("%s\n%s\n" % (fhir_id, media_type)).encode('utf-8'))
+    digest.update(content)
+    return quote_etag(digest.hexdigest())
+
+
+def not_modified_response(request, resource_type, etag, last_modified=None):
+    """
+    Return the 304 (or 412) response when the request validators match
+    the ETag or the HTTP date last_modified, or None.
+    """
+    conditional = 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META
+    response = get_conditional_response(request, etag=etag,
+                                        last_modified=parse_http_date_safe(last_modified) if last_modified else None)
+    not_modified = response is not None and response.status_code == 304
+    conditional_stats.record(resource_type, conditional=conditional, not_modified=not_modified)
+    if not_modified:
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = last_modified
+    return response
@@ -0,0 +1,340 @@
+"""
+FHIR Bulk Data Patient/$export jobs.
+
+The kick-off request (see views.export) saves an ExportJob. A worker then
+pages through the backend searches for the beneficiary, MAX_PAGE_SIZE
+entries at a time, checks every resource against the beneficiary and
+writes them to default_storage as NDJSON files of about
+FHIR_EXPORT_FILE_MAX_RESOURCES resources per resource type, under
+exports/<job id>/.
+
+Jobs run in up to FHIR_EXPORT_MAX_WORKERS threads per process, started
+once the kick-off is committed. With 0 workers, or for jobs left behind
+by a process that went away, the run_export_jobs management command
+picks them up. The checkpoint is saved after each file, so an
+interrupted job resumes from the last file written. Finished jobs and
+their files are removed FHIR_EXPORT_RETENTION seconds after they end by
+the cleanup_export_jobs management command.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.utils import timezone
+from requests import Request, RequestException
+from rest_framework import exceptions
+
+from apps.authorization.models import DataAccessGrant
+from apps.authorization.permissions import PatientReferenceValidator
+from apps.fhir import fastjson
+from apps.fhir.server import connection as backend_connection
+from apps.fhir.server.client import get_backend_client
+from .constants import MAX_PAGE_SIZE
+from .exceptions import UpstreamServerException
+from .models import ExportJob
+from .signals import pre_fetch, post_fetch
+from .utils import FhirServerVerify, get_resourcerouter
+from .views.generic import FhirDataView
+
+logger = logging.getLogger('hhs_server.%s' % __name__)
+
+# Resource types exported, in the order they are written
+EXPORT_RESOURCE_TYPES = ['Patient', 'Coverage', 'ExplanationOfBenefit']
+
+# Backend search parameters selecting the beneficiary, as in the search views
+SEARCH_PARAMETERS = {
+    'Patient': lambda fhir_id: {'_id': fhir_id},
+    'Coverage': lambda fhir_id: {'beneficiary': 'Patient/' + fhir_id},
+    'ExplanationOfBenefit': lambda fhir_id: {'patient': fhir_id},
+}
+
+
+class ExportError(Exception):
+    pass
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def job_headers(job, url, counter):
+    """
+    Backend headers for a job page, the same as
+    backend_connection.headers() sends for a client request.
+    """
+    return {
+        'includeAddressFields': 'False',
+        'BlueButton-OriginalQueryTimestamp': timezone.now().isoformat(),
+        'BlueButton-OriginalQueryId': str(job.id),
+        'BlueButton-OriginalQueryCounter': str(counter),
+        'BlueButton-BeneficiaryId': 'patientId:' + job.fhir_id,
+        'BlueButton-UserId': str(job.user_id),
+        'BlueButton-Application': str(job.application.name),
+        'BlueButton-ApplicationId': str(job.application_id),
+        'BlueButton-DeveloperId': str(job.application.user_id),
+        'keep-alive': settings.REQUEST_EOB_KEEP_ALIVE,
+        'BlueButton-OriginalUrl': job.request_url,
+        'BlueButton-OriginalQuery': '',
+        'BlueButton-BackendCall': url,
+    }
+
+
+def has_next(bundle):
+    return any(link.get('relation') == 'next' for link in bundle.get('link', []))
+
+
+class ExportRunner(object):
+    """
+    Pages the backend searches of an in progress job into NDJSON files.
+    """
+
+    def __init__(self, job, page_size=MAX_PAGE_SIZE):
+        self.job = job
+        self.page_size = page_size
+        self.file_max_resources = getattr(settings, 'FHIR_EXPORT_FILE_MAX_RESOURCES', 1000)
+        self.retries = getattr(settings, 'FHIR_EXPORT_RETRIES', 2)
+        self.checkpoint = job.get_checkpoint()
+        self.validator = PatientReferenceValidator(job.fhir_id)
+        self.client = get_backend_client()
+        self.pages = 0
+
+    def run(self):
+        for resource_type in self.job.get_resource_types():
+            self.export_resource_type(resource_type)
+
+        now = timezone.now()
+        if not ExportJob.objects.filter(pk=self.job.pk, status=ExportJob.IN_PROGRESS).update(
+                status=ExportJob.COMPLETED, checkpoint=json.dumps(self.checkpoint),
+                completed_at=now, updated_at=now):
+            raise ExportCancelled()
+
+    def export_resource_type(self, resource_type):
+        state = self.checkpoint.setdefault(resource_type, {'start_index': 0, 'files': [], 'done': False})
+        start_index = state['start_index']
+        lines = []
+        while not state['done']:
+            self.check_active()
+            bundle = self.fetch_page(resource_type, start_index)
+            entries = bundle.get('entry', [])
+            for entry in entries:
+                resource = entry.get('resource')
+                try:
+                    valid = self.validator.check_resource(resource)
+                except exceptions.NotFound:
+                    raise ExportError("The backend returned a %s resource of another beneficiary" % resource_type)
+                if not valid:
+                    logger.info("Skipped a malformed %s resource in export %s" % (resource_type, self.job.pk))
+                    continue
+                lines.append(fastjson.dumps(resource))
+            start_index += len(entries)
+
+            done = not entries or not has_next(bundle)
+            if done or len(lines) >= self.file_max_resources:
+                if lines:
+                    self.write_file(resource_type, state, lines)
+                    lines = []
+                state['start_index'] = start_index
+                state['done'] = done
+                self.save_checkpoint()
+
+    def check_active(self):
+        # Also a heartbeat, jobs not updated for FHIR_EXPORT_STALE_AFTER are requeued
+        if not ExportJob.objects.filter(pk=self.job.pk, status=ExportJob.IN_PROGRESS).update(
+                updated_at=timezone.now()):
+            raise ExportCancelled()
+        if not DataAccessGrant.objects.filter(beneficiary_id=self.job.user_id,
+                                              application_id=self.job.application_id).exists():
+            raise ExportError("Access to the beneficiary data was revoked")
+
+    def save_checkpoint(self):
+        if not ExportJob.objects.filter(pk=self.job.pk, status=ExportJob.IN_PROGRESS).update(
+                checkpoint=json.dumps(self.checkpoint), updated_at=timezone.now()):
+            raise ExportCancelled()
+
+    def write_file(self, resource_type, state, lines):
+        name = '%s%s-%d.ndjson' % (self.job.storage_prefix, resource_type, len(state['files']) + 1)
+        content = b'\n'.join(lines) + b'\n'
+        # The storage picks another name if an interrupted run left this one behind
+        path = default_storage.save(name, ContentFile(content))
+        state['files'].append({'name': os.path.basename(path), 'path': path, 'count': len(lines)})
+
+    def fetch_page(self, resource_type, start_index):
+        # Each page goes to the endpoint picked by the load balancer
+        resource_router = get_resourcerouter()
+        url = resource_router.fhir_url + resource_type + '/'
+        params = {
+            **SEARCH_PARAMETERS[resource_type](self.job.fhir_id),
+            '_format': 'application/json+fhir',
+            'startIndex': start_index,
+            '_count': self.page_size,
+        }
+        if self.job.since:
+            params['_lastUpdated'] = 'ge' + self.job.since
+
+        self.pages += 1
+        req = Request('GET', url, params=params, headers=job_headers(self.job, url, self.pages))
+        prepped = self.client.prepare_request(req)
+
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(attempt)
+            # Send signal
+            pre_fetch.send_robust(FhirDataView, request=req)
+            try:
+                r = self.client.send(
+                    prepped,
+                    cert=backend_connection.certs(url=url),
+                    timeout=resource_router.wait_time,
+                    verify=FhirServerVerify(url=url))
+            except (RequestException, UpstreamServerException) as e:
+                # The backend circuit breaker may be open for a while, retry anyway
+                error = repr(e)
+                continue
+            # Send signal
+            post_fetch.send_robust(FhirDataView, request=prepped, response=r)
+            if r.status_code < 300:
+                return fastjson.loads(r.content)
+            error = "status %s" % r.status_code
+            if r.status_code < 500:
+                break
+
+        raise ExportError("An error occurred contacting the upstream server: %s" % error)
+
+
+def delete_job_files(job):
+    try:
+        directories, files = default_storage.listdir(job.storage_prefix)
+    except OSError:
+        return
+    for name in files:
+        default_storage.delete(job.storage_prefix + name)
+
+
+def claim_job(job_id):
+    return ExportJob.objects.filter(pk=job_id, status=ExportJob.QUEUED).update(
+        status=ExportJob.IN_PROGRESS, updated_at=timezone.now()) == 1
+
+
+def run_job(job_id):
+    """
+    Run a queued job to the end. Returns False when the job was not
+    queued, e.g. another worker claimed it first.
+    """
+    if not claim_job(job_id):
+        return False
+
+    job = ExportJob.objects.select_related('application').get(pk=job_id)
+    try:
+        ExportRunner(job).run()
+    except ExportCancelled:
+        delete_job_files(job)
+    except Exception as e:
+        if isinstance(e, ExportError):
+            logger.info("Export %s failed: %s" % (job.pk, e))
+        else:
+            logger.exception("Export %s failed" % job.pk)
+        ExportJob.objects.filter(pk=job.pk, status=ExportJob.IN_PROGRESS).update(
+            status=ExportJob.FAILED, error=str(e), updated_at=timezone.now())
+        delete_job_files(job)
+    return True
+
+
+def cancel_job(job):
+    ExportJob.objects.filter(pk=job.pk).exclude(status=ExportJob.CANCELLED).update(
+        status=ExportJob.CANCELLED, updated_at=timezone.now())
+    delete_job_files(job)
+
+
+def requeue_stale_jobs():
+    stale_after = timedelta(seconds=getattr(settings, 'FHIR_EXPORT_STALE_AFTER', 600))
+    return ExportJob.objects.filter(status=ExportJob.IN_PROGRESS,
+                                    updated_at__lt=timezone.now() - stale_after).update(
+        status=ExportJob.QUEUED, updated_at=timezone.now())
+
+
+def run_queued_jobs():
+    """
+    Requeue jobs left behind by a worker that went away and run all
+    queued jobs in turn. Returns the number of jobs run.
+    """
+    requeue_stale_jobs()
+    job_ids = ExportJob.objects.filter(status=ExportJob.QUEUED).order_by(
+        'transaction_time').values_list('pk', flat=True)
+    return sum(1 for job_id in list(job_ids) if run_job(job_id))
+
+
+def is_expired(job):
+    retention = timedelta(seconds=getattr(settings, 'FHIR_EXPORT_RETENTION', 24 * 60 * 60))
+    return job.status not in ExportJob.ACTIVE_STATUSES and job.updated_at < timezone.now() - retention
+
+
+def cleanup_expired_jobs():
+    retention = timedelta(seconds=getattr(settings, 'FHIR_EXPORT_RETENTION', 24 * 60 * 60))
+    expired = ExportJob.objects.exclude(status__in=ExportJob.ACTIVE_STATUSES).filter(
+        updated_at__lt=timezone.now() - retention)
+    count = 0
+    for job in expired:
+        delete_job_files(job)
+        job.delete()
+        count += 1
+    return count
+
+
+class ExportQueue(object):
+    """
+    Runs jobs in worker threads of this process, at most max_workers at once.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._futures = set()
+
+    def _get_executor(self):
+        # Worker threads do not survive a fork
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            self._pid = os.getpid()
+            self._futures = set()
+        return self._executor
+
+    def submit(self, job_id):
+        if self.max_workers <= 0:
+            return False
+        with self._lock:
+            future = self._get_executor().submit(self._run, job_id)
+            self._futures.add(future)
+            future.add_done_callback(self._futures.discard)
+        return True
+
+    def _run(self, job_id):
+        try:
+            run_job(job_id)
+        except Exception:
+            logger.exception("Export %s could not be run" % job_id)
+        finally:
+            # Connections are per thread, do not leave this one open
+            connection.close()
+
+    def wait(self, timeout=None):
+        with self._lock:
+            futures = list(self._futures)
+        wait(futures, timeout=timeout)
+
+    def stats(self):
+        with self._lock:
+            return {"max_workers": self.max_workers, "in_flight": len(self._futures)}
+
+
+export_queue = ExportQueue(max_workers=getattr(settings, 'FHIR_EXPORT_MAX_WORKERS', 2))
@@ -0,0 +1,225 @@
+"""
+Hedged backend requests for FHIR reads and searches.
+
+FHIR reads and searches are idempotent GETs. When the backend has not
+answered one within the FHIR_HEDGING_PERCENTILE latency observed for its
+resource type (at least FHIR_HEDGING_MIN_DELAY_MS), a second identical
+request is sent and whichever answers first is used. The other one is
+left to finish in the background.
+
+Hedges draw from a RetryBudget: every request adds
+FHIR_RETRY_BUDGET_PERCENT / 100 of a token, up to FHIR_RETRY_BUDGET_MAX
+tokens, and a hedge takes a whole one. So hedges add at most that share
+of load, and cannot amplify an outage. No hedge is sent until there are
+FHIR_HEDGING_MIN_SAMPLES latencies for the resource type.
+
+Primary attempts run on a pool of FHIR_HEDGING_MAX_WORKERS threads, and
+hedges on their own pool of FHIR_HEDGING_MAX_HEDGES threads, so busy
+primaries never leave a slow call without a hedge worker. A primary
+sent while FHIR_HEDGING_MAX_WORKERS others are in flight is sent from
+the request thread and cannot be hedged: size FHIR_HEDGING_MAX_WORKERS
+to the request threads of a worker process, e.g. gunicorn --threads.
+"""
+import logging
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from django.conf import settings
+
+from apps.fhir.server.breaker import AdaptiveTimeouts
+from apps.fhir.server.settings import fhir_settings
+
+logger = logging.getLogger('hhs_server.%s' % __name__)
+
+PRIMARY = 1
+HEDGE = 2
+
+
+def is_enabled():
+    return getattr(settings, 'FHIR_HEDGING_ENABLED', False)
+
+
+class RetryBudget(object):
+    """
+    Thread safe token bucket refilled by requests and drained by hedges.
+
+    Kept in hundredths of a token, so ten deposits at 10% make exactly one.
+    """
+
+    def __init__(self, ratio, max_tokens):
+        self.ratio = ratio
+        self.percent = int(round(ratio * 100))
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self.credits = 0
+        self.deposits = 0
+        self.withdrawals = 0
+        self.denied = 0
+
+    @property
+    def tokens(self):
+        return self.credits / 100
+
+    def deposit(self):
+        with self._lock:
+            self.deposits += 1
+            self.credits = min(self.credits + self.percent, self.max_tokens * 100)
+
+    def withdraw(self):
+        with self._lock:
+            if self.credits < 100:
+                self.denied += 1
+                return False
+            self.credits -= 100
+            self.withdrawals += 1
+            return True
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "tokens": self.tokens,
+                "ratio": self.ratio,
+                "max_tokens": self.max_tokens,
+                "deposits": self.deposits,
+                "withdrawals": self.withdrawals,
+                "denied": self.denied,
+            }
+
+
+class Hedger(object):
+
+    def __init__(self, max_workers, percentile, min_delay, min_samples, budget_ratio, budget_max, max_hedges=None):
+        self.max_workers = max_workers
+        self.max_hedges = max_hedges if max_hedges is not None else max_workers
+        self.budget = RetryBudget(budget_ratio, budget_max)
+        self.delays = AdaptiveTimeouts(percentile=percentile, multiplier=1.0, minimum=min_delay,
+                                       min_samples=min_samples)
+        self._lock = threading.Lock()
+        # attempt -> executor, and the futures in flight on it
+        self._executors = {}
+        self._pid = None
+        self._in_flight = {PRIMARY: set(), HEDGE: set()}
+        self._counters = {"requests": 0, "direct": 0, "hedged": 0, "hedge_won": 0, "skipped": 0}
+
+    def _limit(self, attempt):
+        return self.max_hedges if attempt == HEDGE else self.max_workers
+
+    def _get_executor(self, attempt):
+        # Called with the lock held, worker threads do not survive a fork
+        if self._pid != os.getpid():
+            self._executors = {}
+            self._pid = os.getpid()
+            self._in_flight = {PRIMARY: set(), HEDGE: set()}
+        if attempt not in self._executors:
+            self._executors[attempt] = ThreadPoolExecutor(max_workers=self._limit(attempt))
+        return self._executors[attempt]
+
+    def _submit(self, resource_type, send_attempt, attempt):
+        with self._lock:
+            executor = self._get_executor(attempt)
+            in_flight = self._in_flight[attempt]
+            if len(in_flight) >= self._limit(attempt):
+                self._counters["skipped"] += 1
+                return None
+            future = executor.submit(self._timed, resource_type, send_attempt, attempt)
+            in_flight.add(future)
+        future.add_done_callback(lambda done: self._done(in_flight, done))
+        return future
+
+    def _done(self, in_flight, future):
+        with self._lock:
+            in_flight.discard(future)
+
+    def _timed(self, resource_type, send_attempt, attempt):
+        start = time.monotonic()
+        try:
+            return send_attempt(attempt)
+        finally:
+            self.delays.record(resource_type, time.monotonic() - start)
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def send(self, resource_type, send_attempt, max_delay, on_loser=None):
+        """
+        Call send_attempt(PRIMARY), and send_attempt(HEDGE) as well if the
+        first one is slow. Return (response, attempt of the response,
+        whether a hedge was sent). If a hedge was sent, on_loser(attempt,
+        response) is called with the other response once it arrives.
+        """
+        self._count("requests")
+        self.budget.deposit()
+
+        delay = self.delays.timeout(resource_type, max_delay)
+        primary = self._submit(resource_type, send_attempt, PRIMARY) if delay < max_delay else None
+        if primary is None:
+            # Not enough latencies yet or no free worker, send it from this thread
+            self._count("direct")
+            return self._timed(resource_type, send_attempt, PRIMARY), PRIMARY, False
+
+        done, _ = wait([primary], timeout=delay)
+        if done or not self.budget.withdraw():
+            return primary.result(), PRIMARY, False
+
+        hedge = self._submit(resource_type, send_attempt, HEDGE)
+        if hedge is None:
+            return primary.result(), PRIMARY, False
+        self._count("hedged")
+
+        attempts = {primary: PRIMARY, hedge: HEDGE}
+        winner = None
+        pending = set(attempts)
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            # An error is not an answer, wait for the other attempt
+            winner = next((future for future in done if future.exception() is None), None)
+        if winner is None:
+            # Both failed
+            return primary.result(), PRIMARY, True
+
+        if winner is hedge:
+            self._count("hedge_won")
+        loser = primary if winner is hedge else hedge
+        if on_loser is not None:
+            def loser_done(future):
+                if future.exception() is None:
+                    on_loser(attempts[future], future.result())
+                else:
+                    logger.info("Hedged attempt %s failed: %r" % (attempts[future], future.exception()))
+            loser.add_done_callback(loser_done)
+        return winner.result(), attempts[winner], True
+
+    def wait(self, timeout=None):
+        with self._lock:
+            futures = list(self._in_flight[PRIMARY] | self._in_flight[HEDGE])
+        wait(futures, timeout=timeout)
+
+    def clear(self):
+        with self._lock:
+            for counter in self._counters:
+                self._counters[counter] = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["in_flight"] = len(self._in_flight[PRIMARY])
+            stats["hedges_in_flight"] = len(self._in_flight[HEDGE])
+        stats["hedge_rate"] = round(stats["hedged"] / stats["requests"], 4) if stats["requests"] else 0.0
+        stats["hedge_win_rate"] = round(stats["hedge_won"] / stats["hedged"], 4) if stats["hedged"] else 0.0
+        stats["retry_budget"] = self.budget.snapshot()
+        stats["delays"] = self.delays.snapshot(fhir_settings.wait_time)
+        stats["config"] = {"max_workers": self.max_workers, "max_hedges": self.max_hedges, "percentile": self.delays.percentile,
+                           "min_delay": self.delays.minimum, "min_samples": self.delays.min_samples}
+        return stats
+
+
+hedger = Hedger(max_workers=getattr(settings, 'FHIR_HEDGING_MAX_WORKERS', 8),
+                percentile=getattr(settings, 'FHIR_HEDGING_PERCENTILE', 95),
+                min_delay=getattr(settings, 'FHIR_HEDGING_MIN_DELAY_MS', 200) / 1000,
+                min_samples=getattr(settings, 'FHIR_HEDGING_MIN_SAMPLES', 50),
+                budget_ratio=getattr(settings, 'FHIR_RETRY_BUDGET_PERCENT', 10) / 100,
+                budget_max=getattr(settings, 'FHIR_RETRY_BUDGET_MAX', 10),
+                max_hedges=getattr(settings, 'FHIR_HEDGING_MAX_HEDGES', 4))
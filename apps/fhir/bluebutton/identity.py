@@ -0,0 +1,48 @@
+"""
+Who a resource (FHIR) API request is made by and for.
+
+OAuth2ResourceOwner resolves the access token, its application and
+beneficiary, and the beneficiary crosswalk once, and keeps them on the
+request as an Identity (see set_identity). The permission classes, the
+backend request headers (generate_info_headers) and the audit log
+(RequestResponseLog) read them from there instead of loading them again.
+
+Requests not authenticated by OAuth2ResourceOwner, e.g. userinfo or the
+authorization flow, have no Identity, get_identity() returns None.
+"""
+
+
+class Identity(object):
+    """
+    The access token, application, developer, beneficiary and crosswalk of a request.
+    """
+
+    def __init__(self, access_token, crosswalk):
+        self.access_token = access_token
+        self.application = access_token.application
+        self.beneficiary = access_token.user
+        self.crosswalk = crosswalk
+
+    @property
+    def developer(self):
+        # Loaded on first use only, then kept on the application
+        return self.application.user
+
+    @property
+    def fhir_id(self):
+        return self.crosswalk.fhir_id
+
+
+def set_identity(request, identity):
+    request.identity = identity
+    # Also seen by the middlewares, e.g. the audit log, on the Django request
+    django_request = getattr(request, '_request', None)
+    if django_request is not None:
+        django_request.identity = identity
+
+
+def get_identity(request):
+    """
+    The Identity of an authenticated resource API request, or None.
+    """
+    return getattr(request, 'identity', None)
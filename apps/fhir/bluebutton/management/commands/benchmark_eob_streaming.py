@@ -0,0 +1,86 @@
+import json
+import multiprocessing
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from apps.authorization.permissions import is_resource_for_patient, PatientReferenceValidator
+from apps.fhir.bluebutton.streaming import iter_bundle, STREAM_CHUNK_SIZE
+from apps.fhir.server.client import BackendClient
+from apps.fhir.server.mock_bfd import MockBFDServer
+
+FHIR_ID = '-20140000008325'
+
+
+def buffered(client, url, params):
+    r = client.get(url, params=params)
+    out_data = r.json()
+    is_resource_for_patient(out_data, FHIR_ID)
+    content = JSONRenderer().render(out_data)
+    return [content]
+
+
+def streamed(client, url, params):
+    validator = PatientReferenceValidator(FHIR_ID)
+
+    r = client.get(url, params=params, stream=True)
+    try:
+        for part in iter_bundle(r.iter_content(STREAM_CHUNK_SIZE), validator.feed):
+            yield part
+    finally:
+        r.close()
+
+
+class Command(BaseCommand):
+    help = ('Compare time to first byte, total time and peak Python memory of the buffered '
+            'and streaming paths for synthetic ExplanationOfBenefit search Bundles.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=50, help="entries per Bundle")
+        parser.add_argument('--runs', type=int, default=20, help="requests per mode")
+        parser.add_argument('--chunk-delay', type=float, default=0.005,
+                            help="seconds between 16KB chunks sent by the stand-in backend")
+
+    def handle(self, *args, **options):
+        # Serve from a child process, so building the backend Bundles
+        # does not count towards the measured memory
+        server = MockBFDServer(chunk_delay=options['chunk_delay'])
+        backend = multiprocessing.Process(target=server.serve_forever, daemon=True)
+        backend.start()
+        client = BackendClient()
+        url = server.url + "ExplanationOfBenefit/"
+        params = {'patient': FHIR_ID, '_count': options['count'], '_format': 'application/json+fhir'}
+
+        size = len(client.get(url, params=params).content)
+        self.stdout.write("Bundle: %s entries, %.1f KB, chunk delay %sms" % (
+            options['count'], size / 1024, int(options['chunk_delay'] * 1000)))
+        self.stdout.write("%10s %10s %10s %14s" % ('mode', 'ttfb_ms', 'total_ms', 'peak_mem_kb'))
+        try:
+            for name, fetch in (('buffered', buffered), ('streaming', streamed)):
+                ttfb, total, peak = [], [], []
+                for _ in range(options['runs']):
+                    tracemalloc.start()
+                    start = time.monotonic()
+                    first = None
+                    received = 0
+                    for part in fetch(client, url, params):
+                        if first is None:
+                            first = time.monotonic() - start
+                        received += len(part)
+                    total.append(time.monotonic() - start)
+                    ttfb.append(first)
+                    peak.append(tracemalloc.get_traced_memory()[1])
+                    tracemalloc.stop()
+
+                self.stdout.write("%10s %10.1f %10.1f %14.0f" % (
+                    name, 1000 * sum(ttfb) / len(ttfb), 1000 * sum(total) / len(total),
+                    max(peak) / 1024))
+            # Both paths must forward the same document
+            if json.loads(b''.join(buffered(client, url, params))) != json.loads(b''.join(streamed(client, url, params))):
+                self.stderr.write("Buffered and streamed Bundles differ")
+        finally:
+            client.close()
+            backend.terminate()
+            server.server_close()
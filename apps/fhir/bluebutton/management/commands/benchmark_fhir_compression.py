@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from apps.fhir.bluebutton.compression import available_encodings, compress, compress_stream
+from apps.fhir.bluebutton.streaming import STREAM_CHUNK_SIZE
+from apps.fhir.server.mock_bfd import eob_bundle
+
+FHIR_ID = '-20140000008325'
+
+LEVELS = {
+    'gzip': [1, 3, 5, 6, 9],
+    'br': [1, 4, 5, 9, 11],
+}
+
+
+class Command(BaseCommand):
+    help = ('Compare CPU time and compressed size of gzip and brotli levels for rendered '
+            'synthetic ExplanationOfBenefit search Bundles, as served by the search views.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--counts', type=int, nargs='+', default=[10, 50], help="entries per Bundle")
+        parser.add_argument('--runs', type=int, default=20, help="compressions per level")
+
+    def handle(self, *args, **options):
+        self.stdout.write("%8s %6s %5s %10s %10s %8s %10s %12s" % (
+            'entries', 'enc', 'level', 'bytes', 'encoded', 'ratio', 'cpu_ms', 'stream_bytes'))
+        for count in options['counts']:
+            content = JSONRenderer().render(eob_bundle(FHIR_ID, count=count, total=count))
+            chunks = [content[i:i + STREAM_CHUNK_SIZE] for i in range(0, len(content), STREAM_CHUNK_SIZE)]
+            for encoding in available_encodings():
+                for level in LEVELS[encoding]:
+                    start = time.process_time()
+                    for _ in range(options['runs']):
+                        encoded = compress(encoding, level, content)
+                    cpu = (time.process_time() - start) / options['runs']
+                    # Streamed bodies are flushed after each chunk
+                    streamed = sum(len(part) for part in compress_stream(encoding, level, chunks))
+                    self.stdout.write("%8s %6s %5s %10s %10s %8.3f %10.2f %12s" % (
+                        count, encoding, level, len(content), len(encoded),
+                        len(encoded) / len(content), 1000 * cpu, streamed))
+        if 'br' not in available_encodings():
+            self.stdout.write("brotli is not installed, only gzip was measured")
@@ -0,0 +1,44 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from apps.fhir import fastjson
+from apps.fhir.renderers import FastJSONRenderer
+from apps.fhir.server.mock_bfd import eob_bundle
+
+FHIR_ID = '-20140000008325'
+
+
+def throughput(size, runs, func):
+    start = time.perf_counter()
+    for _ in range(runs):
+        func()
+    return size * runs / (time.perf_counter() - start) / (1024 * 1024)
+
+
+class Command(BaseCommand):
+    help = ('Compare encode and decode throughput of the stdlib JSONRenderer/json.loads and '
+            'FastJSONRenderer/fastjson.loads for synthetic ExplanationOfBenefit search Bundles.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--counts', type=int, nargs='+', default=[10, 50], help="entries per Bundle")
+        parser.add_argument('--runs', type=int, default=50, help="encodes and decodes per Bundle")
+
+    def handle(self, *args, **options):
+        self.stdout.write("fastjson backend: %s" % fastjson.backend())
+        self.stdout.write("%8s %10s %14s %14s %14s %14s" % (
+            'entries', 'bytes', 'encode_MB/s', 'fast_enc_MB/s', 'decode_MB/s', 'fast_dec_MB/s'))
+        for count in options['counts']:
+            bundle = eob_bundle(FHIR_ID, count=count, total=count)
+            content = JSONRenderer().render(bundle)
+            if FastJSONRenderer().render(bundle) != content:
+                self.stderr.write("FastJSONRenderer output differs from JSONRenderer")
+            runs = options['runs']
+            self.stdout.write("%8s %10s %14.1f %14.1f %14.1f %14.1f" % (
+                count, len(content),
+                throughput(len(content), runs, lambda: JSONRenderer().render(bundle)),
+                throughput(len(content), runs, lambda: FastJSONRenderer().render(bundle)),
+                throughput(len(content), runs, lambda: json.loads(content.decode('utf-8'))),
+                throughput(len(content), runs, lambda: fastjson.loads(content))))
@@ -0,0 +1,62 @@
+import time
+
+import voluptuous
+
+from django.core.management.base import BaseCommand
+from django.http import QueryDict
+from voluptuous import All, Coerce, Match, Range, Required
+
+from apps.fhir.bluebutton.constants import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from apps.fhir.bluebutton.views.search import EOB_TYPE_VALUES, SearchViewExplanationOfBenefit
+
+QUERIES = {
+    'empty': '',
+    'paged': 'startIndex=20&count=10',
+    'type': 'type=carrier,pde,dme,hha,hospice,inpatient,outpatient,snf',
+    'full': ('startIndex=20&_count=50&_lastUpdated=ge2019-01-01&_lastUpdated=lt2020-01-01'
+             '&type=https://bluebutton.cms.gov/resources/codesystem/eob-type|carrier,pde'),
+}
+
+# The per request voluptuous schema the search views used before QUERY_PARAMETERS
+REGEX_TYPE_VALUES_LIST = r'(?i)^((' + '|'.join('(%s)' % value.replace('|', r'\|')
+                                               for value in EOB_TYPE_VALUES) + r')\s*,*\s*)+$'
+LEGACY_SCHEMA = {
+    Required('startIndex', default=0): Coerce(int),
+    Required('_count', default=DEFAULT_PAGE_SIZE): All(Coerce(int), Range(min=0, max=MAX_PAGE_SIZE)),
+    '_lastUpdated': [Match(r'^((lt)|(le)|(gt)|(ge)).+', msg="the _lastUpdated operator is not valid")],
+    'type': Match(REGEX_TYPE_VALUES_LIST, msg="the type parameter value is not valid"),
+}
+
+
+def legacy_filter_parameters(query_params):
+    params = query_params.dict()
+    val = params.pop('count', None)
+    if val is not None:
+        params['_count'] = val
+    params['_lastUpdated'] = query_params.getlist('_lastUpdated')
+    return voluptuous.Schema(LEGACY_SCHEMA, extra=voluptuous.REMOVE_EXTRA)(params)
+
+
+def per_call_us(runs, func):
+    start = time.perf_counter()
+    for _ in range(runs):
+        func()
+    return (time.perf_counter() - start) * 1000000 / runs
+
+
+class Command(BaseCommand):
+    help = ('Compare the per request cost of the former voluptuous schema and the compiled '
+            'QUERY_PARAMETERS of the ExplanationOfBenefit search view.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=10000, help="parses per query")
+
+    def handle(self, *args, **options):
+        parameters = SearchViewExplanationOfBenefit.QUERY_PARAMETERS
+        runs = options['runs']
+        self.stdout.write("%8s %14s %14s %8s" % ('query', 'legacy_us', 'compiled_us', 'speedup'))
+        for name, query in QUERIES.items():
+            query_params = QueryDict(query)
+            legacy = per_call_us(runs, lambda: legacy_filter_parameters(query_params))
+            compiled = per_call_us(runs, lambda: parameters.parse(query_params))
+            self.stdout.write("%8s %14.2f %14.2f %7.1fx" % (name, legacy, compiled, legacy / compiled))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from apps.fhir.bluebutton.export import cleanup_expired_jobs
+
+
+class Command(BaseCommand):
+    help = 'Remove FHIR Bulk Data export jobs and files older than FHIR_EXPORT_RETENTION.'
+
+    def handle(self, *args, **options):
+        self.stdout.write("Removed %s export jobs" % cleanup_expired_jobs())
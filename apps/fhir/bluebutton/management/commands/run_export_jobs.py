@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.fhir.bluebutton.export import run_queued_jobs
+
+
+class Command(BaseCommand):
+    help = 'Run queued FHIR Bulk Data export jobs, including jobs left behind by stopped workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll', type=int, default=0,
+                            help="keep running, checking for queued jobs every POLL seconds")
+
+    def handle(self, *args, **options):
+        while True:
+            count = run_queued_jobs()
+            if count:
+                self.stdout.write("Ran %s export jobs" % count)
+            if not options['poll']:
+                break
+            time.sleep(options['poll'])
@@ -1,11 +1,14 @@
 import binascii
+import json
 import logging
+import uuid
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.db.models import (CASCADE, Q)
 from django.utils.crypto import pbkdf2
+from oauth2_provider.settings import oauth2_settings
 from requests import Response
 from rest_framework import status
 from rest_framework.exceptions import APIException
@@ -201,6 +204,63 @@ class Fhir_Response(Response):
             self.__dict__[k] = v
 
 
+class ExportJob(models.Model):
+    """
+    FHIR Bulk Data Patient/$export job for one beneficiary and application.
+    See apps.fhir.bluebutton.export.
+
+    checkpoint holds, per resource type, the backend startIndex written
+    so far and the NDJSON files written, so an interrupted job resumes
+    where it stopped.
+    """
+
+    QUEUED = 'queued'
+    IN_PROGRESS = 'in_progress'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (IN_PROGRESS, 'In progress'),
+        (COMPLETED, 'Completed'),
+        (FAILED, 'Failed'),
+        (CANCELLED, 'Cancelled'),
+    )
+
+    ACTIVE_STATUSES = (QUEUED, IN_PROGRESS)
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=CASCADE)
+    application = models.ForeignKey(oauth2_settings.APPLICATION_MODEL, on_delete=CASCADE)
+    fhir_id = models.CharField(max_length=80)
+    resource_types = models.CharField(max_length=200)
+    since = models.CharField(max_length=40, blank=True, default='')
+    request_url = models.TextField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    checkpoint = models.TextField(default='{}')
+    error = models.TextField(blank=True, default='')
+    transaction_time = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return '%s %s' % (self.id, self.status)
+
+    def get_resource_types(self):
+        return self.resource_types.split(',')
+
+    def get_checkpoint(self):
+        return json.loads(self.checkpoint)
+
+    def set_checkpoint(self, checkpoint):
+        self.checkpoint = json.dumps(checkpoint)
+
+    @property
+    def storage_prefix(self):
+        return 'exports/%s/' % self.id
+
+
 def check_crosswalks():
     synth_count = Crosswalk.synth_objects.count()
     real_count = Crosswalk.real_objects.count()
@@ -3,6 +3,7 @@ from rest_framework import (permissions, exceptions)
 from django.contrib.auth import get_user_model
 from rest_framework.exceptions import PermissionDenied
 from .constants import ALLOWED_RESOURCE_TYPES
+from .identity import get_identity
 from django.conf import settings
 
 User = get_user_model()
@@ -23,6 +24,9 @@ class ResourcePermission(permissions.BasePermission):
 class HasCrosswalk(permissions.BasePermission):
 
     def has_permission(self, request, view):
+        identity = get_identity(request)
+        if identity is not None:
+            return bool(identity.fhir_id)
         return bool(request.user and request.user.crosswalk and request.user.crosswalk.fhir_id)
 
 
@@ -73,8 +77,10 @@ class SearchCrosswalkPermission(HasCrosswalk):
 class ApplicationActivePermission(permissions.BasePermission):
 
     def has_permission(self, request, view):
-        app_is_active = request.auth and request.auth.application.active
-        app_name = request.auth.application.name if request.auth and request.auth.application.name else "Unknown"
+        identity = get_identity(request)
+        application = identity.application if identity is not None else getattr(request.auth, 'application', None)
+        app_is_active = request.auth and application.active
+        app_name = application.name if request.auth and application.name else "Unknown"
         if app_is_active is False:
             # in order to generate application specific message, short circuit base
             # permission's error raise flow
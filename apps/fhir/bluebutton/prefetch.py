@@ -0,0 +1,183 @@
+"""
+Background prefetch of the next ExplanationOfBenefit search page.
+
+After a page is served, the next one is fetched from the backend in a
+worker thread and held in memory for a short time, keyed on the access
+token, the beneficiary and the canonical backend query relative to the
+backend endpoint (the next request may be sent to another one), so a client
+walking the pages in order gets it without waiting on the backend. Held
+backend responses are served like any other: checked against the
+beneficiary, stored in the response cache and given their Last-Modified.
+
+A prefetch is logged as a backend call of its own, with its own query id
+and start time, and the query id of the request it followed in
+BlueButton-PrefetchOf (see prefetch_request).
+
+Prefetches are dropped rather than queued once FHIR_EOB_PREFETCH_MAX_WORKERS
+are in flight, and the oldest pages are evicted once more than
+FHIR_EOB_PREFETCH_MAX_BYTES are held.
+"""
+import hashlib
+import logging
+import os
+import pytz
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from django.conf import settings
+
+from apps.fhir.server.router import load_balancer
+from .search_parameters import canonical_query
+
+logger = logging.getLogger('hhs_server.%s' % __name__)
+
+
+def is_enabled():
+    return getattr(settings, 'FHIR_EOB_PREFETCH_ENABLED', False)
+
+
+def build_key(request, url, params):
+    return hashlib.sha256("\n".join([
+        str(request.auth.pk),
+        request.auth.token,
+        request.crosswalk.fhir_id,
+        load_balancer.relative_url(url),
+        canonical_query(params),
+    ]).encode('utf-8')).hexdigest()
+
+
+def prefetch_request(req):
+    """
+    Give a backend request built for the page being served its own
+    identity, req is then sent after that page's request has ended.
+    """
+    req.headers['BlueButton-PrefetchOf'] = req.headers.get('BlueButton-OriginalQueryId', '')
+    req.headers['BlueButton-OriginalQueryId'] = str(uuid.uuid1())
+    req.headers['BlueButton-OriginalQueryCounter'] = '1'
+
+
+def sent_request(req):
+    # Started when sent, not when scheduled
+    req.headers['BlueButton-OriginalQueryTimestamp'] = datetime.now(pytz.utc).isoformat()
+    return req
+
+
+class Prefetcher(object):
+
+    def __init__(self, max_workers, max_bytes, ttl):
+        self.max_workers = max_workers
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._pages = OrderedDict()
+        self._bytes = 0
+        self._in_flight = {}
+        self._counters = {"scheduled": 0, "prefetched": 0, "failed": 0, "dropped": 0,
+                          "hits": 0, "misses": 0, "wasted": 0}
+
+    def _get_executor(self):
+        # Worker threads do not survive a fork
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            self._pid = os.getpid()
+            self._in_flight = {}
+        return self._executor
+
+    def _expire(self, now):
+        # Pages are held in the order they expire
+        while self._pages:
+            key, (expires, response) = next(iter(self._pages.items()))
+            if expires > now:
+                break
+            self._evict(key)
+
+    def _evict(self, key):
+        expires, response = self._pages.pop(key)
+        self._bytes -= len(response.content)
+        self._counters["wasted"] += 1
+
+    def take(self, key):
+        """
+        Return and forget the backend response prefetched for key, or None.
+        """
+        with self._lock:
+            self._expire(time.monotonic())
+            page = self._pages.pop(key, None)
+            if page is None:
+                self._counters["misses"] += 1
+                return None
+            self._bytes -= len(page[1].content)
+            self._counters["hits"] += 1
+            return page[1]
+
+    def schedule(self, key, fetch):
+        """
+        Run fetch() in a worker thread and hold the backend response it returns for key.
+        """
+        with self._lock:
+            executor = self._get_executor()
+            if key in self._pages or key in self._in_flight:
+                return
+            if len(self._in_flight) >= self.max_workers:
+                self._counters["dropped"] += 1
+                return
+            self._counters["scheduled"] += 1
+            self._in_flight[key] = executor.submit(self._run, key, fetch)
+
+    def _run(self, key, fetch):
+        try:
+            response = fetch()
+        except Exception as e:
+            logger.info("Prefetch failed: %r" % e)
+            with self._lock:
+                self._counters["failed"] += 1
+                self._in_flight.pop(key, None)
+            return
+
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if len(response.content) > self.max_bytes:
+                self._counters["dropped"] += 1
+                return
+            self._counters["prefetched"] += 1
+            self._pages[key] = (time.monotonic() + self.ttl, response)
+            self._bytes += len(response.content)
+            self._expire(time.monotonic())
+            while self._bytes > self.max_bytes:
+                self._evict(next(iter(self._pages)))
+
+    def wait(self, timeout=None):
+        with self._lock:
+            futures = list(self._in_flight.values())
+        wait(futures, timeout=timeout)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._bytes = 0
+            for counter in self._counters:
+                self._counters[counter] = 0
+
+    def stats(self):
+        with self._lock:
+            self._expire(time.monotonic())
+            stats = dict(self._counters)
+            lookups = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+            stats["wasted_rate"] = round(stats["wasted"] / stats["prefetched"], 4) if stats["prefetched"] else 0.0
+            stats["pages_held"] = len(self._pages)
+            stats["bytes_held"] = self._bytes
+            stats["in_flight"] = len(self._in_flight)
+            stats["config"] = {"max_workers": self.max_workers, "max_bytes": self.max_bytes, "ttl": self.ttl}
+            return stats
+
+
+prefetcher = Prefetcher(max_workers=getattr(settings, 'FHIR_EOB_PREFETCH_MAX_WORKERS', 4),
+                        max_bytes=getattr(settings, 'FHIR_EOB_PREFETCH_MAX_BYTES', 32 * 1024 * 1024),
+                        ttl=getattr(settings, 'FHIR_EOB_PREFETCH_TTL', 30))
@@ -0,0 +1,215 @@
+"""
+FHIR _elements and _summary projection of read and search responses.
+
+_elements=a,b keeps only the listed top level elements (and resourceType,
+id and meta) of each resource. _summary=true keeps the summary elements
+of the resource type, _summary=data drops the narrative text, and
+_summary=count (search only) returns the search Bundle without entries.
+A resource that lost elements gets the SUBSETTED meta tag.
+
+Parameters named in FHIR_PROJECTION_BACKEND_PARAMETERS are also sent to
+the backend. The projection is still applied here in case the backend
+ignores them. A forwarded _elements always asks for the element the
+beneficiary check reads (REFERENCE_ELEMENTS), it is dropped here after the
+check when the client did not ask for it. A _summary=count search not sent to the backend asks it
+for _count=0, so no entries are transferred.
+
+Projected responses are counted per application, with the encoded size
+before and after the projection of one in FHIR_PROJECTION_STATS_SAMPLE_EVERY
+of them (encoding both costs more than the projection itself).
+"""
+import re
+import threading
+
+from collections import defaultdict
+from django.conf import settings
+
+from apps.fhir import fastjson
+from .search_parameters import InvalidSearchParameter
+
+SUBSETTED_TAG = {
+    "system": "http://terminology.hl7.org/CodeSystem/v3-ObservationValue",
+    "code": "SUBSETTED",
+    "display": "Resource encoded in summary mode",
+}
+
+# Kept by every projection
+MANDATORY_ELEMENTS = frozenset(['resourceType', 'id', 'meta'])
+
+# Elements marked isSummary in the STU3 definitions of the served resource types
+SUMMARY_ELEMENTS = {
+    'Patient': frozenset([
+        'identifier', 'active', 'name', 'telecom', 'gender', 'birthDate', 'deceasedBoolean',
+        'deceasedDateTime', 'address', 'managingOrganization', 'link']),
+    'Coverage': frozenset([
+        'identifier', 'status', 'type', 'policyHolder', 'subscriber', 'subscriberId', 'beneficiary',
+        'relationship', 'period', 'payor', 'grouping', 'dependent', 'sequence', 'order', 'network',
+        'contract']),
+    'ExplanationOfBenefit': frozenset([
+        'identifier', 'status', 'type', 'patient', 'billablePeriod', 'created', 'insurer', 'provider',
+        'organization', 'outcome', 'totalCost', 'payment', 'totalBenefit']),
+}
+
+# Elements the permission checks read the beneficiary from, by resource type
+REFERENCE_ELEMENTS = {
+    'Patient': 'id',
+    'Coverage': 'beneficiary',
+    'ExplanationOfBenefit': 'patient',
+}
+
+# Bundle elements returned for _summary=count
+COUNT_ELEMENTS = ('resourceType', 'id', 'meta', 'type', 'total', 'link')
+
+ELEMENT_NAME = re.compile(r'^[A-Za-z][A-Za-z0-9]*$')
+
+
+def backend_parameters():
+    return getattr(settings, 'FHIR_PROJECTION_BACKEND_PARAMETERS', [])
+
+
+def sample_every():
+    return max(getattr(settings, 'FHIR_PROJECTION_STATS_SAMPLE_EVERY', 100), 1)
+
+
+class ProjectionStats(object):
+    """
+    Per process projected response and byte counters by application.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(lambda: {"name": None, "responses": 0, "sampled": 0,
+                                              "bytes_before": 0, "bytes_after": 0})
+
+    def _key(self, application):
+        return str(application.pk) if application is not None else "unknown"
+
+    def count(self, application):
+        """
+        Count a projected response, return True when its sizes are to be recorded.
+        """
+        with self._lock:
+            counters = self._counters[self._key(application)]
+            counters["name"] = application.name if application is not None else None
+            counters["responses"] += 1
+            # The first response of an application, then one in sample_every()
+            return (counters["responses"] - 1) % sample_every() == 0
+
+    def record(self, application, before, after):
+        with self._lock:
+            counters = self._counters[self._key(application)]
+            counters["sampled"] += 1
+            counters["bytes_before"] += before
+            counters["bytes_after"] += after
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for key, counters in self._counters.items():
+                result[key] = dict(counters)
+                result[key]["saved_ratio"] = (
+                    round(1 - counters["bytes_after"] / counters["bytes_before"], 4)
+                    if counters["bytes_before"] else 0.0)
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+
+projection_stats = ProjectionStats()
+
+
+class Projection(object):
+
+    def __init__(self, elements=None, summary=None):
+        self.elements = frozenset(elements) if elements else None
+        self.summary = summary
+
+    def __bool__(self):
+        return self.elements is not None or self.summary not in (None, 'false')
+
+    @classmethod
+    def from_query(cls, query_params, summary_values):
+        """
+        Projection of the _elements and _summary request parameters,
+        raises InvalidSearchParameter.
+        """
+        elements = None
+        value = query_params.get('_elements')
+        if value is not None:
+            elements = [element.strip() for element in value.split(',') if element.strip()]
+            if not elements or not all(ELEMENT_NAME.match(element) for element in elements):
+                raise InvalidSearchParameter("the _elements parameter value is not valid")
+
+        summary = query_params.get('_summary')
+        if summary is not None:
+            summary = summary.lower()
+            if summary not in summary_values:
+                raise InvalidSearchParameter("the _summary parameter value is not valid")
+        return cls(elements, summary)
+
+    def backend_parameters(self, resource_type):
+        """
+        The parameters to send to the backend with the search parameters.
+        """
+        forwarded = backend_parameters()
+        params = {}
+        if self.elements is not None and '_elements' in forwarded:
+            # The beneficiary check must still find the reference, apply_resource drops it later
+            elements = set(self.elements)
+            if resource_type in REFERENCE_ELEMENTS:
+                elements.add(REFERENCE_ELEMENTS[resource_type])
+            params['_elements'] = ','.join(sorted(elements))
+        if self.summary is not None and '_summary' in forwarded:
+            params['_summary'] = self.summary
+        elif self.summary == 'count':
+            params['_count'] = 0
+        return params
+
+    def apply(self, data):
+        if data.get('resourceType') != 'Bundle':
+            return self.apply_resource(data)
+        if self.summary == 'count':
+            return {key: data[key] for key in COUNT_ELEMENTS if key in data}
+        if 'entry' not in data:
+            return data
+        bundle = dict(data)
+        bundle['entry'] = [
+            dict(entry, resource=self.apply_resource(entry['resource'])) if 'resource' in entry else entry
+            for entry in data['entry']
+        ]
+        return bundle
+
+    def apply_resource(self, resource):
+        keep = None
+        if self.summary == 'true':
+            keep = SUMMARY_ELEMENTS.get(resource.get('resourceType'))
+        if self.elements is not None:
+            keep = self.elements if keep is None else keep & self.elements
+
+        if keep is not None:
+            projected = {key: value for key, value in resource.items() if key in keep or key in MANDATORY_ELEMENTS}
+        elif self.summary == 'data':
+            projected = {key: value for key, value in resource.items() if key != 'text'}
+        else:
+            return resource
+
+        if len(projected) == len(resource):
+            return resource
+        meta = dict(projected.get('meta', {}))
+        meta['tag'] = meta.get('tag', []) + [SUBSETTED_TAG]
+        projected['meta'] = meta
+        return projected
+
+
+def project(request, projection, data):
+    """
+    Apply projection to data and count it for the application, with the
+    bytes saved of the sampled responses.
+    """
+    projected = projection.apply(data)
+    application = request.auth.application if request.auth is not None else None
+    if projection_stats.count(application):
+        projection_stats.record(application, len(fastjson.dumps(data)), len(fastjson.dumps(projected)))
+    return projected
@@ -0,0 +1,144 @@
+"""
+Declarative FHIR search parameters, compiled once per view class.
+
+A view declares its QUERY_PARAMETERS as a SearchParameters of named
+parameter types. Parsing a request validates and normalizes each value:
+
+* Integer coerces and checks a range, with a default when missing.
+* Prefixed keeps every value of a repeated parameter (_lastUpdated) that
+  starts with one of its prefixes, lower-cases the prefix, and drops
+  duplicates.
+* TokenList splits a comma separated parameter (type) into known codes,
+  case-insensitively, and emits them lower-cased, deduplicated and sorted.
+
+Unknown parameters are dropped. So two queries that differ only in case,
+order or repeated values parse to the same parameters, and canonical_query
+gives them the same query string, used for the backend URL and in the
+response cache and prefetch keys.
+"""
+import re
+
+from urllib.parse import urlencode
+
+
+class InvalidSearchParameter(ValueError):
+
+    def __init__(self, msg):
+        super().__init__(msg)
+        self.msg = msg
+
+
+def canonical_query(params):
+    """
+    Order independent query string of the backend parameters
+    """
+    items = []
+    for key, value in params.items():
+        values = value if isinstance(value, (list, tuple)) else [value]
+        items.extend((key, str(v)) for v in values)
+    return urlencode(sorted(items))
+
+
+class Parameter(object):
+    # Whether all values of a repeated parameter are kept, or only the last one
+    multiple = False
+
+    def __init__(self, default=None, msg=None):
+        self.default = default
+        self.msg = msg
+
+    def clean(self, value):
+        raise NotImplementedError()
+
+
+class Integer(Parameter):
+
+    def __init__(self, default=None, min=None, max=None, msg=None):
+        super().__init__(default, msg)
+        self.min = min
+        self.max = max
+
+    def clean(self, value):
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise InvalidSearchParameter(self.msg or "expected int")
+        if self.min is not None and value < self.min:
+            raise InvalidSearchParameter(self.msg or "value must be at least %s" % self.min)
+        if self.max is not None and value > self.max:
+            raise InvalidSearchParameter(self.msg or "value must be at most %s" % self.max)
+        return value
+
+
+class Prefixed(Parameter):
+    multiple = True
+
+    def __init__(self, prefixes, msg=None):
+        super().__init__(None, msg)
+        self.pattern = re.compile(r'^(%s)(.+)$' % '|'.join(re.escape(prefix) for prefix in prefixes),
+                                  re.IGNORECASE | re.DOTALL)
+
+    def clean(self, values):
+        result = []
+        for value in values:
+            match = self.pattern.match(value)
+            if match is None:
+                raise InvalidSearchParameter(self.msg)
+            value = match.group(1).lower() + match.group(2)
+            if value not in result:
+                result.append(value)
+        return sorted(result)
+
+
+class TokenList(Parameter):
+
+    SEPARATOR = re.compile(r'[\s,]+')
+
+    def __init__(self, tokens, msg=None):
+        super().__init__(None, msg)
+        self.tokens = frozenset(token.lower() for token in tokens)
+
+    def clean(self, value):
+        tokens = [token for token in self.SEPARATOR.split(value.lower()) if token]
+        if not tokens or any(token not in self.tokens for token in tokens):
+            raise InvalidSearchParameter(self.msg)
+        return ','.join(sorted(set(tokens)))
+
+
+class SearchParameters(object):
+    """
+    Compiled parameters of a view, transforms map alternate names
+    (e.g. count) to the parameter names.
+    """
+
+    def __init__(self, parameters=None, transforms=None):
+        self.parameters = dict(parameters or {})
+        self.transforms = dict(transforms or {})
+        self._aliases = {name: [alias for alias, target in self.transforms.items() if target == name]
+                         for name in self.parameters}
+
+    def extend(self, parameters=None, transforms=None):
+        return SearchParameters({**self.parameters, **(parameters or {})},
+                                {**self.transforms, **(transforms or {})})
+
+    def parse(self, query_params):
+        """
+        Return the validated, normalized parameters of a QueryDict,
+        raises InvalidSearchParameter.
+        """
+        result = {}
+        for name, parameter in self.parameters.items():
+            values = query_params.getlist(name)
+            for alias in self._aliases[name]:
+                values = query_params.getlist(alias) or values
+            if parameter.multiple:
+                if values:
+                    result[name] = parameter.clean(values)
+            elif values:
+                result[name] = parameter.clean(values[-1])
+            elif parameter.default is not None:
+                result[name] = parameter.default
+        return result
+
+    def canonical_query(self, query_params):
+        return canonical_query(self.parse(query_params))
@@ -0,0 +1,151 @@
+"""
+Streaming pass-through of backend search Bundles.
+
+The backend body is forwarded to the client as it arrives, without being
+loaded as a whole and re-rendered. The top level Bundle object is parsed
+incrementally into events: (name, value) for each top level member,
+("entry", entry) for each Bundle.entry and ("end", None). Every event is
+handed to a callable before the bytes it was parsed from are released, so
+at most one entry (plus the current network chunk) is held in memory and no
+entry reaches the client unchecked.
+"""
+import codecs
+import json
+import re
+
+from .exceptions import UpstreamServerException
+
+# Size of the chunks read from the backend response
+STREAM_CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# Parser states
+START, KEY_OR_END, KEY, COLON, VALUE, AFTER_VALUE, ENTRY_START, ENTRY_OR_END, ENTRY, AFTER_ENTRY, DONE = range(11)
+
+
+class Incomplete(Exception):
+    pass
+
+
+class BundleStreamParser(object):
+    """
+    Incremental parser for a top level Bundle object.
+
+    feed() takes the next piece of the body and returns the prefix of the
+    body that has been parsed and checked, and is safe to forward.
+    """
+
+    decoder = json.JSONDecoder()
+
+    def __init__(self, on_event):
+        self.on_event = on_event
+        self.state = START
+        self.buffer = ''
+        self.key = None
+        self.entry_count = 0
+
+    def feed(self, text, eof=False):
+        self.buffer += text
+        pos = 0
+        try:
+            while True:
+                pos = WHITESPACE.match(self.buffer, pos).end()
+                if pos == len(self.buffer):
+                    break
+                pos = self.step(pos, eof)
+        except Incomplete:
+            if eof:
+                raise UpstreamServerException('Incomplete response from the upstream server')
+
+        if eof:
+            if self.state != DONE:
+                raise UpstreamServerException('Incomplete response from the upstream server')
+            self.on_event('end', None)
+
+        released, self.buffer = self.buffer[:pos], self.buffer[pos:]
+        return released
+
+    def decode(self, pos, eof):
+        try:
+            value, end = self.decoder.raw_decode(self.buffer, pos)
+        except ValueError:
+            raise Incomplete()
+        # A number at the end of the buffer may continue in the next piece
+        if end == len(self.buffer) and not eof:
+            raise Incomplete()
+        return value, end
+
+    def expect(self, pos, char, state):
+        if self.buffer[pos] != char:
+            raise UpstreamServerException('Invalid response from the upstream server')
+        self.state = state
+        return pos + 1
+
+    def step(self, pos, eof):
+        char = self.buffer[pos]
+        state = self.state
+
+        if state == START:
+            return self.expect(pos, '{', KEY_OR_END)
+
+        if state == KEY_OR_END and char == '}':
+            self.state = DONE
+            return pos + 1
+
+        if state in (KEY_OR_END, KEY):
+            if char != '"':
+                raise UpstreamServerException('Invalid response from the upstream server')
+            self.key, pos = self.decode(pos, eof)
+            self.state = COLON
+            return pos
+
+        if state == COLON:
+            return self.expect(pos, ':', ENTRY_START if self.key == 'entry' else VALUE)
+
+        if state == VALUE:
+            value, pos = self.decode(pos, eof)
+            self.on_event(self.key, value)
+            self.state = AFTER_VALUE
+            return pos
+
+        if state == AFTER_VALUE:
+            return self.expect(pos, '}' if char == '}' else ',', DONE if char == '}' else KEY)
+
+        if state == ENTRY_START:
+            return self.expect(pos, '[', ENTRY_OR_END)
+
+        if state == ENTRY_OR_END and char == ']':
+            self.state = AFTER_VALUE
+            return pos + 1
+
+        if state in (ENTRY_OR_END, ENTRY):
+            entry, pos = self.decode(pos, eof)
+            self.on_event('entry', entry)
+            self.entry_count += 1
+            self.state = AFTER_ENTRY
+            return pos
+
+        if state == AFTER_ENTRY:
+            return self.expect(pos, ']' if char == ']' else ',', AFTER_VALUE if char == ']' else ENTRY)
+
+        # Anything but whitespace after the Bundle
+        raise UpstreamServerException('Invalid response from the upstream server')
+
+
+def iter_bundle(chunks, on_event):
+    """
+    Yield the checked parts of a Bundle body as utf-8 bytes,
+    from an iterable of raw body chunks.
+    """
+    parser = BundleStreamParser(on_event)
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+
+    for chunk in chunks:
+        released = parser.feed(text_decoder.decode(chunk))
+        if released:
+            yield released.encode('utf-8')
+
+    released = parser.feed(text_decoder.decode(b'', final=True), eof=True)
+    if released:
+        yield released.encode('utf-8')
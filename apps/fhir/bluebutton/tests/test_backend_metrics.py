@@ -0,0 +1,116 @@
+import json
+import time
+
+from django.core.cache import caches
+from django.test import override_settings, SimpleTestCase
+from django.test.client import Client
+from django.urls import reverse
+from httmock import all_requests, HTTMock
+from unittest.mock import patch
+
+from apps.fhir.server.mock_bfd import eob_bundle
+from apps.test import BaseApiTest
+from .. import backend_metrics
+from ..backend_metrics import aggregate, interaction_of, MetricsRegistry
+
+FHIR_ID = '-20140000008325'
+BASE_URL = 'https://fhir.backend.bluebutton.hhsdevcloud.us/v1/fhir/'
+
+
+class TestBackendMetrics(SimpleTestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_interaction(self):
+        self.assertEqual(interaction_of(BASE_URL + 'Patient/' + FHIR_ID, 'Patient'), 'read')
+        self.assertEqual(interaction_of(BASE_URL + 'Patient/?_id=' + FHIR_ID, 'Patient'), 'search')
+        self.assertEqual(interaction_of(BASE_URL + 'ExplanationOfBenefit/', 'ExplanationOfBenefit'), 'search')
+
+    def test_buckets(self):
+        registry = MetricsRegistry(flush_interval=3600)
+        labels = ('Patient', 'read', '1', '200')
+        registry.observe(labels, 0.01, 500)
+        registry.observe(labels, 0.05, 2048)
+        registry.observe(labels, 60, 20 * 1024 * 1024)
+        series = registry.snapshot()[0]
+        self.assertEqual(series['labels'], list(labels))
+        self.assertEqual(series['latency']['counts'], [2, 0, 0, 0, 0, 0, 0, 0, 0, 1])
+        self.assertEqual(series['size']['counts'], [1, 1, 0, 0, 0, 1])
+
+    def test_aggregate_workers(self):
+        labels = ('ExplanationOfBenefit', 'search', '1', '200')
+        workers = [MetricsRegistry(flush_interval=3600) for _ in range(2)]
+        for number, registry in enumerate(workers):
+            registry.observe(labels, 0.2, 4096)
+            with patch.object(registry, 'worker_key', return_value='%s:worker-%d' % (backend_metrics.KEY_PREFIX, number)):
+                registry.flush()
+
+        with patch.object(backend_metrics, 'registry', MetricsRegistry()):
+            result = aggregate()
+        self.assertEqual(result['workers'], 3)
+        self.assertEqual(len(result['series']), 1)
+        series = result['series'][0]
+        self.assertEqual(series['resource_type'], 'ExplanationOfBenefit')
+        self.assertEqual(series['count'], 2)
+        self.assertEqual(series['latency_buckets'][2], 2)
+        self.assertEqual(series['size_total'], 8192)
+
+    def test_flush_in_background(self):
+        registry = MetricsRegistry(flush_interval=0.05)
+        with patch.object(registry, 'flush', wraps=registry.flush) as flush:
+            registry.observe(('Patient', 'read', '1', '200'), 0.01, 500)
+            # Not from the request thread
+            flush.assert_not_called()
+            deadline = time.monotonic() + 5
+            while not flush.called and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertTrue(flush.called)
+        self.assertEqual(caches['default'].get(registry.worker_key())['series'][0]['labels'],
+                         ['Patient', 'read', '1', '200'])
+
+    def test_worker_slots(self):
+        cache = caches['default']
+        first, second = MetricsRegistry(flush_interval=3600), MetricsRegistry(flush_interval=3600)
+        first.register(cache, 'worker-1')
+        second.register(cache, 'worker-2')
+        first.register(cache, 'worker-1')
+        self.assertEqual((first._slot, second._slot), (0, 1))
+        self.assertEqual(cache.get(backend_metrics.slot_key(1)), 'worker-2')
+
+        # A slot taken while the worker's own expired is not overwritten
+        cache.delete(backend_metrics.slot_key(0))
+        second.register(cache, 'worker-2')
+        MetricsRegistry().register(cache, 'worker-3')
+        first.register(cache, 'worker-1')
+        self.assertEqual(cache.get(backend_metrics.slot_key(0)), 'worker-3')
+        self.assertEqual(cache.get(backend_metrics.slot_key(2)), 'worker-1')
+
+
+@override_settings(FHIR_BACKEND_METRICS_ENABLED=True)
+class BackendMetricsViewTest(BaseApiTest):
+
+    def setUp(self):
+        self.read_capability = self._create_capability('Read', [])
+        self.write_capability = self._create_capability('Write', [])
+        self.client = Client()
+        caches['default'].clear()
+        backend_metrics.registry.clear()
+
+    def test_search_recorded(self):
+        @all_requests
+        def catchall(url, req):
+            return {'status_code': 200, 'content': json.dumps(eob_bundle(FHIR_ID, count=2))}
+
+        access_token = self.create_token('John', 'Smith')
+        with HTTMock(catchall):
+            response = self.client.get(reverse('bb_oauth_fhir_eob_search'),
+                                       Authorization="Bearer %s" % access_token)
+        self.assertEqual(response.status_code, 200)
+
+        series = [series for series in aggregate()['series'] if series['resource_type'] == 'ExplanationOfBenefit']
+        self.assertEqual(len(series), 1)
+        self.assertEqual(series[0]['interaction'], 'search')
+        self.assertEqual(series[0]['status'], '200')
+        self.assertEqual(series[0]['count'], 1)
+        self.assertGreater(series[0]['size_total'], 0)
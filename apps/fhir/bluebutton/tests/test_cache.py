@@ -0,0 +1,117 @@
+import json
+from unittest.mock import patch
+
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.test import override_settings
+from django.test.client import Client
+from django.urls import reverse
+from httmock import all_requests, HTTMock
+from oauth2_provider.models import get_access_token_model
+
+from apps.authorization.models import DataAccessGrant
+from apps.test import BaseApiTest
+from ..cache import cache_stats, normalize_query
+
+AccessToken = get_access_token_model()
+
+PATIENT = {
+    "resourceType": "Patient",
+    "id": "-20140000008325",
+    "name": [{"use": "usual", "family": "Doe", "given": ["Jane", "X"]}],
+}
+
+
+@override_settings(FHIR_RESPONSE_CACHE_ENABLED=True)
+class FhirResponseCacheTest(BaseApiTest):
+
+    def setUp(self):
+        self.read_capability = self._create_capability('Read', [])
+        self.write_capability = self._create_capability('Write', [])
+        self._create_capability('patient', [
+            ["GET", r"\/v1\/fhir\/Patient\/\-\d+"],
+            ["GET", "/v1/fhir/Patient"],
+        ])
+        self.client = Client()
+        self.backend_calls = 0
+        caches['default'].clear()
+        cache_stats.reset()
+
+    def _read_patient(self, access_token):
+        @all_requests
+        def catchall(url, req):
+            self.backend_calls += 1
+            return {'status_code': 200, 'content': json.dumps(PATIENT)}
+
+        with HTTMock(catchall):
+            return self.client.get(
+                reverse('bb_oauth_fhir_patient_read_or_update_or_delete',
+                        kwargs={'resource_id': '-20140000008325'}),
+                Authorization="Bearer %s" % access_token)
+
+    def _reissue_token(self, token):
+        DataAccessGrant.objects.get_or_create(beneficiary=token.user, application=token.application)
+        return AccessToken.objects.create(
+            user=token.user, application=token.application, token='cache-test-token',
+            expires=token.expires, scope=token.scope).token
+
+    def test_hit_does_not_call_backend(self):
+        access_token = self.create_token('John', 'Smith')
+
+        first = self._read_patient(access_token)
+        second = self._read_patient(access_token)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(self.backend_calls, 1)
+
+        stats = cache_stats.snapshot()['Patient']
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hit_rate'], 0.5)
+        self.assertGreater(stats['hit_bytes'], 0)
+
+    @override_settings(FHIR_RESPONSE_CACHE_ENABLED=False)
+    def test_disabled(self):
+        access_token = self.create_token('John', 'Smith')
+        self._read_patient(access_token)
+        self._read_patient(access_token)
+        self.assertEqual(self.backend_calls, 2)
+        self.assertEqual(cache_stats.snapshot(), {})
+
+    def test_generation_not_stored(self):
+        access_token = self.create_token('John', 'Smith')
+        with patch('apps.fhir.bluebutton.cache.get_cache', return_value=DummyCache('dummy', {})):
+            first = self._read_patient(access_token)
+            second = self._read_patient(access_token)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(self.backend_calls, 2)
+
+    def test_grant_revocation_purges(self):
+        access_token = self.create_token('John', 'Smith')
+        self._read_patient(access_token)
+
+        token = AccessToken.objects.get(token=access_token)
+        DataAccessGrant.objects.all().delete()
+        # Re-authorize the same beneficiary
+        self._read_patient(self._reissue_token(token))
+
+        self.assertEqual(self.backend_calls, 2)
+
+    def test_token_delete_purges(self):
+        access_token = self.create_token('John', 'Smith')
+        self._read_patient(access_token)
+
+        token = AccessToken.objects.get(token=access_token)
+        token.delete()
+        self._read_patient(self._reissue_token(token))
+
+        self.assertEqual(self.backend_calls, 2)
+
+    def test_normalize_query(self):
+        self.assertEqual(normalize_query({'b': '2', 'a': ['3', '1']}),
+                         normalize_query({'a': ['3', '1'], 'b': 2}))
+        self.assertEqual(normalize_query({'b': '2', 'a': '1'}), 'a=1&b=2')
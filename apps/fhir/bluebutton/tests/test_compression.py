@@ -0,0 +1,81 @@
+import gzip
+import json
+
+from django.test import override_settings, SimpleTestCase
+from django.test.client import Client
+from django.urls import reverse
+from httmock import all_requests, HTTMock
+from unittest import mock
+
+from apps.fhir.server.mock_bfd import eob_bundle, patient_resource
+from apps.test import BaseApiTest
+from .. import compression
+
+FHIR_ID = '-20140000008325'
+
+
+@mock.patch.object(compression, 'brotli', None)
+class TestNegotiateEncoding(SimpleTestCase):
+
+    def test_negotiate(self):
+        self.assertEqual(compression.negotiate_encoding('gzip, deflate, br'), 'gzip')
+        self.assertEqual(compression.negotiate_encoding('*'), 'gzip')
+        self.assertIsNone(compression.negotiate_encoding('gzip;q=0, deflate'))
+        self.assertIsNone(compression.negotiate_encoding('*;q=0'))
+        self.assertIsNone(compression.negotiate_encoding(''))
+
+    def test_stream_decompresses_to_body(self):
+        content = json.dumps(eob_bundle(FHIR_ID, count=5)).encode('utf-8')
+        chunks = [content[i:i + 1000] for i in range(0, len(content), 1000)]
+        parts = list(compression.compress_stream('gzip', 6, chunks))
+        self.assertEqual(gzip.decompress(b''.join(parts)), content)
+        # Flushed after each chunk, not held back until the end
+        self.assertGreater(len(parts), 2)
+
+
+@mock.patch.object(compression, 'brotli', None)
+class FhirCompressionTest(BaseApiTest):
+
+    def setUp(self):
+        self.read_capability = self._create_capability('Read', [])
+        self.write_capability = self._create_capability('Write', [])
+        self.client = Client()
+
+    def _get(self, url_name, backend_content, **kwargs):
+        access_token = self.create_token('John', 'Smith')
+
+        @all_requests
+        def catchall(url, req):
+            return {'status_code': 200, 'content': json.dumps(backend_content)}
+
+        with HTTMock(catchall):
+            return self.client.get(reverse(url_name, kwargs=kwargs),
+                                   Authorization="Bearer %s" % access_token,
+                                   HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+    def test_buffered_response(self):
+        bundle = eob_bundle(FHIR_ID, count=10)
+        response = self._get('bb_oauth_fhir_eob_search', bundle)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        self.assertEqual(json.loads(gzip.decompress(response.content).decode('utf-8')), bundle)
+
+    @override_settings(FHIR_STREAMING_ENABLED=True)
+    def test_streamed_response(self):
+        bundle = eob_bundle(FHIR_ID, count=10)
+        response = self._get('bb_oauth_fhir_eob_search', bundle)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        content = gzip.decompress(b''.join(response.streaming_content))
+        self.assertEqual(json.loads(content.decode('utf-8')), bundle)
+
+    @override_settings(FHIR_COMPRESSION_MIN_SIZE=100000)
+    def test_small_body_not_compressed(self):
+        response = self._get('bb_oauth_fhir_patient_read_or_update_or_delete', patient_resource(FHIR_ID),
+                             resource_id=FHIR_ID)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(response.json()['id'], FHIR_ID)
@@ -0,0 +1,88 @@
+import json
+
+from django.test import override_settings, SimpleTestCase
+from django.test.client import Client
+from django.urls import reverse
+from httmock import all_requests, HTTMock
+
+from apps.test import BaseApiTest
+from ..conditional import build_etag, conditional_stats
+
+FHIR_ID = '-20140000008325'
+LAST_MODIFIED = 'Tue, 07 Jul 2020 20:40:21 GMT'
+
+PATIENT = {
+    "resourceType": "Patient",
+    "id": FHIR_ID,
+    "name": [{"use": "usual", "family": "Doe", "given": ["Jane", "X"]}],
+}
+
+
+class TestBuildEtag(SimpleTestCase):
+
+    def test_scoped_to_beneficiary(self):
+        content = json.dumps(PATIENT)
+        self.assertEqual(build_etag(FHIR_ID, 'application/json', content),
+                         build_etag(FHIR_ID, 'application/json', content.encode('utf-8')))
+        self.assertNotEqual(build_etag(FHIR_ID, 'application/json', content),
+                            build_etag('-20140000008326', 'application/json', content))
+        self.assertNotEqual(build_etag(FHIR_ID, 'application/json', content),
+                            build_etag(FHIR_ID, 'application/fhir+json', content))
+
+
+class ConditionalGetTest(BaseApiTest):
+
+    def setUp(self):
+        self.read_capability = self._create_capability('Read', [])
+        self.write_capability = self._create_capability('Write', [])
+        self.client = Client()
+        self.backend_headers = {}
+        conditional_stats.reset()
+
+    def _read_patient(self, access_token, **headers):
+        @all_requests
+        def catchall(url, req):
+            return {'status_code': 200, 'content': json.dumps(PATIENT), 'headers': self.backend_headers}
+
+        with HTTMock(catchall):
+            return self.client.get(
+                reverse('bb_oauth_fhir_patient_read_or_update_or_delete',
+                        kwargs={'resource_id': FHIR_ID}),
+                Authorization="Bearer %s" % access_token, **headers)
+
+    def test_if_none_match(self):
+        access_token = self.create_token('John', 'Smith')
+
+        first = self._read_patient(access_token)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json(), PATIENT)
+        etag = first['ETag']
+
+        second = self._read_patient(access_token, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.content, b'')
+        self.assertEqual(second['ETag'], etag)
+
+        changed = self._read_patient(access_token, HTTP_IF_NONE_MATCH='"another"')
+        self.assertEqual(changed.status_code, 200)
+
+        stats = conditional_stats.snapshot()['Patient']
+        self.assertEqual((stats['responses'], stats['conditional'], stats['not_modified']), (3, 2, 1))
+        self.assertEqual(stats['not_modified_rate'], 0.3333)
+
+    def test_backend_last_modified(self):
+        self.backend_headers = {'Last-Modified': LAST_MODIFIED}
+        access_token = self.create_token('John', 'Smith')
+
+        first = self._read_patient(access_token)
+        self.assertEqual(first['Last-Modified'], LAST_MODIFIED)
+
+        second = self._read_patient(access_token, HTTP_IF_MODIFIED_SINCE=LAST_MODIFIED)
+        self.assertEqual(second.status_code, 304)
+
+    @override_settings(FHIR_CONDITIONAL_GET_ENABLED=False)
+    def test_disabled(self):
+        access_token = self.create_token('John', 'Smith')
+        response = self._read_patient(access_token)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
@@ -0,0 +1,152 @@
+import json
+import shutil
+import tempfile
+
+from datetime import timedelta
+from django.test import override_settings
+from django.test.client import Client
+from django.urls import reverse
+from django.utils import timezone
+from unittest import mock
+from waffle.testutils import override_switch
+
+from apps.authorization.models import DataAccessGrant
+from apps.fhir.server.mock_bfd import MockBFDServer
+from apps.fhir.server.settings import fhir_settings
+from apps.test import BaseApiTest
+from ..export import cleanup_expired_jobs, run_queued_jobs
+from ..models import ExportJob
+
+FHIR_ID = '-20140000008325'
+
+
+@override_settings(FHIR_EXPORT_MAX_WORKERS=0, FHIR_EXPORT_FILE_MAX_RESOURCES=50)
+class PatientExportTest(BaseApiTest):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = MockBFDServer(eob_total=120).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.read_capability = self._create_capability('Read', [])
+        self.write_capability = self._create_capability('Write', [])
+        self.client = Client()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media_root = override_settings(MEDIA_ROOT=self.media_root)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        backend = mock.patch.multiple(fhir_settings, fhir_url=self.server.url,
+                                      client_auth=False, cert_file='', key_file='')
+        backend.start()
+        self.addCleanup(backend.stop)
+
+    def _kick_off(self, access_token, params=None):
+        return self.client.get(reverse('bb_oauth_fhir_patient_export'), params or {},
+                               Authorization="Bearer %s" % access_token,
+                               HTTP_PREFER='respond-async')
+
+    def _get(self, url, access_token):
+        return self.client.get(url, Authorization="Bearer %s" % access_token)
+
+    def _export(self):
+        access_token = self.create_token('John', 'Smith')
+        response = self._kick_off(access_token)
+        self.assertEqual(response.status_code, 202)
+        status_url = response['Content-Location']
+        self.assertEqual(self._get(status_url, access_token).status_code, 202)
+        self.assertEqual(run_queued_jobs(), 1)
+        return access_token, status_url
+
+    def test_export(self):
+        access_token, status_url = self._export()
+
+        response = self._get(status_url, access_token)
+        self.assertEqual(response.status_code, 200)
+        manifest = response.json()
+        self.assertTrue(manifest['requiresAccessToken'])
+        self.assertEqual([(output['type'], output['count']) for output in manifest['output']],
+                         [('Patient', 1), ('Coverage', 4), ('ExplanationOfBenefit', 50),
+                          ('ExplanationOfBenefit', 50), ('ExplanationOfBenefit', 20)])
+
+        eob_ids = []
+        for output in manifest['output']:
+            response = self._get(output['url'], access_token)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/fhir+ndjson')
+            resources = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+            self.assertEqual(len(resources), output['count'])
+            self.assertTrue(all(resource['resourceType'] == output['type'] for resource in resources))
+            eob_ids += [resource['id'] for resource in resources if output['type'] == 'ExplanationOfBenefit']
+        self.assertEqual(len(set(eob_ids)), 120)
+
+    def test_one_active_job(self):
+        access_token = self.create_token('John', 'Smith')
+        self.assertEqual(self._kick_off(access_token).status_code, 202)
+        self.assertEqual(self._kick_off(access_token).status_code, 429)
+
+    def test_prefer_respond_async_required(self):
+        access_token = self.create_token('John', 'Smith')
+        response = self.client.get(reverse('bb_oauth_fhir_patient_export'),
+                                   Authorization="Bearer %s" % access_token)
+        self.assertEqual(response.status_code, 400)
+
+    @override_switch('require-scopes', active=True)
+    def test_types_limited_to_scopes(self):
+        self.read_capability.protected_resources = json.dumps([["GET", "/v1/fhir/Coverage/"]])
+        self.read_capability.save()
+        access_token = self.create_token('John', 'Smith')
+        self.assertEqual(self._kick_off(access_token, {'_type': 'ExplanationOfBenefit'}).status_code, 403)
+        self.assertEqual(self._kick_off(access_token).status_code, 202)
+        self.assertEqual(ExportJob.objects.get().get_resource_types(), ['Coverage'])
+
+    def test_resume_from_checkpoint(self):
+        access_token = self.create_token('John', 'Smith')
+        self._kick_off(access_token, {'_type': 'ExplanationOfBenefit'})
+        job = ExportJob.objects.get()
+        # As left by a worker that stopped after the first file
+        job.set_checkpoint({'ExplanationOfBenefit': {'start_index': 100, 'done': False, 'files': [
+            {'name': 'ExplanationOfBenefit-1.ndjson', 'path': job.storage_prefix + 'ExplanationOfBenefit-1.ndjson',
+             'count': 100}]}})
+        job.status = ExportJob.IN_PROGRESS
+        job.save()
+        ExportJob.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+
+        requests_before = self.server.request_count
+        self.assertEqual(run_queued_jobs(), 1)
+        self.assertEqual(self.server.request_count - requests_before, 1)
+        checkpoint = ExportJob.objects.get().get_checkpoint()['ExplanationOfBenefit']
+        self.assertEqual([f['count'] for f in checkpoint['files']], [100, 20])
+        self.assertEqual(checkpoint['start_index'], 120)
+
+    def test_cancel(self):
+        access_token, status_url = self._export()
+        file_url = self._get(status_url, access_token).json()['output'][0]['url']
+
+        response = self.client.delete(status_url, Authorization="Bearer %s" % access_token)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self._get(status_url, access_token).status_code, 404)
+        self.assertEqual(self._get(file_url, access_token).status_code, 404)
+        self.assertEqual(self.client.delete(status_url, Authorization="Bearer %s" % access_token).status_code, 404)
+
+    def test_revoked_grant_fails_job(self):
+        access_token = self.create_token('John', 'Smith')
+        self._kick_off(access_token)
+        DataAccessGrant.objects.all().delete()
+        run_queued_jobs()
+        job = ExportJob.objects.get()
+        self.assertEqual(job.status, ExportJob.FAILED)
+        self.assertIn('revoked', job.error)
+
+    def test_cleanup_expired_jobs(self):
+        access_token, status_url = self._export()
+        with override_settings(FHIR_EXPORT_RETENTION=0):
+            self.assertEqual(self._get(status_url, access_token).status_code, 404)
+            self.assertEqual(cleanup_expired_jobs(), 1)
+        self.assertFalse(ExportJob.objects.exists())
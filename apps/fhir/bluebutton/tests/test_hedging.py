@@ -0,0 +1,179 @@
+import json
+import threading
+
+from django.test import override_settings, SimpleTestCase
+from django.test.client import Client
+from django.urls import reverse
+from httmock import all_requests, HTTMock
+from unittest.mock import patch
+
+from apps.fhir.server.mock_bfd import patient_resource
+from apps.test import BaseApiTest
+from ..hedging import Hedger, RetryBudget, HEDGE, PRIMARY
+
+FHIR_ID = '-20140000008325'
+
+
+def make_hedger(**kwargs):
+    options = {'max_workers': 4, 'percentile': 95, 'min_delay': 0.05, 'min_samples': 5,
+               'budget_ratio': 1.0, 'budget_max': 10}
+    options.update(kwargs)
+    hedger = Hedger(**options)
+    for _ in range(options['min_samples']):
+        hedger.delays.record('Patient', 0.01)
+    return hedger
+
+
+class TestRetryBudget(SimpleTestCase):
+
+    def test_hedges_limited_to_ratio(self):
+        budget = RetryBudget(ratio=0.1, max_tokens=10)
+        for _ in range(9):
+            budget.deposit()
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+        snapshot = budget.snapshot()
+        self.assertEqual((snapshot['withdrawals'], snapshot['denied']), (1, 2))
+
+    def test_tokens_capped(self):
+        budget = RetryBudget(ratio=1.0, max_tokens=2)
+        for _ in range(5):
+            budget.deposit()
+        self.assertTrue(budget.withdraw())
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+
+
+class TestHedger(SimpleTestCase):
+
+    def test_fast_primary_is_not_hedged(self):
+        hedger = make_hedger()
+        attempts = []
+
+        def send_attempt(attempt):
+            attempts.append(attempt)
+            return 'response %s' % attempt
+
+        self.assertEqual(hedger.send('Patient', send_attempt, 30), ('response 1', PRIMARY, False))
+        self.assertEqual(attempts, [PRIMARY])
+        self.assertEqual(hedger.stats()['hedged'], 0)
+
+    def test_slow_primary_is_hedged(self):
+        hedger = make_hedger()
+        release = threading.Event()
+        losers = []
+        loser_done = threading.Event()
+
+        def send_attempt(attempt):
+            if attempt == PRIMARY:
+                release.wait(5)
+            return 'response %s' % attempt
+
+        def on_loser(attempt, response):
+            losers.append((attempt, response))
+            loser_done.set()
+
+        self.assertEqual(hedger.send('Patient', send_attempt, 30, on_loser), ('response 2', HEDGE, True))
+        release.set()
+        self.assertTrue(loser_done.wait(5))
+        self.assertEqual(losers, [(PRIMARY, 'response 1')])
+        stats = hedger.stats()
+        self.assertEqual((stats['hedged'], stats['hedge_won']), (1, 1))
+
+    def test_hedges_have_their_own_workers(self):
+        hedger = make_hedger(max_workers=1, max_hedges=1)
+        release = threading.Event()
+
+        def send_attempt(attempt):
+            if attempt == PRIMARY:
+                release.wait(5)
+            return 'response %s' % attempt
+
+        # The only primary worker is busy with the slow primary
+        self.assertEqual(hedger.send('Patient', send_attempt, 30), ('response 2', HEDGE, True))
+        release.set()
+        hedger.wait(5)
+
+    def test_no_hedge_without_budget(self):
+        hedger = make_hedger(budget_ratio=0.1)
+        release = threading.Event()
+        attempts = []
+
+        def send_attempt(attempt):
+            attempts.append(attempt)
+            release.wait(0.2)
+            return 'response %s' % attempt
+
+        self.assertEqual(hedger.send('Patient', send_attempt, 30), ('response 1', PRIMARY, False))
+        self.assertEqual(attempts, [PRIMARY])
+        self.assertEqual(hedger.stats()['retry_budget']['denied'], 1)
+
+    def test_no_hedge_without_latencies(self):
+        hedger = make_hedger()
+        attempts = []
+
+        def send_attempt(attempt):
+            attempts.append((attempt, threading.current_thread()))
+            return 'response %s' % attempt
+
+        self.assertEqual(hedger.send('Coverage', send_attempt, 30), ('response 1', PRIMARY, False))
+        # Sent from the calling thread
+        self.assertEqual(attempts, [(PRIMARY, threading.current_thread())])
+        self.assertEqual(hedger.stats()['direct'], 1)
+
+    def test_failed_attempt_is_not_an_answer(self):
+        hedger = make_hedger()
+        release = threading.Event()
+
+        def send_attempt(attempt):
+            if attempt == PRIMARY:
+                release.wait(5)
+                return 'response 1'
+            raise ConnectionError()
+
+        self.assertEqual(hedger.send('Patient', send_attempt, 30)[:2], ('response 1', PRIMARY))
+        release.set()
+        hedger.wait(5)
+
+
+@override_settings(FHIR_HEDGING_ENABLED=True)
+class HedgedReadTest(BaseApiTest):
+
+    def setUp(self):
+        self.read_capability = self._create_capability('Read', [])
+        self.write_capability = self._create_capability('Write', [])
+        self.client = Client()
+        self.hedger = make_hedger()
+
+    def test_hedged_read_is_logged(self):
+        release = threading.Event()
+        calls = []
+
+        @all_requests
+        def catchall(url, req):
+            calls.append(url)
+            if len(calls) == 1:
+                # The primary attempt answers once the hedge has
+                release.wait(5)
+            return {'status_code': 200, 'content': json.dumps(patient_resource(FHIR_ID))}
+
+        access_token = self.create_token('John', 'Smith')
+        with patch('apps.fhir.bluebutton.hedging.hedger', self.hedger), HTTMock(catchall):
+            with self.assertLogs('audit.data.fhir', 'INFO') as logs:
+                response = self.client.get(
+                    reverse('bb_oauth_fhir_patient_read_or_update_or_delete',
+                            kwargs={'resource_id': FHIR_ID}),
+                    Authorization="Bearer %s" % access_token)
+                release.set()
+                self.hedger.wait(5)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(calls), 2)
+        events = [json.loads(line.split(':', 2)[2]) for line in logs.output]
+        self.assertIn({'attempt': HEDGE}, [event.get('hedge') for event in events
+                                           if event['type'] == 'fhir_pre_fetch'])
+        self.assertIn({'attempt': HEDGE, 'won': True}, [event.get('hedge') for event in events
+                                                        if event['type'] == 'fhir_post_fetch'])
+        self.assertEqual(self.hedger.stats()['hedge_won'], 1)
@@ -5,7 +5,18 @@ Created: 7/19/16 9:04 AM
 
 File created by: ''
 """
+import json
+import threading
+import time
+
 from django.test import TestCase, RequestFactory
+from django.test.client import Client
+from django.urls import reverse
+from httmock import all_requests, HTTMock
+from unittest.mock import patch
+
+from apps.fhir.server.mock_bfd import capability_statement
+from ..capability import CapabilityStatement
 
 
 class BlueButtonReadRequestTest(TestCase):
@@ -28,3 +39,75 @@ class ConformanceFilterTest(TestCase):
     # Make call to Conformance Statement
 
     # Test that Patient is only resource displayed
+
+
+class CapabilityStatementTest(TestCase):
+    """ Test the precomputed Conformance Statement """
+
+    def setUp(self):
+        self.client = Client()
+        self.statement = CapabilityStatement(refresh_interval=3600, retry_interval=0)
+        self.calls = []
+        self.available = True
+
+        @all_requests
+        def backend(url, req):
+            self.calls.append(url)
+            if not self.available:
+                return {'status_code': 503, 'content': ''}
+            return {'status_code': 200, 'content': json.dumps(capability_statement())}
+
+        self.backend = backend
+
+    def get_metadata(self, **extra):
+        with patch('apps.fhir.bluebutton.views.home.capability_statement', self.statement), HTTMock(self.backend):
+            return self.client.get(reverse('fhir_conformance_metadata'), **extra)
+
+    def test_fetched_once(self):
+        response = self.get_metadata()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('max-age=', response['Cache-Control'])
+        content = response.json()
+        self.assertEqual([r['type'] for r in content['rest'][0]['resource']],
+                         ["Coverage", "ExplanationOfBenefit", "Patient"])
+        self.assertIn('security', content['rest'][0])
+
+        again = self.get_metadata()
+        self.assertEqual(again.content, response.content)
+        self.assertEqual(len(self.calls), 1)
+
+        not_modified = self.get_metadata(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_last_good_copy_kept(self):
+        response = self.get_metadata()
+        self.available = False
+        with HTTMock(self.backend):
+            self.statement.refresh()
+        self.assertEqual(self.get_metadata().content, response.content)
+        self.assertEqual(self.statement.stats()['failures'], 1)
+
+    def test_unavailable_without_copy(self):
+        self.available = False
+        self.assertEqual(self.get_metadata().status_code, 503)
+
+    def test_first_requests_share_one_fetch(self):
+        fetches = []
+
+        def slow_fetch():
+            fetches.append(1)
+            time.sleep(0.2)
+            return {'resourceType': 'CapabilityStatement', 'rest': [{'resource': []}]}
+
+        request = RequestFactory().get(reverse('fhir_conformance_metadata'))
+        documents = []
+        with patch('apps.fhir.bluebutton.capability.fetch_statement', slow_fetch):
+            threads = [threading.Thread(target=lambda: documents.append(self.statement.get(request)))
+                       for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(5)
+        self.assertEqual(len(fetches), 1)
+        self.assertEqual(len(documents), 4)
@@ -0,0 +1,52 @@
+import json
+
+from django.core.cache import caches
+from django.test.client import Client
+from django.urls import reverse
+from httmock import all_requests, HTTMock
+
+from apps.fhir.server.mock_bfd import eob_bundle
+from apps.test import BaseApiTest
+
+FHIR_ID = '-20140000008325'
+
+# Queries of a FHIR read or search: the token with its application and
+# beneficiary, the crosswalk, the application last_active update, the
+# grant and the require-scopes switch. The developer and the application
+# are not loaded again.
+QUERY_BUDGET = 5
+
+
+class TestIdentity(BaseApiTest):
+
+    def setUp(self):
+        self.read_capability = self._create_capability('Read', [])
+        self.write_capability = self._create_capability('Write', [])
+        self.client = Client()
+        self.token = self.create_token('John', 'Smith')
+        self.headers = []
+        # Switches are otherwise read from the cache or the database depending on the tests run before
+        caches['default'].clear()
+
+    def _get(self, url, content):
+        @all_requests
+        def catchall(url, req):
+            self.headers.append(req.headers)
+            return {'status_code': 200, 'content': json.dumps(content)}
+
+        with HTTMock(catchall), self.assertNumQueries(QUERY_BUDGET):
+            response = self.client.get(url, Authorization="Bearer %s" % self.token)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_read_query_budget(self):
+        self._get(reverse('bb_oauth_fhir_patient_read_or_update_or_delete', kwargs={'resource_id': FHIR_ID}),
+                  {'resourceType': 'Patient', 'id': FHIR_ID})
+
+        self.assertEqual(self.headers[0]['BlueButton-BeneficiaryId'], 'patientId:' + FHIR_ID)
+        self.assertNotEqual(self.headers[0]['BlueButton-DeveloperId'], '')
+
+    def test_search_query_budget(self):
+        self._get(reverse('bb_oauth_fhir_eob_search'), eob_bundle(FHIR_ID, count=2))
+
+        self.assertEqual(self.headers[0]['BlueButton-BeneficiaryId'], 'patientId:' + FHIR_ID)
@@ -0,0 +1,172 @@
+import json
+import requests
+import threading
+
+from unittest.mock import patch
+
+from django.core.cache import caches
+from django.test import override_settings, SimpleTestCase
+from django.test.client import Client
+from django.urls import reverse
+from httmock import all_requests, HTTMock
+from urllib.parse import parse_qs
+
+from apps.fhir.server.mock_bfd import eob_bundle
+from apps.fhir.server.router import Endpoint, load_balancer
+from apps.test import BaseApiTest
+from ..prefetch import Prefetcher, prefetcher
+
+FHIR_ID = '-20140000008325'
+
+
+def page(content):
+    response = requests.Response()
+    response._content = content
+    return response
+
+
+class TestPrefetcher(SimpleTestCase):
+
+    def test_take_once(self):
+        p = Prefetcher(max_workers=2, max_bytes=100, ttl=30)
+        p.schedule('a', lambda: page(b'page'))
+        p.wait()
+        self.assertEqual(p.take('a').content, b'page')
+        self.assertIsNone(p.take('a'))
+        stats = p.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['prefetched']), (1, 1, 1))
+
+    def test_expired_pages_are_wasted(self):
+        p = Prefetcher(max_workers=2, max_bytes=100, ttl=0)
+        p.schedule('a', lambda: page(b'page'))
+        p.wait()
+        self.assertIsNone(p.take('a'))
+        stats = p.stats()
+        self.assertEqual(stats['wasted'], 1)
+        self.assertEqual(stats['wasted_rate'], 1.0)
+
+    def test_oldest_pages_evicted_over_max_bytes(self):
+        p = Prefetcher(max_workers=1, max_bytes=10, ttl=30)
+        for key in ('a', 'b', 'c'):
+            p.schedule(key, lambda: page(b'12345'))
+            p.wait()
+        stats = p.stats()
+        self.assertEqual(stats['bytes_held'], 10)
+        self.assertEqual(stats['wasted'], 1)
+        self.assertIsNone(p.take('a'))
+        self.assertEqual(p.take('c').content, b'12345')
+
+    def test_dropped_over_max_workers(self):
+        p = Prefetcher(max_workers=1, max_bytes=100, ttl=30)
+        release = threading.Event()
+        p.schedule('a', lambda: release.wait() and page(b'a'))
+        p.schedule('b', lambda: page(b'b'))
+        release.set()
+        p.wait()
+        stats = p.stats()
+        self.assertEqual((stats['scheduled'], stats['dropped']), (1, 1))
+
+
+@override_settings(FHIR_EOB_PREFETCH_ENABLED=True)
+class EOBPrefetchTest(BaseApiTest):
+
+    def setUp(self):
+        self.read_capability = self._create_capability('Read', [])
+        self.write_capability = self._create_capability('Write', [])
+        self.client = Client()
+        self.backend_start_indexes = []
+        self.access_token = self.create_token('John', 'Smith')
+        prefetcher.clear()
+
+    def _get_pages(self, start_indexes, count=5, headers=None, **query):
+        @all_requests
+        def catchall(url, req):
+            start_index = int(parse_qs(url.query)['startIndex'][0])
+            self.backend_start_indexes.append(start_index)
+            return {'status_code': 200, 'headers': headers or {},
+                    'content': json.dumps(eob_bundle(FHIR_ID, start_index=start_index, count=count, total=12))}
+
+        responses = []
+        with HTTMock(catchall):
+            for start_index in start_indexes:
+                response = self.client.get(reverse('bb_oauth_fhir_eob_search'),
+                                           dict(query, startIndex=start_index, _count=count),
+                                           Authorization="Bearer %s" % self.access_token)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()['entry'][0]['resource']['id'],
+                                 eob_bundle(FHIR_ID, start_index=start_index, count=count)['entry'][0]['resource']['id'])
+                prefetcher.wait(timeout=5)
+                responses.append(response)
+        return responses
+
+    def test_next_page_is_prefetched(self):
+        self._get_pages((0, 5, 10))
+
+        # Pages 2 and 3 came from the prefetch, there is no page after 3
+        self.assertEqual(sorted(self.backend_start_indexes), [0, 5, 10])
+        stats = prefetcher.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['prefetched']), (2, 1, 2))
+
+    def test_prefetch_shared_by_endpoints(self):
+        endpoints = [Endpoint({'FHIR_URL': 'https://bfd-east.test/v1/fhir/'}),
+                     Endpoint({'FHIR_URL': 'https://bfd-west.test/v1/fhir/'})]
+        hosts = []
+
+        @all_requests
+        def catchall(url, req):
+            hosts.append(url.netloc)
+            start_index = int(parse_qs(url.query)['startIndex'][0])
+            self.backend_start_indexes.append(start_index)
+            return {'status_code': 200,
+                    'content': json.dumps(eob_bundle(FHIR_ID, start_index=start_index, count=5, total=12))}
+
+        # The first page request goes to the east endpoint, the second to the west one
+        chosen = [endpoints[0]]
+        with patch.object(load_balancer, 'endpoints', endpoints), \
+                patch.object(load_balancer, 'choose', side_effect=lambda: chosen[0]), \
+                HTTMock(catchall):
+            for start_index, endpoint in ((0, endpoints[0]), (5, endpoints[1])):
+                chosen[0] = endpoint
+                response = self.client.get(reverse('bb_oauth_fhir_eob_search'),
+                                           {'startIndex': start_index, '_count': 5},
+                                           Authorization="Bearer %s" % self.access_token)
+                self.assertEqual(response.status_code, 200)
+                prefetcher.wait(timeout=5)
+
+        # Page 2 prefetched from east was served to the request sent to west
+        self.assertEqual(self.backend_start_indexes, [0, 5, 10])
+        self.assertEqual(hosts, ['bfd-east.test', 'bfd-east.test', 'bfd-west.test'])
+        self.assertEqual(prefetcher.stats()['hits'], 1)
+
+    def test_prefetch_keyed_on_query(self):
+        # The page at startIndex 5 of 3 resources a page is not the prefetched one
+        self._get_pages((0,), count=5)
+        self._get_pages((5,), count=3)
+        self.assertEqual(prefetcher.stats()['hits'], 0)
+
+    @override_settings(FHIR_CONDITIONAL_GET_ENABLED=True)
+    def test_prefetched_page_has_last_modified(self):
+        last_modified = 'Wed, 21 Oct 2015 07:28:00 GMT'
+        responses = self._get_pages((0, 5), headers={'Last-Modified': last_modified})
+        self.assertEqual(prefetcher.stats()['hits'], 1)
+        self.assertEqual(responses[1]['Last-Modified'], last_modified)
+
+    @override_settings(FHIR_RESPONSE_CACHE_ENABLED=True, FHIR_RESPONSE_CACHE_TTL={'ExplanationOfBenefit': 60})
+    def test_prefetched_page_is_cached(self):
+        caches['default'].clear()
+        self._get_pages((0, 5, 5))
+        # Page 2 was prefetched once, then served from the response cache
+        self.assertEqual(sorted(self.backend_start_indexes), [0, 5, 10])
+        self.assertEqual(prefetcher.stats()['hits'], 1)
+
+    def test_prefetch_logged_as_own_call(self):
+        with self.assertLogs('audit.data.fhir', 'INFO') as logs:
+            self._get_pages((0,))
+
+        events = [json.loads(line.split(':', 2)[2]) for line in logs.output]
+        pre_fetches = [event for event in events if event['type'] == 'fhir_pre_fetch']
+        self.assertEqual(len(pre_fetches), 2)
+        served, prefetched = pre_fetches
+        self.assertNotIn('prefetch_of', served)
+        self.assertEqual(prefetched['prefetch_of'], served['uuid'])
+        self.assertNotEqual(prefetched['uuid'], served['uuid'])
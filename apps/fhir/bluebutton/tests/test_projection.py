@@ -0,0 +1,177 @@
+import json
+from unittest.mock import patch
+
+from django.http import QueryDict
+from django.test import override_settings, SimpleTestCase
+from django.test.client import Client
+from django.urls import reverse
+from httmock import all_requests, HTTMock
+from urllib.parse import parse_qs
+
+from apps.fhir.server.mock_bfd import eob_bundle, patient_resource
+from apps.test import BaseApiTest
+from ..projection import Projection, projection_stats, SUBSETTED_TAG
+from ..search_parameters import InvalidSearchParameter
+
+FHIR_ID = '-20140000008325'
+
+SEARCH_SUMMARY_VALUES = ('true', 'count', 'data', 'false')
+
+
+def projection(query):
+    return Projection.from_query(QueryDict(query), SEARCH_SUMMARY_VALUES)
+
+
+class TestProjection(SimpleTestCase):
+
+    def test_no_projection(self):
+        self.assertFalse(projection(''))
+        self.assertFalse(projection('_summary=false'))
+        patient = patient_resource(FHIR_ID)
+        self.assertIs(projection('_summary=false').apply(patient), patient)
+
+    def test_invalid_values(self):
+        with self.assertRaisesMessage(InvalidSearchParameter, 'the _summary parameter value is not valid'):
+            Projection.from_query(QueryDict('_summary=count'), ('true', 'data', 'false'))
+        with self.assertRaisesMessage(InvalidSearchParameter, 'the _elements parameter value is not valid'):
+            projection('_elements=name,a.b')
+
+    def test_elements(self):
+        patient = projection('_elements=gender, birthDate').apply(patient_resource(FHIR_ID))
+        self.assertEqual(sorted(patient), ['birthDate', 'gender', 'id', 'meta', 'resourceType'])
+        self.assertEqual(patient['meta']['tag'], [SUBSETTED_TAG])
+        self.assertEqual(patient['meta']['lastUpdated'], patient_resource(FHIR_ID)['meta']['lastUpdated'])
+
+    def test_summary_true(self):
+        patient = projection('_summary=true').apply(patient_resource(FHIR_ID))
+        self.assertNotIn('extension', patient)
+        self.assertIn('name', patient)
+
+    def test_summary_data(self):
+        patient = dict(patient_resource(FHIR_ID), text={'status': 'generated', 'div': '<div></div>'})
+        self.assertNotIn('text', projection('_summary=data').apply(patient))
+
+    def test_bundle_entries(self):
+        bundle = projection('_elements=type,billablePeriod').apply(eob_bundle(FHIR_ID, count=3))
+        self.assertEqual(bundle['total'], 100)
+        for entry in bundle['entry']:
+            self.assertEqual(sorted(entry['resource']),
+                             ['billablePeriod', 'id', 'meta', 'resourceType', 'type'])
+
+    def test_summary_count(self):
+        self.assertEqual(projection('_summary=count').backend_parameters('ExplanationOfBenefit'), {'_count': 0})
+        bundle = projection('_summary=count').apply(eob_bundle(FHIR_ID, count=3))
+        self.assertNotIn('entry', bundle)
+        self.assertEqual(bundle['total'], 100)
+
+
+class ProjectionViewTest(BaseApiTest):
+
+    def setUp(self):
+        self.read_capability = self._create_capability('Read', [])
+        self.write_capability = self._create_capability('Write', [])
+        self.client = Client()
+        projection_stats.reset()
+
+    def test_summary_count_search(self):
+        backend_counts = []
+
+        @all_requests
+        def catchall(url, req):
+            count = int(parse_qs(url.query)['_count'][0])
+            backend_counts.append(count)
+            return {'status_code': 200, 'content': json.dumps(eob_bundle(FHIR_ID, count=count, total=12))}
+
+        access_token = self.create_token('John', 'Smith')
+        with HTTMock(catchall):
+            response = self.client.get(reverse('bb_oauth_fhir_eob_search'), {'_summary': 'count'},
+                                       Authorization="Bearer %s" % access_token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(backend_counts, [0])
+        self.assertEqual(response.json()['total'], 12)
+        self.assertNotIn('entry', response.json())
+
+    def test_elements_search(self):
+        @all_requests
+        def catchall(url, req):
+            self.assertNotIn('_elements', parse_qs(url.query))
+            return {'status_code': 200, 'content': json.dumps(eob_bundle(FHIR_ID, count=5, total=12))}
+
+        access_token = self.create_token('John', 'Smith')
+        with HTTMock(catchall):
+            response = self.client.get(reverse('bb_oauth_fhir_eob_search'), {'_elements': 'type'},
+                                       Authorization="Bearer %s" % access_token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(response.json()['entry'][0]['resource']), ['id', 'meta', 'resourceType', 'type'])
+
+        stats = list(projection_stats.snapshot().values())
+        self.assertEqual(len(stats), 1)
+        self.assertEqual((stats[0]['responses'], stats[0]['sampled']), (1, 1))
+        self.assertLess(stats[0]['bytes_after'], stats[0]['bytes_before'])
+
+    @override_settings(FHIR_PROJECTION_BACKEND_PARAMETERS=['_elements'])
+    def test_forwarded_elements_keep_reference(self):
+        backend_elements = []
+
+        @all_requests
+        def catchall(url, req):
+            # A backend applying _elements
+            elements = parse_qs(url.query)['_elements'][0].split(',')
+            backend_elements.append(elements)
+            bundle = eob_bundle(FHIR_ID, count=5, total=12)
+            for entry in bundle['entry']:
+                entry['resource'] = {key: value for key, value in entry['resource'].items()
+                                     if key in elements or key in ('resourceType', 'id', 'meta')}
+            return {'status_code': 200, 'content': json.dumps(bundle)}
+
+        access_token = self.create_token('John', 'Smith')
+        with HTTMock(catchall):
+            response = self.client.get(reverse('bb_oauth_fhir_eob_search'), {'_elements': 'type'},
+                                       Authorization="Bearer %s" % access_token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(backend_elements, [['patient', 'type']])
+        # Checked against the beneficiary, then dropped
+        self.assertEqual(sorted(response.json()['entry'][0]['resource']), ['id', 'meta', 'resourceType', 'type'])
+
+    @override_settings(FHIR_PROJECTION_BACKEND_PARAMETERS=['_elements'])
+    def test_forwarded_elements_read(self):
+        backend_elements = []
+
+        @all_requests
+        def catchall(url, req):
+            backend_elements.append(parse_qs(url.query)['_elements'][0])
+            return {'status_code': 200, 'content': json.dumps(patient_resource(FHIR_ID))}
+
+        access_token = self.create_token('John', 'Smith')
+        with HTTMock(catchall):
+            response = self.client.get(
+                reverse('bb_oauth_fhir_patient_read_or_update_or_delete', kwargs={'resource_id': FHIR_ID}),
+                {'_elements': 'gender'}, Authorization="Bearer %s" % access_token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(backend_elements, ['gender,id'])
+        self.assertEqual(sorted(response.json()), ['gender', 'id', 'meta', 'resourceType'])
+
+    @override_settings(FHIR_PROJECTION_STATS_SAMPLE_EVERY=2)
+    def test_sizes_sampled(self):
+        @all_requests
+        def catchall(url, req):
+            return {'status_code': 200, 'content': json.dumps(eob_bundle(FHIR_ID, count=5, total=12))}
+
+        access_token = self.create_token('John', 'Smith')
+        with HTTMock(catchall), patch.object(projection_stats, 'record', wraps=projection_stats.record) as record:
+            for _ in range(3):
+                response = self.client.get(reverse('bb_oauth_fhir_eob_search'), {'_elements': 'type'},
+                                           Authorization="Bearer %s" % access_token)
+                self.assertEqual(response.status_code, 200)
+
+        stats = list(projection_stats.snapshot().values())[0]
+        self.assertEqual((stats['responses'], stats['sampled']), (3, 2))
+        # Sizes of the first and third responses only
+        self.assertEqual(record.call_count, 2)
+
+    def test_invalid_summary(self):
+        access_token = self.create_token('John', 'Smith')
+        response = self.client.get(reverse('bb_oauth_fhir_eob_search'), {'_summary': 'text'},
+                                   Authorization="Bearer %s" % access_token)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['detail'], 'the _summary parameter value is not valid')
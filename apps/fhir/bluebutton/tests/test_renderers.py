@@ -0,0 +1,46 @@
+import datetime
+import decimal
+import io
+import uuid
+
+from django.test import SimpleTestCase
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+
+from apps.fhir import fastjson
+from apps.fhir.parsers import FHIRParser
+from apps.fhir.renderers import FHIRRenderer
+from apps.fhir.server.mock_bfd import eob_bundle
+
+FHIR_ID = '-20140000008325'
+
+
+class TestFastJSON(SimpleTestCase):
+
+    def test_renders_as_json_renderer(self):
+        for data in (
+            eob_bundle(FHIR_ID, count=5),
+            {"text": "José 中     \"quoted\"", "values": [1, 2.5, -0.0, 1752.25, 0.001, True, None]},
+            {"when": datetime.datetime(2020, 7, 7, 20, 40, 21, 347123, tzinfo=datetime.timezone.utc),
+             "day": datetime.date(2020, 7, 7), "id": uuid.UUID(int=1), "amount": decimal.Decimal('10.50')},
+        ):
+            self.assertEqual(FHIRRenderer().render(data), JSONRenderer().render(data))
+
+    def test_exponents_parse_equal(self):
+        # orjson writes 1e16 where the json module writes 1e+16, both are valid JSON numbers
+        data = {"values": [1e16, 1e-7]}
+        self.assertEqual(fastjson.loads(FHIRRenderer().render(data)), fastjson.loads(JSONRenderer().render(data)))
+
+    def test_indent_requested(self):
+        data = {"resourceType": "Patient", "id": FHIR_ID}
+        self.assertEqual(FHIRRenderer().render(data, 'application/fhir+json; indent=2'),
+                         JSONRenderer().render(data, 'application/json; indent=2'))
+
+    def test_round_trip(self):
+        bundle = eob_bundle(FHIR_ID, count=5)
+        self.assertEqual(fastjson.loads(fastjson.dumps(bundle)), bundle)
+        self.assertEqual(FHIRParser().parse(io.BytesIO(fastjson.dumps(bundle))), bundle)
+
+    def test_parse_error(self):
+        with self.assertRaises(ParseError):
+            FHIRParser().parse(io.BytesIO(b'{"resourceType": '))
@@ -0,0 +1,48 @@
+from django.http import QueryDict
+from django.test import SimpleTestCase
+
+from ..search_parameters import InvalidSearchParameter
+from ..views.search import SearchViewExplanationOfBenefit, SearchViewPatient
+
+EOB_TYPE_SYSTEM = 'https://bluebutton.cms.gov/resources/codesystem/eob-type'
+
+
+class TestSearchParameters(SimpleTestCase):
+
+    def parse(self, query, view=SearchViewExplanationOfBenefit):
+        return view.QUERY_PARAMETERS.parse(QueryDict(query))
+
+    def test_defaults_and_unknown_parameters(self):
+        self.assertEqual(self.parse('foo=bar'), {'startIndex': 0, '_count': 10})
+
+    def test_count_alias(self):
+        self.assertEqual(self.parse('count=5&_count=20')['_count'], 5)
+
+    def test_integer_errors(self):
+        with self.assertRaisesMessage(InvalidSearchParameter, 'expected int'):
+            self.parse('startIndex=one')
+        with self.assertRaisesMessage(InvalidSearchParameter, 'value must be at most 50'):
+            self.parse('_count=51')
+
+    def test_last_updated_normalized(self):
+        params = self.parse('_lastUpdated=LT2020-01-01&_lastUpdated=ge2019-01-01&_lastUpdated=lt2020-01-01')
+        self.assertEqual(params['_lastUpdated'], ['ge2019-01-01', 'lt2020-01-01'])
+        with self.assertRaisesMessage(InvalidSearchParameter, 'the _lastUpdated operator is not valid'):
+            self.parse('_lastUpdated=zz2020-01-01')
+
+    def test_type_normalized(self):
+        self.assertEqual(self.parse('type=PDE, carrier,pde,%s|SNF' % EOB_TYPE_SYSTEM)['type'],
+                         'carrier,%s|snf,pde' % EOB_TYPE_SYSTEM)
+        self.assertEqual(self.parse('type=%s|' % EOB_TYPE_SYSTEM)['type'], '%s|' % EOB_TYPE_SYSTEM)
+        for value in ('carrier,INVALID-TYPE,dme', ',', 'carrierpde'):
+            with self.assertRaisesMessage(InvalidSearchParameter, 'the type parameter value is not valid'):
+                self.parse('type=%s' % value)
+
+    def test_type_only_for_eob(self):
+        self.assertNotIn('type', self.parse('type=pde', view=SearchViewPatient))
+
+    def test_canonical_query(self):
+        parameters = SearchViewExplanationOfBenefit.QUERY_PARAMETERS
+        self.assertEqual(
+            parameters.canonical_query(QueryDict('type=pde,carrier&_lastUpdated=lt2020&count=5')),
+            parameters.canonical_query(QueryDict('_count=5&_lastUpdated=LT2020&type=Carrier,pde,pde&startIndex=0')))
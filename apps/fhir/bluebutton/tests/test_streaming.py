@@ -0,0 +1,105 @@
+import json
+
+from django.test import override_settings, SimpleTestCase
+from django.test.client import Client
+from django.urls import reverse
+from httmock import all_requests, HTTMock
+from rest_framework import exceptions
+
+from apps.authorization.permissions import PatientReferenceValidator
+from apps.fhir.server.mock_bfd import eob_bundle
+from apps.test import BaseApiTest
+from ..exceptions import UpstreamServerException
+from ..streaming import iter_bundle
+
+FHIR_ID = '-20140000008325'
+
+
+def check(chunks):
+    validator = PatientReferenceValidator(FHIR_ID)
+
+    def on_event(event, value):
+        if not validator.feed(event, value):
+            raise exceptions.PermissionDenied()
+
+    return iter_bundle(chunks, on_event)
+
+
+def chunked(content, size):
+    return [content[i:i + size] for i in range(0, len(content), size)]
+
+
+class TestIterBundle(SimpleTestCase):
+
+    def setUp(self):
+        self.content = json.dumps(eob_bundle(FHIR_ID, count=5), indent=2).encode('utf-8')
+
+    def test_forwards_body_unchanged(self):
+        for size in (1, 7, 1024, len(self.content)):
+            out = b''.join(check(chunked(self.content, size)))
+            self.assertEqual(out, self.content)
+
+    def test_multibyte_characters_split_across_chunks(self):
+        content = json.dumps({"resourceType": "Bundle", "id": "é中", "total": 0},
+                             ensure_ascii=False).encode('utf-8')
+        self.assertEqual(b''.join(check(chunked(content, 1))), content)
+
+    def test_entry_for_other_patient_is_not_forwarded(self):
+        bundle = eob_bundle(FHIR_ID, count=3)
+        bundle['entry'][2]['resource']['patient']['reference'] = 'Patient/-20140000000001'
+        content = json.dumps(bundle).encode('utf-8')
+        forwarded = []
+        with self.assertRaises(exceptions.NotFound):
+            for part in check(chunked(content, 1024)):
+                forwarded.append(part)
+        self.assertNotIn(b'-20140000000001', b''.join(forwarded))
+
+    def test_not_a_bundle(self):
+        content = json.dumps({"resourceType": "OperationOutcome"}).encode('utf-8')
+        with self.assertRaises(exceptions.NotFound):
+            list(check([content]))
+
+    def test_malformed_entry(self):
+        content = json.dumps({"resourceType": "Bundle", "entry": [{"fullUrl": "x"}]}).encode('utf-8')
+        with self.assertRaises(exceptions.PermissionDenied):
+            list(check([content]))
+
+    def test_truncated_body(self):
+        with self.assertRaises(UpstreamServerException):
+            list(check([self.content[:-10]]))
+
+
+@override_settings(FHIR_STREAMING_ENABLED=True)
+class StreamingSearchTest(BaseApiTest):
+
+    def setUp(self):
+        self.read_capability = self._create_capability('Read', [])
+        self.write_capability = self._create_capability('Write', [])
+        self._create_capability('eob', [
+            ["GET", "/v1/fhir/ExplanationOfBenefit"],
+        ])
+        self.client = Client()
+
+    def _search(self, bundle):
+        @all_requests
+        def catchall(url, req):
+            return {'status_code': 200, 'content': json.dumps(bundle)}
+
+        access_token = self.create_token('John', 'Smith')
+        with HTTMock(catchall):
+            return self.client.get(
+                reverse('bb_oauth_fhir_eob_search'),
+                {'_count': 5},
+                Authorization="Bearer %s" % access_token)
+
+    def test_eob_search_is_streamed(self):
+        bundle = eob_bundle(FHIR_ID, count=5)
+        response = self._search(bundle)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), bundle)
+
+    def test_eob_search_for_other_patient(self):
+        bundle = eob_bundle('-20140000000001', count=5)
+        response = self._search(bundle)
+        self.assertEqual(response.status_code, 404)
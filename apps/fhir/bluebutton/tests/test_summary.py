@@ -0,0 +1,103 @@
+import json
+import time
+
+from unittest.mock import patch
+
+from django.test.client import Client
+from django.urls import reverse
+from httmock import all_requests, HTTMock
+from waffle.testutils import override_switch
+
+from apps.fhir.server.mock_bfd import coverage_resource, eob_bundle, patient_resource, search_bundle
+from apps.test import BaseApiTest
+from ..views.summary import PatientSummaryView, get_executor
+
+FHIR_ID = '-20140000008325'
+BASE_URL = 'https://fhir.backend.bluebutton.hhsdevcloud.us/v1/fhir/'
+
+
+def backend_bundle(path):
+    if 'ExplanationOfBenefit' in path:
+        return eob_bundle(FHIR_ID, count=2)
+    if 'Coverage' in path:
+        return search_bundle(BASE_URL, 'Coverage', {}, [coverage_resource(FHIR_ID, 'A')], 0, 10, 1)
+    return search_bundle(BASE_URL, 'Patient', {}, [patient_resource(FHIR_ID)], 0, 10, 1)
+
+
+class PatientSummaryTest(BaseApiTest):
+
+    def setUp(self):
+        self.client = Client()
+        self.backend_paths = []
+        self.backend_latency = 0
+
+    def _summary(self, read_urls, requests=1):
+        self.read_capability = self._create_capability('Read', read_urls)
+        self.write_capability = self._create_capability('Write', [])
+        access_token = self.create_token('John', 'Smith')
+
+        @all_requests
+        def catchall(url, req):
+            time.sleep(self.backend_latency)
+            self.backend_paths.append(url.path)
+            return {'status_code': 200, 'content': json.dumps(backend_bundle(url.path))}
+
+        with HTTMock(catchall):
+            for _ in range(requests):
+                start = time.monotonic()
+                response = self.client.get(reverse('bb_oauth_fhir_patient_summary'),
+                                           Authorization="Bearer %s" % access_token)
+                self.elapsed = time.monotonic() - start
+            return response
+
+    def test_summary_collection(self):
+        response = self._summary([])
+        self.assertEqual(response.status_code, 200)
+        content = response.json()
+        self.assertEqual(content['resourceType'], 'Bundle')
+        self.assertEqual(content['type'], 'collection')
+        self.assertEqual([entry['resource']['entry'][0]['resource']['resourceType'] for entry in content['entry']],
+                         ['Patient', 'Coverage', 'ExplanationOfBenefit'])
+        self.assertEqual(len(self.backend_paths), 3)
+
+    def test_backend_searches_run_concurrently(self):
+        self.backend_latency = 0.3
+        response = self._summary([])
+        self.assertEqual(response.status_code, 200)
+        # Close to one backend call, not three
+        self.assertLess(self.elapsed, 0.6)
+
+    def test_search_views_per_request(self):
+        views = []
+        build_search_view = PatientSummaryView.build_search_view
+
+        def record(summary, view_class, request):
+            view = build_search_view(summary, view_class, request)
+            views.append(view)
+            return view
+
+        executor = get_executor()
+        with patch.object(PatientSummaryView, 'build_search_view', record):
+            self.assertEqual(self._summary([], requests=2).status_code, 200)
+
+        self.assertEqual(len(views), 6)
+        self.assertEqual(len(set(map(id, views))), 6)
+        for view in views:
+            self.assertIsNotNone(view.request)
+            self.assertEqual(view.kwargs, {})
+        self.assertIs(get_executor(), executor)
+
+    @override_switch('require-scopes', active=True)
+    def test_summary_respects_scopes(self):
+        response = self._summary([["GET", "/v1/fhir/ExplanationOfBenefit/"]])
+        self.assertEqual(response.status_code, 200)
+        entries = response.json()['entry']
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['resource']['entry'][0]['resource']['resourceType'], 'ExplanationOfBenefit')
+        self.assertEqual(self.backend_paths, ['/v1/fhir/ExplanationOfBenefit/'])
+
+    @override_switch('require-scopes', active=True)
+    def test_summary_without_scopes(self):
+        response = self._summary([])
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.backend_paths, [])
@@ -1,12 +1,33 @@
 from django.conf.urls import url
 from django.contrib import admin
 
+from apps.fhir.bluebutton.views.export import ExportFileView, ExportKickOffView, ExportStatusView
 from apps.fhir.bluebutton.views.read import ReadViewCoverage, ReadViewExplanationOfBenefit, ReadViewPatient
 from apps.fhir.bluebutton.views.search import SearchViewCoverage, SearchViewExplanationOfBenefit, SearchViewPatient
+from apps.fhir.bluebutton.views.summary import PatientSummaryView
 
 admin.autodiscover()
 
 urlpatterns = [
+    # Bulk Data export job status and files, anchored as the file names contain resource types
+    url(r'^bulkdata/jobs/(?P<job_id>[0-9a-f-]+)/(?P<file_name>[^/]+\.ndjson)$',
+        ExportFileView.as_view(),
+        name='bb_oauth_fhir_export_file'),
+
+    url(r'^bulkdata/jobs/(?P<job_id>[0-9a-f-]+)$',
+        ExportStatusView.as_view(),
+        name='bb_oauth_fhir_export_status'),
+
+    # Bulk Data export kick-off, must come before Patient ReadView
+    url(r'Patient/\$export',
+        ExportKickOffView.as_view(),
+        name='bb_oauth_fhir_patient_export'),
+
+    # Patient, Coverage and EOB searches in one Bundle, must come before Patient ReadView
+    url(r'Patient/\$summary',
+        PatientSummaryView.as_view(),
+        name='bb_oauth_fhir_patient_summary'),
+
     # Patient ReadView
     url(r'Patient/(?P<resource_id>[^/]+)',
         ReadViewPatient.as_view(),
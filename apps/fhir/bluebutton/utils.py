@@ -10,11 +10,13 @@ from pytz import timezone
 
 from django.conf import settings
 from django.contrib import messages
-from apps.fhir.server.settings import fhir_settings
+from apps.fhir.server.client import get_backend_client
+from apps.fhir.server.router import load_balancer
 
 from oauth2_provider.models import AccessToken
 
 from apps.wellknown.views import (base_issuer, build_endpoint_info)
+from .identity import get_identity
 from .models import Crosswalk, Fhir_Response
 
 logger = logging.getLogger('hhs_server.%s' % __name__)
@@ -63,6 +65,18 @@ def get_access_token_from_request(request):
     return token
 
 
+def get_access_token(request):
+    """
+    Returns the AccessToken the request was authenticated with, or for
+    a request not authenticated by the API, the one of its Authorization
+    header, or None
+    """
+    if hasattr(request, 'auth'):
+        return request.auth if isinstance(request.auth, AccessToken) else None
+    return AccessToken.objects.filter(
+        token=get_access_token_from_request(request)).select_related('application__user').first()
+
+
 def get_fhir_now(my_now=None):
     """ Format a json datetime in xs:datetime format
 
@@ -139,9 +153,13 @@ def generate_info_headers(request):
     # get query counter or set to 1
     result['BlueButton-OriginalQueryCounter'] = str(get_query_counter(request))
 
-    # Return resource_owner or user
-    user = get_user_from_request(request)
-    crosswalk = get_crosswalk(user)
+    # Resolved when the request was authenticated, else the resource_owner or user
+    identity = get_identity(request)
+    if identity is not None:
+        user, crosswalk = identity.beneficiary, identity.crosswalk
+    else:
+        user = get_user_from_request(request)
+        crosswalk = get_crosswalk(user)
     if crosswalk:
         # we need to send the HicnHash or the fhir_id
         # TODO: Can the hicnHash case ever be reached? Should refactor this!
@@ -158,11 +176,11 @@ def generate_info_headers(request):
         # result['BlueButton-User'] = str(user)
         result['BlueButton-Application'] = ""
         result['BlueButton-ApplicationId'] = ""
-        if AccessToken.objects.filter(token=get_access_token_from_request(request)).exists():
-            at = AccessToken.objects.get(token=get_access_token_from_request(request))
+        at = identity.access_token if identity is not None else get_access_token(request)
+        if at is not None:
             result['BlueButton-Application'] = str(at.application.name)
             result['BlueButton-ApplicationId'] = str(at.application.id)
-            result['BlueButton-DeveloperId'] = str(at.application.user.id)
+            result['BlueButton-DeveloperId'] = str(at.application.user_id)
             # result['BlueButton-Developer'] = str(at.application.user)
         else:
             result['BlueButton-Application'] = ""
@@ -306,13 +324,14 @@ def notNone(value=None, default=None):
         return value
 
 
-def FhirServerAuth(crosswalk=None):
+def FhirServerAuth(crosswalk=None, url=None):
     # Get default clientauth settings from base.py
     # Receive a crosswalk.id or None
+    # and the backend url the certs are for, or None
     # Return a dict
 
     auth_settings = {}
-    resource_router = get_resourcerouter()
+    resource_router = get_resourcerouter(crosswalk, url=url)
     auth_settings['client_auth'] = resource_router.client_auth
     auth_settings['cert_file'] = resource_router.cert_file
     auth_settings['key_file'] = resource_router.key_file
@@ -329,10 +348,10 @@ def FhirServerAuth(crosswalk=None):
     return auth_settings
 
 
-def FhirServerVerify(crosswalk=None):
+def FhirServerVerify(crosswalk=None, url=None):
     # Get default Server Verify Setting
     # Return True or False (Default)
-    return get_resourcerouter().verify_server
+    return get_resourcerouter(crosswalk, url=url).verify_server
 
 
 def mask_with_this_url(request, host_path='', in_text='', find_url=''):
@@ -425,16 +444,24 @@ def get_crosswalk(user):
         return None
 
     try:
-        patient = Crosswalk.objects.get(user=user)
-        return patient
+        # Loaded with the user when it was authenticated with a token
+        return user.crosswalk
     except Crosswalk.DoesNotExist:
         pass
 
     return None
 
 
-def get_resourcerouter(crosswalk=None):
-    return fhir_settings
+def get_resourcerouter(crosswalk=None, url=None):
+    """
+    The backend endpoint a backend url was built from, else the endpoint
+    picked by the load balancer for a new call, see apps.fhir.server.router.
+    """
+    if url is not None:
+        endpoint = load_balancer.endpoint_for(url)
+        if endpoint is not None:
+            return endpoint
+    return load_balancer.choose()
 
 
 def handle_http_error(e):
@@ -665,15 +692,14 @@ def get_patient_by_id(id, request):
     a helper adapted to just get patient given an id out of band of auth flow
     or noraml data flow, use by tools such as BB2-Tools admin viewers
     '''
-    auth_settings = FhirServerAuth(None)
-    certs = (auth_settings['cert_file'], auth_settings['key_file'])
     headers = generate_info_headers(request)
     headers['BlueButton-Application'] = "BB2-Tools"
     headers['includeIdentifiers'] = "true"
     url = "{}Patient/{}?_format={}".format(get_resourcerouter().fhir_url, id, settings.FHIR_PARAM_FORMAT)
-    s = requests.Session()
+    auth_settings = FhirServerAuth(None, url=url)
+    certs = (auth_settings['cert_file'], auth_settings['key_file'])
     req = requests.Request('GET', url, headers=headers)
     prepped = req.prepare()
-    response = s.send(prepped, cert=certs, verify=False)
+    response = get_backend_client().send(prepped, cert=certs, verify=False)
     response.raise_for_status()
     return response.json()
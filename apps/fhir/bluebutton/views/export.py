@@ -0,0 +1,160 @@
+import logging
+
+from django.db import transaction
+from django.http import FileResponse
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from django.utils.dateparse import parse_datetime
+from rest_framework import exceptions, permissions
+from rest_framework.response import Response
+
+from apps.authorization.permissions import DataAccessGrantPermission
+from apps.fhir.bluebutton.views.generic import FhirDataView
+from apps.fhir.bluebutton.views.summary import PatientSummaryView
+from .. import export
+from ..models import ExportJob
+from ..permissions import (HasCrosswalk, ResourcePermission, ApplicationActivePermission)
+
+logger = logging.getLogger('hhs_server.%s' % __name__)
+
+OUTPUT_FORMATS = ['application/fhir+ndjson', 'application/ndjson', 'ndjson']
+
+
+class ExportKickOffView(PatientSummaryView):
+    """
+    FHIR Bulk Data Patient/$export kick-off.
+
+    Queues an ExportJob of the Patient, Coverage and ExplanationOfBenefit
+    searches covered by the token scopes, optionally narrowed with _type
+    and _since, and returns the job status URL in Content-Location.
+    One job per beneficiary and application runs at a time.
+    """
+
+    def get(self, request, *args, **kwargs):
+        if request.META.get('HTTP_PREFER') != 'respond-async':
+            raise exceptions.ParseError('The Prefer header must be respond-async')
+
+        output_format = request.query_params.get('_outputFormat')
+        if output_format and output_format not in OUTPUT_FORMATS:
+            raise exceptions.ParseError('The _outputFormat %s is not supported' % output_format)
+
+        resource_types = [view.resource_type for view in self.get_search_views(request)]
+        if not resource_types:
+            self.permission_denied(request)
+
+        if request.query_params.get('_type'):
+            requested = [t.strip() for t in request.query_params['_type'].split(',') if t.strip()]
+            unsupported = [t for t in requested if t not in export.EXPORT_RESOURCE_TYPES]
+            if unsupported:
+                raise exceptions.ParseError('The _type %s is not supported' % ','.join(unsupported))
+            if [t for t in requested if t not in resource_types]:
+                self.permission_denied(request)
+            resource_types = [t for t in resource_types if t in requested]
+
+        since = request.query_params.get('_since', '')
+        if since and parse_datetime(since) is None:
+            raise exceptions.ParseError('The _since value is not a valid instant')
+
+        if ExportJob.objects.filter(user=request.user, application=request.auth.application,
+                                    status__in=ExportJob.ACTIVE_STATUSES).exists():
+            raise exceptions.Throttled(detail='An export for this beneficiary is already in progress')
+
+        job = ExportJob.objects.create(user=request.user,
+                                       application=request.auth.application,
+                                       fhir_id=request.crosswalk.fhir_id,
+                                       resource_types=','.join(resource_types),
+                                       since=since,
+                                       request_url=request.build_absolute_uri())
+        # Started once committed, a worker thread would not see the job before
+        transaction.on_commit(lambda: export.export_queue.submit(job.pk))
+
+        status_url = request.build_absolute_uri(reverse('bb_oauth_fhir_export_status', kwargs={'job_id': job.pk}))
+        return Response(status=202, headers={'Content-Location': status_url})
+
+
+class ExportJobView(FhirDataView):
+    # Base class for the views of an export job of the token application and beneficiary
+
+    # BB2-149 note, check authenticated first, then app active etc.
+    permission_classes = [
+        permissions.IsAuthenticated,
+        ApplicationActivePermission,
+        ResourcePermission,
+        HasCrosswalk,
+        DataAccessGrantPermission,
+    ]
+
+    def __init__(self):
+        self.resource_type = "Patient"
+
+    def initial(self, request, *args, **kwargs):
+        return super().initial(request, self.resource_type, *args, **kwargs)
+
+    def get_job(self, request, job_id):
+        # Return 404 for other applications' jobs to avoid notifying they exist
+        try:
+            job = ExportJob.objects.get(pk=job_id, user=request.user, application=request.auth.application)
+        except ExportJob.DoesNotExist:
+            raise exceptions.NotFound('The export job does not exist')
+        if job.status == ExportJob.CANCELLED or export.is_expired(job):
+            raise exceptions.NotFound('The export job does not exist')
+        return job
+
+
+class ExportStatusView(ExportJobView):
+    """
+    Bulk Data status: 202 with X-Progress while the job runs, the output
+    manifest once it completes. DELETE cancels the job and removes its files.
+    """
+
+    def get(self, request, job_id, *args, **kwargs):
+        job = self.get_job(request, job_id)
+        checkpoint = job.get_checkpoint()
+
+        if job.status in ExportJob.ACTIVE_STATUSES:
+            progress = ", ".join("%s: %s" % (resource_type, state['start_index'])
+                                 for resource_type, state in checkpoint.items())
+            return Response(status=202, headers={'X-Progress': progress or job.status, 'Retry-After': '5'})
+
+        if job.status == ExportJob.FAILED:
+            return Response({
+                "resourceType": "OperationOutcome",
+                "issue": [{"severity": "error", "code": "exception", "diagnostics": job.error}],
+            }, status=500)
+
+        output = []
+        for resource_type in job.get_resource_types():
+            for output_file in checkpoint.get(resource_type, {}).get('files', []):
+                url = reverse('bb_oauth_fhir_export_file', kwargs={'job_id': job.pk, 'file_name': output_file['name']})
+                output.append({
+                    "type": resource_type,
+                    "url": request.build_absolute_uri(url),
+                    "count": output_file['count'],
+                })
+
+        return Response({
+            "transactionTime": job.transaction_time.isoformat(),
+            "request": job.request_url,
+            "requiresAccessToken": True,
+            "output": output,
+            "error": [],
+        })
+
+    def delete(self, request, job_id, *args, **kwargs):
+        export.cancel_job(self.get_job(request, job_id))
+        return Response(status=202)
+
+
+class ExportFileView(ExportJobView):
+    # NDJSON file of a completed export job
+
+    def get(self, request, job_id, file_name, *args, **kwargs):
+        job = self.get_job(request, job_id)
+        if job.status == ExportJob.COMPLETED:
+            # Only files recorded for the job are served
+            for state in job.get_checkpoint().values():
+                for output_file in state['files']:
+                    if output_file['name'] == file_name:
+                        return FileResponse(default_storage.open(output_file['path'], 'rb'),
+                                            content_type='application/fhir+ndjson')
+        raise exceptions.NotFound('The export file does not exist')
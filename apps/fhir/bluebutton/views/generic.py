@@ -1,24 +1,31 @@
 import logging
-import voluptuous
-from requests import Session, Request
+from requests import Request
 from rest_framework import (exceptions, permissions)
-from rest_framework.parsers import JSONParser
-from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
 
-from apps.fhir.parsers import FHIRParser
-from apps.fhir.renderers import FHIRRenderer
+from apps.fhir import fastjson
+from apps.fhir.parsers import FastJSONParser, FHIRParser
+from apps.fhir.renderers import FastJSONRenderer, FHIRRenderer
 from apps.dot_ext.throttling import TokenRateThrottle
 from apps.fhir.server import connection as backend_connection
+from apps.fhir.server.client import get_backend_client, resource_type_of
 from ..signals import (
     pre_fetch,
     post_fetch
 )
-from apps.authorization.permissions import DataAccessGrantPermission
+from apps.authorization.permissions import DataAccessGrantPermission, PatientReferenceValidator
 from ..authentication import OAuth2ResourceOwner
+from .. import cache as response_cache
+from .. import conditional
+from .. import hedging
 from ..permissions import (HasCrosswalk, ResourcePermission, ApplicationActivePermission)
 from ..exceptions import process_error_response
+from ..projection import Projection, project
+from ..search_parameters import canonical_query, InvalidSearchParameter, SearchParameters
+from ..streaming import iter_bundle, STREAM_CHUNK_SIZE
 from ..utils import (build_fhir_response,
                      FhirServerVerify,
                      get_resourcerouter)
@@ -28,8 +35,8 @@ logger = logging.getLogger('hhs_server.%s' % __name__)
 
 class FhirDataView(APIView):
 
-    parser_classes = [JSONParser, FHIRParser]
-    renderer_classes = [JSONRenderer, FHIRRenderer]
+    parser_classes = [FastJSONParser, FHIRParser]
+    renderer_classes = [FastJSONRenderer, FHIRRenderer]
     throttle_classes = [TokenRateThrottle]
     authentication_classes = [OAuth2ResourceOwner]
     # BB2-149 note, check authenticated first, then app active etc.
@@ -40,6 +47,22 @@ class FhirDataView(APIView):
         ResourcePermission,
         DataAccessGrantPermission]
 
+    # Forward backend Bundles as they arrive, when FHIR_STREAMING_ENABLED
+    streaming = False
+
+    # Backend Last-Modified of the response served, see process_data
+    last_modified = None
+
+    # Query parameters passed on to the backend, see apps.fhir.bluebutton.search_parameters
+    QUERY_PARAMETERS = SearchParameters()
+
+    # Accepted _summary values, none accepts neither _summary nor _elements,
+    # see apps.fhir.bluebutton.projection
+    SUMMARY_VALUES = ()
+
+    # Projection of the request being served, see get
+    projection = None
+
     # Must return a Crosswalk
     def check_resource_permission(self, request, **kwargs):
         raise NotImplementedError()
@@ -47,23 +70,8 @@ class FhirDataView(APIView):
     def build_parameters(self, request):
         raise NotImplementedError()
 
-    def map_parameters(self, params):
-        transforms = getattr(self, "QUERY_TRANSFORMS", {})
-        for key, correct in transforms.items():
-            val = params.pop(key, None)
-            if val is not None:
-                params[correct] = val
-        return params
-
     def filter_parameters(self, request):
-        params = self.map_parameters(request.query_params.dict())
-        # Get list from _lastUpdated QueryDict(), since it can have multi params
-        params['_lastUpdated'] = request.query_params.getlist('_lastUpdated')
-
-        schema = voluptuous.Schema(
-            getattr(self, "QUERY_SCHEMA", {}),
-            extra=voluptuous.REMOVE_EXTRA)
-        return schema(params)
+        return self.QUERY_PARAMETERS.parse(request.query_params)
 
     def validate_response(self, response):
         pass
@@ -85,11 +93,43 @@ class FhirDataView(APIView):
 
     def get(self, request, resource_type, *args, **kwargs):
 
+        if self.SUMMARY_VALUES:
+            try:
+                self.projection = Projection.from_query(request.query_params, self.SUMMARY_VALUES)
+            except InvalidSearchParameter as e:
+                raise exceptions.ParseError(detail=e.msg)
+
+        # Projected responses are re-rendered, so they are not streamed
+        if self.streaming and settings.FHIR_STREAMING_ENABLED and not self.projection:
+            return self.stream_data(request, resource_type, *args, **kwargs)
+
         out_data = self.fetch_data(request, resource_type, *args, **kwargs)
 
-        return Response(out_data)
+        if self.projection:
+            out_data = project(request, self.projection, out_data)
 
-    def fetch_data(self, request, resource_type, *args, **kwargs):
+        return self.build_response(request, resource_type, out_data)
+
+    def build_response(self, request, resource_type, out_data):
+        if not conditional.is_enabled():
+            return Response(out_data)
+
+        # Rendered here, as the ETag is over the body sent
+        renderer = request.accepted_renderer
+        content = renderer.render(out_data, request.accepted_media_type, self.get_renderer_context())
+        etag = conditional.build_etag(request.crosswalk.fhir_id, renderer.media_type, content)
+
+        response = conditional.not_modified_response(request, resource_type, etag, self.last_modified)
+        if response is not None:
+            return response
+
+        response = HttpResponse(content, content_type=renderer.media_type)
+        response['ETag'] = etag
+        if self.last_modified:
+            response['Last-Modified'] = self.last_modified
+        return response
+
+    def get_backend_request(self, request, resource_type, *args, **kwargs):
         resource_router = get_resourcerouter(request.crosswalk)
         target_url = self.build_url(resource_router,
                                     resource_type,
@@ -99,31 +139,56 @@ class FhirDataView(APIView):
         logger.debug('FHIR URL with key:%s' % target_url)
 
         try:
-            get_parameters = {**self.filter_parameters(request), **self.build_parameters(request)}
-        except voluptuous.error.Invalid as e:
+            get_parameters = {**self.filter_parameters(request),
+                              **(self.projection.backend_parameters(resource_type) if self.projection else {}),
+                              **self.build_parameters(request)}
+        except InvalidSearchParameter as e:
             raise exceptions.ParseError(detail=e.msg)
 
         logger.debug('Here is the URL to send, %s now add '
                      'GET parameters %s' % (target_url, get_parameters))
 
+        return target_url, get_parameters
+
+    def build_backend_request(self, request, target_url, get_parameters):
+        return Request('GET',
+                       target_url,
+                       data=get_parameters,
+                       params=canonical_query(get_parameters),
+                       headers=backend_connection.headers(request, url=target_url))
+
+    def send_backend_request(self, request, req, stream=False):
+        """
+        Send a request built by build_backend_request and check the
+        response status. Makes no database queries, so it can be
+        called from other threads.
+        """
+        # The endpoint req.url was built for, with its own client certificate
+        resource_router = get_resourcerouter(request.crosswalk, url=req.url)
+
         # Now make the call to the backend API
-        req = Request('GET',
-                      target_url,
-                      data=get_parameters,
-                      params=get_parameters,
-                      headers=backend_connection.headers(request, url=target_url))
-        s = Session()
-        prepped = s.prepare_request(req)
-        # Send signal
-        pre_fetch.send_robust(FhirDataView, request=req)
-        r = s.send(
-            prepped,
-            cert=backend_connection.certs(crosswalk=request.crosswalk),
-            timeout=resource_router.wait_time,
-            verify=FhirServerVerify(crosswalk=request.crosswalk))
-        # Send signal
-        post_fetch.send_robust(FhirDataView, request=prepped, response=r)
-        response = build_fhir_response(request._request, target_url, request.crosswalk, r=r, e=None)
+        client = get_backend_client()
+        send_kwargs = {
+            'cert': backend_connection.certs(crosswalk=request.crosswalk, url=req.url),
+            'timeout': resource_router.wait_time,
+            'verify': FhirServerVerify(crosswalk=request.crosswalk, url=req.url),
+        }
+        if stream or not hedging.is_enabled():
+            prepped = client.prepare_request(req)
+            # Send signal
+            pre_fetch.send_robust(FhirDataView, request=req)
+            r = client.send(prepped, stream=stream, **send_kwargs)
+
+            if stream and r.status_code < 300:
+                # post_fetch is sent once the body has been streamed, see stream_data
+                return r
+
+            # Send signal
+            post_fetch.send_robust(FhirDataView, request=prepped, response=r)
+        else:
+            r = self.send_hedged(client, req, resource_router.wait_time, **send_kwargs)
+
+        response = build_fhir_response(request._request, req.url, request.crosswalk, r=r, e=None)
 
         # BB2-128
         error = process_error_response(response)
@@ -133,8 +198,127 @@ class FhirDataView(APIView):
 
         self.validate_response(response)
 
-        out_data = r.json()
+        return r
+
+    def send_hedged(self, client, req, max_delay, **kwargs):
+        """
+        Send req, and a second time if the backend is slow to answer,
+        see apps.fhir.bluebutton.hedging. The audit log records both
+        attempts and which one was used.
+        """
+        def send_attempt(attempt):
+            prepped = client.prepare_request(req)
+            # Send signal
+            if attempt == hedging.HEDGE:
+                pre_fetch.send_robust(FhirDataView, request=req, hedge={"attempt": attempt})
+            else:
+                pre_fetch.send_robust(FhirDataView, request=req)
+            # The hedge must not wait on the attempt it hedges
+            return client.send(prepped, coalesce=attempt == hedging.PRIMARY, **kwargs)
+
+        def on_loser(attempt, r):
+            # Send signal
+            post_fetch.send_robust(FhirDataView, request=r.request, response=r,
+                                   hedge={"attempt": attempt, "won": False})
+
+        r, attempt, hedged = hedging.hedger.send(resource_type_of(req.url), send_attempt, max_delay, on_loser)
+
+        # Send signal
+        if hedged:
+            post_fetch.send_robust(FhirDataView, request=r.request, response=r,
+                                   hedge={"attempt": attempt, "won": True})
+        else:
+            post_fetch.send_robust(FhirDataView, request=r.request, response=r)
+        return r
+
+    def fetch_data(self, request, resource_type, *args, **kwargs):
+        target_url, get_parameters = self.get_backend_request(request, resource_type, *args, **kwargs)
+
+        cache_key, out_data = response_cache.get_response(request.crosswalk.fhir_id, resource_type,
+                                                          target_url, get_parameters)
+        if out_data is not None:
+            return out_data
+
+        r = self.send_backend_request(request, self.build_backend_request(request, target_url, get_parameters))
+
+        return self.process_data(request, resource_type, r, cache_key)
+
+    def process_data(self, request, resource_type, r, cache_key=None):
+        out_data = fastjson.loads(r.content)
 
         self.check_object_permissions(request, out_data)
 
+        response_cache.set_response(cache_key, resource_type, out_data)
+
+        self.last_modified = r.headers.get('Last-Modified')
+
         return out_data
+
+    def stream_data(self, request, resource_type, *args, **kwargs):
+        """
+        Forward the backend Bundle as it arrives instead of loading and
+        re-rendering it. The DataAccessGrantPermission patient check runs
+        on every entry before it is forwarded.
+        """
+        target_url, get_parameters = self.get_backend_request(request, resource_type, *args, **kwargs)
+
+        cache_key, out_data = response_cache.get_response(request.crosswalk.fhir_id, resource_type,
+                                                          target_url, get_parameters)
+        if out_data is not None:
+            return self.build_response(request, resource_type, out_data)
+
+        # Request level checks up front, then the patient check per entry
+        self.check_object_permissions(request, {'resourceType': 'Bundle', 'entry': []})
+
+        r = self.send_backend_request(request, self.build_backend_request(request, target_url, get_parameters),
+                                      stream=True)
+
+        # The body is not rendered here, the backend ETag is scoped to the beneficiary instead
+        etag = r.headers.get('ETag') if conditional.is_enabled() else None
+        if etag:
+            etag = conditional.build_etag(request.crosswalk.fhir_id, request.accepted_renderer.media_type, etag)
+            response = conditional.not_modified_response(request, resource_type, etag, r.headers.get('Last-Modified'))
+            if response is not None:
+                r.close()
+                r.streamed_size = 0
+                # Send signal
+                post_fetch.send_robust(FhirDataView, request=r.request, response=r)
+                return response
+
+        validator = PatientReferenceValidator(request.crosswalk.fhir_id)
+
+        def on_event(event, value):
+            if not validator.feed(event, value):
+                self.permission_denied(request)
+
+        content = self.stream_content(r, on_event)
+        # Check the first chunk before sending headers, so errors
+        # found there still get a regular error response
+        first = next(content, b'')
+
+        def stream():
+            yield first
+            yield from content
+
+        response = StreamingHttpResponse(stream(), status=r.status_code,
+                                         content_type=request.accepted_renderer.media_type)
+        if etag:
+            response['ETag'] = etag
+        return response
+
+    def stream_content(self, r, on_event):
+        try:
+            r.streamed_size = 0
+            for part in iter_bundle(r.iter_content(STREAM_CHUNK_SIZE), on_event):
+                r.streamed_size += len(part)
+                yield part
+        except Exception as e:
+            if r.streamed_size:
+                # Headers are sent, the client only sees a truncated body
+                logger.error('Streaming of the backend response to %s was aborted after %s bytes: %r'
+                             % (r.url, r.streamed_size, e))
+            raise
+        finally:
+            r.close()
+            # Send signal
+            post_fetch.send_robust(FhirDataView, request=r.request, response=r)
@@ -26,6 +26,8 @@ class ReadView(FhirDataView):
         TokenHasProtectedCapability,
     ]
 
+    SUMMARY_VALUES = ('true', 'data', 'false')
+
     def __init__(self):
         self.resource_type = None
 
@@ -1,22 +1,23 @@
 import logging
 
-from voluptuous import (
-    Required,
-    All,
-    Match,
-    Range,
-    Coerce,
-)
 from rest_framework import (permissions)
 
 from apps.fhir.bluebutton.constants import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 from apps.fhir.bluebutton.views.generic import FhirDataView
 from apps.authorization.permissions import DataAccessGrantPermission
 from apps.capabilities.permissions import TokenHasProtectedCapability
+from .. import cache as response_cache
+from .. import prefetch
+from ..search_parameters import Integer, Prefixed, SearchParameters, TokenList
 from ..permissions import (SearchCrosswalkPermission, ResourcePermission, ApplicationActivePermission)
 
 logger = logging.getLogger('hhs_server.%s' % __name__)
 
+# Valid ExplanationOfBenefit type values, with or without the system
+EOB_TYPE_CODES = ['carrier', 'pde', 'dme', 'hha', 'hospice', 'inpatient', 'outpatient', 'snf']
+EOB_TYPE_SYSTEM = 'https://bluebutton.cms.gov/resources/codesystem/eob-type'
+EOB_TYPE_VALUES = EOB_TYPE_CODES + [EOB_TYPE_SYSTEM + '|'] + [EOB_TYPE_SYSTEM + '|' + code for code in EOB_TYPE_CODES]
+
 
 class SearchView(FhirDataView):
     # Base class for FHIR resource search views
@@ -31,18 +32,15 @@ class SearchView(FhirDataView):
         TokenHasProtectedCapability,
     ]
 
-    # Regex to match a valid _lastUpdated value that can begin with lt, le, gt and ge operators
-    REGEX_LASTUPDATED_VALUE = r'^((lt)|(le)|(gt)|(ge)).+'
-
-    QUERY_TRANSFORMS = {
+    QUERY_PARAMETERS = SearchParameters({
+        'startIndex': Integer(default=0),
+        '_count': Integer(default=DEFAULT_PAGE_SIZE, min=0, max=MAX_PAGE_SIZE),
+        '_lastUpdated': Prefixed(['lt', 'le', 'gt', 'ge'], msg="the _lastUpdated operator is not valid"),
+    }, transforms={
         'count': '_count',
-    }
+    })
 
-    QUERY_SCHEMA = {
-        Required('startIndex', default=0): Coerce(int),
-        Required('_count', default=DEFAULT_PAGE_SIZE): All(Coerce(int), Range(min=0, max=MAX_PAGE_SIZE)),
-        '_lastUpdated': [Match(REGEX_LASTUPDATED_VALUE, msg="the _lastUpdated operator is not valid")]
-    }
+    SUMMARY_VALUES = ('true', 'count', 'data', 'false')
 
     def __init__(self):
         self.resource_type = None
@@ -86,31 +84,13 @@ class SearchViewCoverage(SearchView):
 class SearchViewExplanationOfBenefit(SearchView):
     # Class used for ExplanationOfBenefit resource search view
 
-    # Regex to match a valid type value
-    REGEX_TYPE_VALUE = r"(carrier)|" + \
-        r"(pde)|" + \
-        r"(dme)|" + \
-        r"(hha)|" + \
-        r"(hospice)|" + \
-        r"(inpatient)|" + \
-        r"(outpatient)|" + \
-        r"(snf)|" + \
-        r"(https://bluebutton.cms.gov/resources/codesystem/eob-type\|)|" + \
-        r"(https://bluebutton.cms.gov/resources/codesystem/eob-type\|carrier)|" + \
-        r"(https://bluebutton.cms.gov/resources/codesystem/eob-type\|pde)|" + \
-        r"(https://bluebutton.cms.gov/resources/codesystem/eob-type\|dme)|" + \
-        r"(https://bluebutton.cms.gov/resources/codesystem/eob-type\|hha)|" + \
-        r"(https://bluebutton.cms.gov/resources/codesystem/eob-type\|hospice)|" + \
-        r"(https://bluebutton.cms.gov/resources/codesystem/eob-type\|inpatient)|" + \
-        r"(https://bluebutton.cms.gov/resources/codesystem/eob-type\|outpatient)|" + \
-        r"(https://bluebutton.cms.gov/resources/codesystem/eob-type\|snf)"
-
-    # Regex to match a list of comma separated type values with IGNORECASE
-    REGEX_TYPE_VALUES_LIST = r'(?i)^((' + REGEX_TYPE_VALUE + r')\s*,*\s*)+$'
-
-    # Add type parameter to schema only for EOB
-    QUERY_SCHEMA = {**SearchView.QUERY_SCHEMA,
-                    'type': Match(REGEX_TYPE_VALUES_LIST, msg="the type parameter value is not valid")}
+    # Add type parameter only for EOB
+    QUERY_PARAMETERS = SearchView.QUERY_PARAMETERS.extend({
+        'type': TokenList(EOB_TYPE_VALUES, msg="the type parameter value is not valid"),
+    })
+
+    # Pages of up to MAX_PAGE_SIZE claims are worth streaming
+    streaming = True
 
     def __init__(self):
         self.resource_type = "ExplanationOfBenefit"
@@ -120,3 +100,34 @@ class SearchViewExplanationOfBenefit(SearchView):
             '_format': 'application/json+fhir',
             'patient': request.crosswalk.fhir_id,
         }
+
+    def fetch_data(self, request, resource_type, *args, **kwargs):
+        if not prefetch.is_enabled():
+            return super().fetch_data(request, resource_type, *args, **kwargs)
+
+        target_url, get_parameters = self.get_backend_request(request, resource_type, *args, **kwargs)
+
+        cache_key, out_data = response_cache.get_response(request.crosswalk.fhir_id, resource_type,
+                                                          target_url, get_parameters)
+        if out_data is None:
+            # A prefetched response is served as if it was fetched now
+            r = prefetch.prefetcher.take(prefetch.build_key(request, target_url, get_parameters))
+            if r is None:
+                r = self.send_backend_request(request, self.build_backend_request(request, target_url, get_parameters))
+            out_data = self.process_data(request, resource_type, r, cache_key)
+
+        self.prefetch_next_page(request, target_url, get_parameters, out_data)
+
+        return out_data
+
+    def prefetch_next_page(self, request, target_url, get_parameters, out_data):
+        if not get_parameters['_count'] or not any(link.get('relation') == 'next'
+                                                   for link in out_data.get('link', [])):
+            return
+
+        next_parameters = dict(get_parameters, startIndex=get_parameters['startIndex'] + get_parameters['_count'])
+        # Built here, building the request headers queries the database
+        req = self.build_backend_request(request, target_url, next_parameters)
+        prefetch.prefetch_request(req)
+        prefetch.prefetcher.schedule(prefetch.build_key(request, target_url, next_parameters),
+                                     lambda: self.send_backend_request(request, prefetch.sent_request(req)))
@@ -0,0 +1,122 @@
+import logging
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.urls import reverse
+from rest_framework import permissions
+from rest_framework.response import Response
+from waffle import switch_is_active
+
+from apps.authorization.permissions import DataAccessGrantPermission
+from apps.capabilities.permissions import token_allows
+from apps.fhir.bluebutton.views.generic import FhirDataView
+from apps.fhir.bluebutton.views.search import (SearchViewCoverage,
+                                               SearchViewExplanationOfBenefit,
+                                               SearchViewPatient)
+from .. import cache as response_cache
+from ..permissions import (HasCrosswalk, ResourcePermission, ApplicationActivePermission)
+
+logger = logging.getLogger('hhs_server.%s' % __name__)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    The worker threads of the backend searches, shared by the requests of
+    this process, at most FHIR_SUMMARY_MAX_WORKERS searches run at once.
+    """
+    global _executor, _executor_pid
+    with _executor_lock:
+        # Worker threads do not survive a fork
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'FHIR_SUMMARY_MAX_WORKERS', 12))
+            _executor_pid = os.getpid()
+        return _executor
+
+
+class PatientSummaryView(FhirDataView):
+    """
+    Patient, Coverage and ExplanationOfBenefit searches in one request.
+
+    The token and grant are checked once, the backend searches run
+    concurrently and their searchset Bundles are returned as the entries
+    of a collection Bundle. Only the searches covered by the token scopes
+    are included.
+    """
+
+    # BB2-149 note, check authenticated first, then app active etc.
+    permission_classes = [
+        permissions.IsAuthenticated,
+        ApplicationActivePermission,
+        ResourcePermission,
+        HasCrosswalk,
+        DataAccessGrantPermission,
+    ]
+
+    # Search views and the URL names their scopes are granted on
+    SEARCHES = [
+        (SearchViewPatient, 'bb_oauth_fhir_patient_search'),
+        (SearchViewCoverage, 'bb_oauth_fhir_coverage_search'),
+        (SearchViewExplanationOfBenefit, 'bb_oauth_fhir_eob_search'),
+    ]
+
+    def __init__(self):
+        self.resource_type = "Patient"
+
+    def initial(self, request, *args, **kwargs):
+        return super().initial(request, self.resource_type, *args, **kwargs)
+
+    def build_search_view(self, view_class, request):
+        # Set up as as_view() and dispatch() do, a view per search keeps its own state
+        view = view_class()
+        view.setup(request)
+        view.format_kwarg = self.format_kwarg
+        view.headers = self.default_response_headers
+        return view
+
+    def get_search_views(self, request):
+        if not switch_is_active("require-scopes"):
+            return [self.build_search_view(view_class, request) for view_class, url_name in self.SEARCHES]
+
+        views = []
+        for view_class, url_name in self.SEARCHES:
+            path = reverse(url_name)
+            # Search URLs are served with and without the trailing slash
+            if (token_allows(request.auth, request.method, path)
+                    or token_allows(request.auth, request.method, path + "/")):
+                views.append(self.build_search_view(view_class, request))
+        return views
+
+    def get(self, request, *args, **kwargs):
+        views = self.get_search_views(request)
+        if not views:
+            self.permission_denied(request)
+
+        # Requests are built here, as building them queries the database
+        results = []
+        for view in views:
+            target_url, get_parameters = view.get_backend_request(request, view.resource_type)
+            cache_key, out_data = response_cache.get_response(request.crosswalk.fhir_id, view.resource_type,
+                                                              target_url, get_parameters)
+            req = None if out_data is not None else view.build_backend_request(request, target_url, get_parameters)
+            results.append([view, cache_key, out_data, req])
+
+        pending = [result for result in results if result[2] is None]
+        if pending:
+            executor = get_executor()
+            futures = [executor.submit(view.send_backend_request, request, req)
+                       for view, cache_key, out_data, req in pending]
+            for result, future in zip(pending, futures):
+                view, cache_key = result[0], result[1]
+                result[2] = view.process_data(request, view.resource_type, future.result(), cache_key)
+
+        return Response({
+            "resourceType": "Bundle",
+            "type": "collection",
+            "entry": [{"resource": out_data} for view, cache_key, out_data, req in results],
+        })
@@ -0,0 +1,40 @@
+"""
+JSON encoding and decoding with orjson when it is installed, else the
+standard json module.
+
+dumps() writes compact UTF-8 JSON like DRF's JSONRenderer. Types orjson
+does not handle natively (datetimes included, so they keep DRF's format)
+are passed to the default callable.
+"""
+import json
+
+try:
+    import orjson
+    # Older releases format datetimes themselves
+    if not hasattr(orjson, 'OPT_PASSTHROUGH_DATETIME'):
+        orjson = None
+except ImportError:
+    orjson = None
+
+
+def backend():
+    return 'orjson' if orjson is not None else 'json'
+
+
+def loads(content):
+    """
+    Decode JSON bytes or str. Raises ValueError on invalid JSON.
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def dumps(data, default=None):
+    """
+    Encode to compact UTF-8 JSON bytes. Raises TypeError for data that
+    cannot be encoded.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(data, default=default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
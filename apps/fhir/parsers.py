@@ -1,5 +1,26 @@
+from django.conf import settings
+from rest_framework.exceptions import ParseError
 from rest_framework.parsers import JSONParser
 
+from . import fastjson
 
-class FHIRParser(JSONParser):
+
+class FastJSONParser(JSONParser):
+    """
+    JSONParser decoding with orjson when it is installed. orjson is strict,
+    so it is only used with STRICT_JSON and UTF-8 request bodies.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        if fastjson.orjson is None or not self.strict or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+
+        try:
+            return fastjson.loads(stream.read())
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % exc)
+
+
+class FHIRParser(FastJSONParser):
     media_type = 'application/fhir+json'
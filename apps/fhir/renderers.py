@@ -1,5 +1,30 @@
 from rest_framework.renderers import JSONRenderer
 
+from . import fastjson
 
-class FHIRRenderer(JSONRenderer):
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer encoding with orjson when it is installed.
+
+    The output is the same as JSONRenderer's for compact, non-indented
+    UTF-8 output, the DRF defaults. Other output, and data orjson cannot
+    encode, is rendered by JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (data is None or fastjson.orjson is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = fastjson.dumps(data, default=self.encoder_class().default)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Escaped like JSONRenderer, so the output stays a strict javascript subset
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class FHIRRenderer(FastJSONRenderer):
     media_type = 'application/fhir+json'
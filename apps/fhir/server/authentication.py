@@ -7,6 +7,7 @@ from apps.fhir.bluebutton.utils import (generate_info_headers,
 from ..bluebutton.exceptions import UpstreamServerException
 from ..bluebutton.utils import (FhirServerAuth,
                                 get_resourcerouter)
+from .client import get_backend_client
 from .loggers import log_match_fhir_id
 from apps.fhir.bluebutton.signals import (
     pre_fetch,
@@ -46,10 +47,6 @@ def search_fhir_id_by_identifier(search_identifier, request=None):
         Raises exception:
             UpstreamServerException: For backend response issues.
     """
-    # Get certs from FHIR server settings
-    auth_settings = FhirServerAuth(None)
-    certs = (auth_settings['cert_file'], auth_settings['key_file'])
-
     # Add headers for FHIR backend logging, including auth_flow_dict
     if request:
         # Get auth flow session values.
@@ -70,12 +67,14 @@ def search_fhir_id_by_identifier(search_identifier, request=None):
         + "Patient/?identifier=" + search_identifier \
         + "&_format=" + settings.FHIR_PARAM_FORMAT
 
-    s = requests.Session()
+    # Get certs from FHIR server settings for the endpoint picked
+    auth_settings = FhirServerAuth(None, url=url)
+    certs = (auth_settings['cert_file'], auth_settings['key_file'])
 
     req = requests.Request('GET', url, headers=headers)
     prepped = req.prepare()
     pre_fetch.send_robust(FhirServerAuth, request=req, auth_flow_dict=auth_flow_dict)
-    response = s.send(prepped, cert=certs, verify=False)
+    response = get_backend_client().send(prepped, cert=certs, verify=False)
     post_fetch.send_robust(FhirServerAuth, request=req, response=response, auth_flow_dict=auth_flow_dict)
     response.raise_for_status()
     backend_data = response.json()
@@ -0,0 +1,217 @@
+"""
+Circuit breaker and adaptive timeouts for calls to the backend FHIR server.
+
+A CircuitBreaker per backend endpoint (scheme and host) keeps the calls of
+the last BREAKER_WINDOW seconds. Once there are at least BREAKER_MIN_CALLS
+of them and the share of failed calls (connection errors, timeouts and 5xx
+responses) reaches BREAKER_ERROR_RATE, or the share of calls slower than
+BREAKER_SLOW_CALL_TIME reaches BREAKER_SLOW_CALL_RATE, the breaker opens:
+calls fail fast for BREAKER_OPEN_TIME seconds. It then lets
+BREAKER_HALF_OPEN_CALLS probe calls through, closing again when they all
+succeed and reopening on the first failure.
+
+AdaptiveTimeouts keeps the last TIMEOUT_SAMPLES latencies per resource
+type. Once there are TIMEOUT_MIN_SAMPLES of them, a call gets TIMEOUT_MULTIPLIER
+times the TIMEOUT_PERCENTILE latency as its timeout, at least TIMEOUT_MIN
+and at most the timeout it was sent with (WAIT_TIME by default).
+
+All of these are FHIR_SERVER settings, see apps.fhir.server.settings.
+"""
+import logging
+import math
+import threading
+import time
+
+from collections import defaultdict, deque
+
+logger = logging.getLogger('hhs_server.%s' % __name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Recompute a percentile after this many new latencies
+PERCENTILE_REFRESH = 10
+
+
+class CircuitBreaker(object):
+    """
+    Thread safe closed/open/half open state of one backend endpoint.
+    """
+
+    def __init__(self, endpoint, window=60, min_calls=20, error_rate=0.5, slow_call_time=10,
+                 slow_call_rate=0.8, open_time=30, half_open_calls=1, clock=time.monotonic):
+        self.endpoint = endpoint
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_time = slow_call_time
+        self.slow_call_rate = slow_call_rate
+        self.open_time = open_time
+        self.half_open_calls = half_open_calls
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        # (time, failed, slow) of the calls in the window
+        self._calls = deque()
+        self.state = CLOSED
+        self.changed_at = clock()
+        self.opened = 0
+        self.rejected = 0
+        self._probes = 0
+        self._probe_successes = 0
+
+    def allow(self):
+        """
+        Return whether a call may be sent now. A True in the half open
+        state takes a probe slot, so every call allowed must be recorded.
+        """
+        with self._lock:
+            if self.state == OPEN:
+                if self.clock() - self.changed_at < self.open_time:
+                    self.rejected += 1
+                    return False
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    self.rejected += 1
+                    return False
+                self._probes += 1
+            return True
+
+    def record(self, elapsed, failed):
+        slow = elapsed >= self.slow_call_time
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes = max(self._probes - 1, 0)
+                if failed or slow:
+                    self._set_state(OPEN)
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_calls:
+                        self._set_state(CLOSED)
+                return
+            if self.state == OPEN:
+                # Sent before the breaker opened
+                return
+
+            now = self.clock()
+            self._calls.append((now, failed, slow))
+            self._trim(now)
+            if len(self._calls) < self.min_calls:
+                return
+            error_rate, slow_rate = self._rates()
+            if error_rate >= self.error_rate or slow_rate >= self.slow_call_rate:
+                self._set_state(OPEN)
+
+    def retry_after(self):
+        with self._lock:
+            if self.state != OPEN:
+                return 0
+            return max(math.ceil(self.open_time - (self.clock() - self.changed_at)), 0)
+
+    def _trim(self, now):
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+
+    def _rates(self):
+        calls = len(self._calls)
+        if not calls:
+            return 0.0, 0.0
+        return (sum(1 for _, failed, _ in self._calls if failed) / calls,
+                sum(1 for _, _, slow in self._calls if slow) / calls)
+
+    def _set_state(self, state):
+        if state == OPEN:
+            error_rate, slow_rate = self._rates()
+            logger.warning("Backend circuit breaker for %s changed from %s to %s "
+                           "(error rate %.2f, slow call rate %.2f over %s calls)"
+                           % (self.endpoint, self.state, state, error_rate, slow_rate, len(self._calls)))
+            self.opened += 1
+        else:
+            logger.warning("Backend circuit breaker for %s changed from %s to %s"
+                           % (self.endpoint, self.state, state))
+        if state == CLOSED:
+            self._calls.clear()
+        self.state = state
+        self.changed_at = self.clock()
+        self._probes = 0
+        self._probe_successes = 0
+
+    def snapshot(self):
+        retry_after = self.retry_after()
+        with self._lock:
+            self._trim(self.clock())
+            error_rate, slow_rate = self._rates()
+            return {
+                "state": self.state,
+                "state_age": round(self.clock() - self.changed_at, 3),
+                "retry_after": retry_after,
+                "calls": len(self._calls),
+                "error_rate": round(error_rate, 4),
+                "slow_call_rate": round(slow_rate, 4),
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+
+def percentile(values, p):
+    """
+    Nearest rank percentile of a sorted list.
+    """
+    if not values:
+        return None
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+class AdaptiveTimeouts(object):
+    """
+    Thread safe timeouts per resource type from the observed latencies.
+    """
+
+    def __init__(self, percentile=99, multiplier=2.0, minimum=5, min_samples=50, samples=1000):
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.minimum = minimum
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._latencies = defaultdict(lambda: deque(maxlen=samples))
+        self._percentiles = {}
+        self._pending = defaultdict(int)
+
+    def record(self, resource_type, elapsed):
+        with self._lock:
+            self._latencies[resource_type].append(elapsed)
+            self._pending[resource_type] += 1
+
+    def _percentile(self, resource_type):
+        # Called with the lock held
+        latencies = self._latencies.get(resource_type)
+        if latencies is None or len(latencies) < self.min_samples:
+            return None
+        if resource_type not in self._percentiles or self._pending[resource_type] >= PERCENTILE_REFRESH:
+            self._percentiles[resource_type] = percentile(sorted(latencies), self.percentile)
+            self._pending[resource_type] = 0
+        return self._percentiles[resource_type]
+
+    def timeout(self, resource_type, maximum):
+        with self._lock:
+            latency = self._percentile(resource_type)
+        if latency is None:
+            return maximum
+        return min(maximum, max(self.minimum, latency * self.multiplier))
+
+    def snapshot(self, maximum):
+        with self._lock:
+            resource_types = list(self._latencies)
+            latencies = {resource_type: self._percentile(resource_type) for resource_type in resource_types}
+            samples = {resource_type: len(self._latencies[resource_type]) for resource_type in resource_types}
+        return {
+            resource_type: {
+                "samples": samples[resource_type],
+                "latency_p%s_ms" % self.percentile: (round(latency * 1000, 3)
+                                                     if latency is not None else None),
+                "timeout": self.timeout(resource_type, maximum),
+            }
+            for resource_type, latency in latencies.items()
+        }
@@ -0,0 +1,485 @@
+"""
+Pooled, keep-alive HTTP client used for every call to the backend FHIR server (BFD).
+
+Building a new requests.Session() per call means every request pays a new
+TCP + client certificate TLS handshake. A single BackendClient is shared per
+worker process instead, and its connection pools are sized from the
+FHIR_SERVER settings. For example:
+
+FHIR_SERVER = {
+    "FHIR_URL": "https://fhir.server/v1/fhir/",
+    "POOL_CONNECTIONS": 10,        # number of per-host pools to keep
+    "POOL_MAXSIZE": 10,            # connections kept per host
+    "POOL_BLOCK": False,           # wait for a free connection instead of opening a new one
+    "POOL_TIMEOUT": 10,            # max seconds to wait for a free connection when blocking
+    "POOL_KEEPALIVE_TIMEOUT": 120, # idle seconds before a pooled connection is re-opened
+    "POOL_KEEPALIVE_MAX": 0,       # requests per connection before it is re-opened (0 = no limit)
+    "COALESCE": True,              # share the result of identical in flight GETs
+    "BREAKER_ENABLED": True,       # fail fast while the backend is failing, see apps.fhir.server.breaker
+    "ADAPTIVE_TIMEOUT": True,      # timeouts per resource type from the observed latencies
+}
+
+With COALESCE, a GET sent while an identical one (method, URL, body, client
+certificate and verify setting) is in flight is not sent again: the caller
+waits for the call in flight and gets its own copy of the response. Headers
+are not part of the key, as they carry per request logging values. The
+callers still check the response themselves, e.g. FhirDataView runs its
+permission classes on it for each request.
+
+Every call goes through the circuit breaker of its backend endpoint, which
+raises UpstreamServerException without calling the backend while it is
+open, and gets a timeout from the latencies of its resource type. Its
+start and outcome are reported to the load balancer, see
+apps.fhir.server.router.
+"""
+import copy
+import logging
+import os
+import threading
+import time
+
+from collections import deque
+from http import cookiejar
+from urllib.parse import urlsplit
+
+from requests import Request, Session
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from apps.fhir.bluebutton.exceptions import UpstreamServerException
+from .breaker import AdaptiveTimeouts, CircuitBreaker
+from .router import load_balancer
+from .settings import fhir_settings
+
+logger = logging.getLogger('hhs_server.%s' % __name__)
+
+# Window used for the handshakes per minute rate
+HANDSHAKE_WINDOW = 60
+
+
+class BlockAllCookies(cookiejar.CookiePolicy):
+    """
+    The session is shared by every beneficiary served by the worker,
+    so cookies set by the backend must never be stored or replayed.
+    """
+    netscape = True
+    rfc2965 = False
+    hide_cookie2 = False
+
+    def set_ok(self, cookie, request):
+        return False
+
+    def return_ok(self, cookie, request):
+        return False
+
+    def domain_return_ok(self, domain, request):
+        return False
+
+    def path_return_ok(self, path, request):
+        return False
+
+
+class PoolStats(object):
+    """
+    Thread safe counters for the connection pools of a BackendClient.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.reused = 0
+        self.handshakes = 0
+        self.recycled = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self._handshake_times = deque()
+
+    def record_request(self, reused):
+        with self._lock:
+            self.requests += 1
+            if reused:
+                self.reused += 1
+            else:
+                self.handshakes += 1
+                self._handshake_times.append(time.monotonic())
+
+    def record_wait(self, elapsed):
+        with self._lock:
+            self.waits += 1
+            self.wait_time += elapsed
+            self.max_wait_time = max(self.max_wait_time, elapsed)
+
+    def record_recycle(self):
+        with self._lock:
+            self.recycled += 1
+
+    def handshakes_per_minute(self):
+        cutoff = time.monotonic() - HANDSHAKE_WINDOW
+        with self._lock:
+            while self._handshake_times and self._handshake_times[0] < cutoff:
+                self._handshake_times.popleft()
+            return len(self._handshake_times)
+
+    def snapshot(self):
+        handshakes_per_minute = self.handshakes_per_minute()
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "reused": self.reused,
+                "reuse_ratio": round(self.reused / self.requests, 4) if self.requests else 0.0,
+                "handshakes": self.handshakes,
+                "handshakes_per_minute": handshakes_per_minute,
+                "recycled": self.recycled,
+                "wait_time_avg_ms": round(self.wait_time * 1000 / self.waits, 3) if self.waits else 0.0,
+                "wait_time_max_ms": round(self.max_wait_time * 1000, 3),
+            }
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Runs one call per key at a time, callers with the key of a call
+    in flight wait for it and share its result.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.followers = 0
+        self.errors = 0
+
+    def do(self, key, fn):
+        """
+        Return (result of fn, whether it came from another caller).
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.response, True
+
+        try:
+            call.response = fn()
+        except Exception as e:
+            call.error = e
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.response, False
+
+    def snapshot(self):
+        with self._lock:
+            calls = self.leaders + self.followers
+            return {
+                "coalesce_calls": calls,
+                "coalesce_in_flight": len(self._calls),
+                "coalesce_saved": self.followers,
+                "coalesce_saved_ratio": round(self.followers / calls, 4) if calls else 0.0,
+                "coalesce_errors": self.errors,
+            }
+
+
+def coalesce_key(prepped, cert=None, verify=None, **kwargs):
+    """
+    Key of a request that can share a call in flight, or None.
+    """
+    if prepped.method != 'GET' or kwargs.get('stream'):
+        return None
+    key = (prepped.method, prepped.url, prepped.body, cert, verify)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def endpoint_of(url):
+    parts = urlsplit(url)
+    return '%s://%s' % (parts.scheme, parts.netloc)
+
+
+def resource_type_of(url):
+    """
+    Resource type of a backend URL, the first capitalized path segment
+    (e.g. .../v1/fhir/ExplanationOfBenefit/), else the last one (metadata).
+    """
+    segments = [segment for segment in urlsplit(url).path.split('/') if segment]
+    for segment in segments:
+        if segment[0].isupper():
+            return segment
+    return segments[-1] if segments else ''
+
+
+def copy_response(response, prepped):
+    """
+    Copy of a loaded response for another caller, with its own request
+    so the post_fetch logging shows that caller's headers.
+    """
+    r = copy.copy(response)
+    r.headers = response.headers.copy()
+    r.request = prepped
+    r.coalesced = True
+    return r
+
+
+class InstrumentedPoolMixin(object):
+    """
+    Connection pool mixin recording reuse, handshakes and the time spent
+    waiting for a free connection, and recycling connections that outlived
+    the configured keep-alive limits.
+    """
+    stats = None
+    pool_timeout = None
+    keepalive_timeout = None
+    keepalive_max = None
+
+    def _get_conn(self, timeout=None):
+        if timeout is None:
+            timeout = self.pool_timeout
+        start = time.monotonic()
+        conn = super()._get_conn(timeout=timeout)
+        self.stats.record_wait(time.monotonic() - start)
+
+        if getattr(conn, 'sock', None) is not None and self._is_expired(conn):
+            conn.close()
+            self.stats.record_recycle()
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn.bb_last_used = time.monotonic()
+        super()._put_conn(conn)
+
+    def _make_request(self, conn, method, url, *args, **kwargs):
+        # A connection without a socket opens one (and handshakes) on this request
+        reused = getattr(conn, 'sock', None) is not None
+        conn.bb_requests = getattr(conn, 'bb_requests', 0) + 1 if reused else 1
+        self.stats.record_request(reused)
+        return super()._make_request(conn, method, url, *args, **kwargs)
+
+    def _is_expired(self, conn):
+        last_used = getattr(conn, 'bb_last_used', None)
+        if self.keepalive_timeout and last_used is not None:
+            if time.monotonic() - last_used > self.keepalive_timeout:
+                return True
+        if self.keepalive_max and getattr(conn, 'bb_requests', 0) >= self.keepalive_max:
+            return True
+        return False
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose pool manager builds instrumented connection pools.
+    """
+
+    def __init__(self, stats, pool_timeout=None, keepalive_timeout=None, keepalive_max=None, **kwargs):
+        # HTTPAdapter.__init__() calls init_poolmanager(), so set these first
+        self.stats = stats
+        self.pool_timeout = pool_timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.keepalive_max = keepalive_max
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        attrs = {
+            'stats': self.stats,
+            'pool_timeout': self.pool_timeout,
+            'keepalive_timeout': self.keepalive_timeout,
+            'keepalive_max': self.keepalive_max,
+        }
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': type('InstrumentedHTTPConnectionPool', (InstrumentedPoolMixin, HTTPConnectionPool), attrs),
+            'https': type('InstrumentedHTTPSConnectionPool', (InstrumentedPoolMixin, HTTPSConnectionPool), attrs),
+        }
+
+
+class BackendClient(object):
+    """
+    Shared session to the backend FHIR server.
+
+    Settings default to the FHIR_SERVER values, keyword arguments override them.
+    """
+
+    def __init__(self, pool_connections=None, pool_maxsize=None, pool_block=None,
+                 pool_timeout=None, keepalive_timeout=None, keepalive_max=None, coalesce=None,
+                 breaker_enabled=None, adaptive_timeout=None):
+        self.pool_connections = _setting(pool_connections, 'pool_connections')
+        self.pool_maxsize = _setting(pool_maxsize, 'pool_maxsize')
+        self.pool_block = _setting(pool_block, 'pool_block')
+        self.pool_timeout = _setting(pool_timeout, 'pool_timeout')
+        self.keepalive_timeout = _setting(keepalive_timeout, 'pool_keepalive_timeout')
+        self.keepalive_max = _setting(keepalive_max, 'pool_keepalive_max')
+        self.coalesce = _setting(coalesce, 'coalesce')
+        self.breaker_enabled = _setting(breaker_enabled, 'breaker_enabled')
+        self.adaptive_timeout = _setting(adaptive_timeout, 'adaptive_timeout')
+        self.wait_time = fhir_settings.wait_time
+
+        self._breakers = {}
+        self._breakers_lock = threading.Lock()
+        self.timeouts = AdaptiveTimeouts(percentile=fhir_settings.timeout_percentile,
+                                         multiplier=fhir_settings.timeout_multiplier,
+                                         minimum=fhir_settings.timeout_min,
+                                         min_samples=fhir_settings.timeout_min_samples,
+                                         samples=fhir_settings.timeout_samples)
+
+        self.pool_stats = PoolStats()
+        self.single_flight = SingleFlight()
+        self.session = Session()
+        self.session.cookies.set_policy(BlockAllCookies())
+
+        adapter = PooledHTTPAdapter(self.pool_stats,
+                                    pool_timeout=self.pool_timeout,
+                                    keepalive_timeout=self.keepalive_timeout,
+                                    keepalive_max=self.keepalive_max,
+                                    pool_connections=self.pool_connections,
+                                    pool_maxsize=self.pool_maxsize,
+                                    pool_block=self.pool_block)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def prepare_request(self, req):
+        return self.session.prepare_request(req)
+
+    def send(self, prepped, coalesce=True, **kwargs):
+        """
+        Send a prepared request, coalesce=False sends it even if an
+        identical one is in flight (e.g. a hedged request).
+        """
+        key = coalesce_key(prepped, **kwargs) if self.coalesce and coalesce else None
+        if key is None:
+            return self._send(prepped, **kwargs)
+
+        response, shared = self.single_flight.do(key, lambda: self._send(prepped, **kwargs))
+        return copy_response(response, prepped) if shared else response
+
+    def _send(self, prepped, **kwargs):
+        breaker = self.get_breaker(endpoint_of(prepped.url))
+        if breaker is not None and not breaker.allow():
+            raise UpstreamServerException("The upstream server is unavailable, try again later")
+
+        resource_type = resource_type_of(prepped.url)
+        timeout = kwargs.get('timeout') or self.wait_time
+        if self.adaptive_timeout and not isinstance(timeout, tuple):
+            timeout = self.timeouts.timeout(resource_type, timeout)
+        kwargs['timeout'] = timeout
+
+        endpoint = load_balancer.started(prepped.url)
+        start = time.monotonic()
+        failed = True
+        try:
+            response = self.session.send(prepped, **kwargs)
+            failed = response.status_code >= 500
+            return response
+        finally:
+            # Timeouts count too, so the timeout grows back when the backend slows down
+            elapsed = time.monotonic() - start
+            self.timeouts.record(resource_type, elapsed)
+            if breaker is not None:
+                breaker.record(elapsed, failed)
+            load_balancer.finished(endpoint, elapsed, failed)
+
+    def get(self, url, params=None, headers=None, **kwargs):
+        return self.send(self.prepare_request(Request('GET', url, params=params, headers=headers)), **kwargs)
+
+    def get_breaker(self, endpoint):
+        if not self.breaker_enabled:
+            return None
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            with self._breakers_lock:
+                breaker = self._breakers.get(endpoint)
+                if breaker is None:
+                    breaker = self._breakers[endpoint] = CircuitBreaker(
+                        endpoint,
+                        window=fhir_settings.breaker_window,
+                        min_calls=fhir_settings.breaker_min_calls,
+                        error_rate=fhir_settings.breaker_error_rate,
+                        slow_call_time=fhir_settings.breaker_slow_call_time,
+                        slow_call_rate=fhir_settings.breaker_slow_call_rate,
+                        open_time=fhir_settings.breaker_open_time,
+                        half_open_calls=fhir_settings.breaker_half_open_calls)
+        return breaker
+
+    def close(self):
+        self.session.close()
+
+    def stats(self):
+        result = self.pool_stats.snapshot()
+        result.update(self.single_flight.snapshot())
+        result.update({
+            "pid": os.getpid(),
+            "pool_connections": self.pool_connections,
+            "pool_maxsize": self.pool_maxsize,
+            "pool_block": self.pool_block,
+            "keepalive_timeout": self.keepalive_timeout,
+            "keepalive_max": self.keepalive_max,
+            "coalesce": self.coalesce,
+        })
+        return result
+
+    def status(self):
+        """
+        Circuit breaker state and load balancer counters per backend endpoint
+        and timeout per resource type.
+        """
+        with self._breakers_lock:
+            breakers = dict(self._breakers)
+        return {
+            "pid": os.getpid(),
+            "breaker_enabled": self.breaker_enabled,
+            "endpoints": {endpoint: breaker.snapshot() for endpoint, breaker in breakers.items()},
+            "adaptive_timeout": self.adaptive_timeout,
+            "wait_time": self.wait_time,
+            "timeouts": self.timeouts.snapshot(self.wait_time),
+            "load_balancer": load_balancer.snapshot(),
+        }
+
+
+def _setting(value, name):
+    return getattr(fhir_settings, name) if value is None else value
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_backend_client():
+    """
+    Return the BackendClient of the current worker process.
+
+    Sockets must not be shared across a fork, so a client created
+    before the fork (e.g. gunicorn --preload) is replaced in the child.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                logger.debug("Creating backend client for pid %s" % pid)
+                _client = BackendClient()
+                _client_pid = pid
+    return _client
@@ -6,8 +6,8 @@ from apps.fhir.bluebutton.utils import (
 
 
 # return certs
-def certs(crosswalk=None):
-    auth_state = FhirServerAuth(crosswalk)
+def certs(crosswalk=None, url=None):
+    auth_state = FhirServerAuth(crosswalk, url=url)
     return (auth_state.get('cert_file', None), auth_state.get('key_file', None))
 
 
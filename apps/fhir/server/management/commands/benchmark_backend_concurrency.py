@@ -0,0 +1,47 @@
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+
+from apps.fhir.server.client import BackendClient
+from apps.fhir.server.mock_bfd import MockBFDServer
+
+
+class Command(BaseCommand):
+    help = ('Measure how many backend requests one process keeps in flight '
+            'for a given number of request threads, against a local BFD stand-in. '
+            'Only the shared BackendClient is exercised, not the views or a WSGI server, '
+            'the results say nothing of a server worker class.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="requests per run")
+        parser.add_argument('--threads', default='1,4,16,64', help="comma separated thread counts")
+        parser.add_argument('--latency', type=float, default=0.1, help="backend latency in seconds")
+
+    def handle(self, *args, **options):
+        server = MockBFDServer(latency=options['latency']).start()
+        url = server.url + "ExplanationOfBenefit/"
+        params = {'patient': '-20140000008325', '_count': 10, '_format': 'application/json+fhir'}
+
+        self.stdout.write("backend latency: %sms, requests per run: %s" % (
+            int(options['latency'] * 1000), options['requests']))
+        self.stdout.write("%8s %10s %10s %14s %10s %12s" % (
+            'threads', 'elapsed_s', 'req/s', 'max_in_flight', 'handshakes', 'reuse_ratio'))
+        try:
+            for threads in [int(t) for t in options['threads'].split(',')]:
+                server.max_in_flight = 0
+                client = BackendClient(pool_maxsize=threads)
+
+                start = time.monotonic()
+                with ThreadPoolExecutor(max_workers=threads) as executor:
+                    list(executor.map(lambda _: client.get(url, params=params).content,
+                                      range(options['requests'])))
+                elapsed = time.monotonic() - start
+
+                stats = client.stats()
+                self.stdout.write("%8d %10.2f %10.1f %14d %10d %12.3f" % (
+                    threads, elapsed, options['requests'] / elapsed, server.max_in_flight,
+                    stats['handshakes'], stats['reuse_ratio']))
+                client.close()
+        finally:
+            server.stop()
@@ -0,0 +1,126 @@
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.fhir.server.mock_bfd import MockBFDServer
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(timings, p):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * p / 100))]
+
+
+class Command(BaseCommand):
+    help = ('Compare concurrent FHIR requests served by the Django application under gunicorn '
+            'sync and gthread workers, against a local BFD stand-in. The servers use the '
+            'database of the current settings, which must hold the --token access token '
+            '(e.g. from create_test_user_and_application).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--token', required=True, help="access token of a beneficiary")
+        parser.add_argument('--path', default='/v1/fhir/ExplanationOfBenefit/', help="FHIR path requested")
+        parser.add_argument('--requests', type=int, default=200, help="requests per run")
+        parser.add_argument('--concurrency', type=int, default=32, help="requests sent at once")
+        parser.add_argument('--latency', type=float, default=0.1, help="backend latency in seconds")
+        parser.add_argument('--workers', type=int, default=2, help="gunicorn worker processes")
+        parser.add_argument('--threads', type=int, default=8, help="threads per gthread worker")
+
+    def handle(self, *args, **options):
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            raise CommandError("gunicorn is not installed, see requirements/requirements.txt")
+
+        runs = [
+            # More than one thread would make gunicorn use gthread workers
+            ('sync', ['--worker-class', 'sync', '--threads', '1']),
+            ('gthread', ['--worker-class', 'gthread', '--threads', str(options['threads'])]),
+        ]
+
+        bfd = MockBFDServer(latency=options['latency']).start()
+        certs = tempfile.mkdtemp()
+        try:
+            env = self.server_env(bfd.url, certs)
+            self.stdout.write("backend latency: %sms, requests per run: %s, concurrency: %s, workers: %s" % (
+                int(options['latency'] * 1000), options['requests'], options['concurrency'], options['workers']))
+            self.stdout.write("%8s %10s %10s %10s %10s %8s %14s" % (
+                'workers', 'elapsed_s', 'req/s', 'p50_ms', 'p95_ms', 'errors', 'max_in_flight'))
+            for name, worker_args in runs:
+                port = free_port()
+                server = subprocess.Popen(
+                    [sys.executable, '-m', 'gunicorn.app.wsgiapp', 'hhs_oauth_server.wsgi:application',
+                     '--bind', '127.0.0.1:%d' % port, '--workers', str(options['workers'])] + worker_args,
+                    env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                try:
+                    url = "http://127.0.0.1:%d%s" % (port, options['path'])
+                    headers = {'Authorization': "Bearer %s" % options['token']}
+                    self.wait_ready(url, headers, server)
+                    # Not the calls of the worker warm-up
+                    bfd.max_in_flight = 0
+                    elapsed, timings, errors = self.run_load(url, headers, options['requests'], options['concurrency'])
+                finally:
+                    server.terminate()
+                    server.wait()
+                self.stdout.write("%8s %10.2f %10.1f %10.1f %10.1f %8d %14d" % (
+                    name, elapsed, options['requests'] / elapsed, 1000 * percentile(timings, 50),
+                    1000 * percentile(timings, 95), errors, bfd.max_in_flight))
+        finally:
+            bfd.stop()
+            for name in os.listdir(certs):
+                os.remove(os.path.join(certs, name))
+            os.rmdir(certs)
+
+    def server_env(self, fhir_url, certs):
+        env = dict(os.environ, FHIR_URL=fhir_url)
+        # Client certificates must exist, they are not sent over http
+        for name, variable in (('cert.pem', 'FHIR_CERT_FILE'), ('key.pem', 'FHIR_KEY_FILE')):
+            path = os.path.join(certs, name)
+            open(path, 'w').close()
+            env[variable] = path
+        return env
+
+    def wait_ready(self, url, headers, server, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError("gunicorn exited with status %s" % server.returncode)
+            try:
+                r = requests.get(url, headers=headers, timeout=10)
+            except requests.ConnectionError:
+                time.sleep(0.2)
+                continue
+            if r.status_code != 200:
+                raise CommandError("%s returned %s: %s" % (url, r.status_code, r.text[:200]))
+            return
+        raise CommandError("gunicorn did not answer within %s seconds" % timeout)
+
+    def run_load(self, url, headers, count, concurrency):
+        def get(i):
+            start = time.monotonic()
+            try:
+                # A page of its own, identical backend calls in flight would be shared
+                ok = requests.get(url, params={'startIndex': i % 100, '_count': 5},
+                                  headers=headers, timeout=60).status_code == 200
+            except requests.RequestException:
+                ok = False
+            return time.monotonic() - start, ok
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(get, range(count)))
+        elapsed = time.monotonic() - start
+        return elapsed, [timing for timing, ok in results], sum(1 for timing, ok in results if not ok)
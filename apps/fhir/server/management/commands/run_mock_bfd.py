@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from apps.fhir.server.mock_bfd import MockBFDServer
+
+
+class Command(BaseCommand):
+    help = 'Run a local stand-in for the backend FHIR server (BFD).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help="address to listen on")
+        parser.add_argument('--port', type=int, default=8090, help="port to listen on")
+        parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+        parser.add_argument('--eob-total', type=int, default=100, help="EOB count per beneficiary")
+
+    def handle(self, *args, **options):
+        server = MockBFDServer((options['host'], options['port']),
+                               latency=options['latency'],
+                               eob_total=options['eob_total'])
+        self.stdout.write("Mock BFD serving at %s" % server.url)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,376 @@
+"""
+Local stand-in for the backend FHIR server (BFD).
+
+Serves synthetic Patient, Coverage and ExplanationOfBenefit resources for any
+beneficiary id, with an optional per-request latency, so benchmarks and end to
+end tests can run without certificates or network access.
+
+Run it standalone with:
+
+    python manage.py run_mock_bfd --port 8090 --latency 0.2
+
+and point FHIR_URL at http://127.0.0.1:8090/v1/fhir/
+"""
+import json
+import socketserver
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+FHIR_PATH = "/v1/fhir/"
+
+# fhir_id returned by Patient identifier (mbi/hicn hash) searches
+DEFAULT_IDENTIFIER_FHIR_ID = "-20140000008325"
+
+EOB_TYPES = ["carrier", "pde", "outpatient", "inpatient", "dme", "hha", "hospice", "snf"]
+
+COVERAGE_PARTS = ["A", "B", "C", "D"]
+
+
+def patient_resource(fhir_id):
+    return {
+        "resourceType": "Patient",
+        "id": fhir_id,
+        "meta": {"lastUpdated": "2020-07-07T20:40:20.685+00:00"},
+        "extension": [{
+            "url": "https://bluebutton.cms.gov/resources/variables/race",
+            "valueCoding": {
+                "system": "https://bluebutton.cms.gov/resources/variables/race",
+                "code": "1",
+                "display": "White",
+            },
+        }],
+        "identifier": [{
+            "system": "https://bluebutton.cms.gov/resources/variables/bene_id",
+            "value": fhir_id,
+        }],
+        "name": [{"use": "usual", "family": "Doe", "given": ["Jane", "X"]}],
+        "gender": "female",
+        "birthDate": "2014-06-01",
+    }
+
+
+def coverage_resource(fhir_id, part):
+    return {
+        "resourceType": "Coverage",
+        "id": "part-%s-%s" % (part.lower(), fhir_id),
+        "meta": {"lastUpdated": "2020-07-07T20:40:21.347+00:00"},
+        "extension": [{
+            "url": "https://bluebutton.cms.gov/resources/variables/ms_cd",
+            "valueCoding": {
+                "system": "https://bluebutton.cms.gov/resources/variables/ms_cd",
+                "code": "10",
+                "display": "Aged without end-stage renal disease (ESRD)",
+            },
+        }],
+        "status": "active",
+        "type": {"coding": [{"system": "Medicare", "code": "Part %s" % part}]},
+        "beneficiary": {"reference": "Patient/%s" % fhir_id},
+        "grouping": {"subGroup": "Medicare", "subPlan": "Part %s" % part},
+    }
+
+
+def eob_resource(fhir_id, index):
+    """
+    Synthetic claim shaped like a BFD STU3 ExplanationOfBenefit, roughly the
+    size of a real carrier claim.
+    """
+    eob_type = EOB_TYPES[index % len(EOB_TYPES)]
+    claim_id = "-%d" % (10000000000 + index)
+    items = []
+    for seq in range(1, 4):
+        items.append({
+            "sequence": seq,
+            "careTeamLinkId": [seq],
+            "diagnosisLinkId": [seq],
+            "service": {"coding": [{
+                "system": "https://bluebutton.cms.gov/resources/codesystem/hcpcs",
+                "version": "5",
+                "code": "9221%d" % seq,
+            }]},
+            "servicedPeriod": {"start": "2019-04-0%d" % seq, "end": "2019-04-0%d" % seq},
+            "locationCodeableConcept": {
+                "extension": [{
+                    "url": "https://bluebutton.cms.gov/resources/variables/prvdr_state_cd",
+                    "valueCoding": {
+                        "system": "https://bluebutton.cms.gov/resources/variables/prvdr_state_cd",
+                        "code": "99",
+                        "display": "With 000 county code is American Samoa; otherwise unknown",
+                    },
+                }],
+                "coding": [{
+                    "system": "https://bluebutton.cms.gov/resources/variables/line_place_of_srvc_cd",
+                    "code": "11",
+                    "display": "Office. Location, other than a hospital, where the health professional "
+                               "routinely provides health examinations, diagnosis, and treatment.",
+                }],
+            },
+            "quantity": {"value": 1},
+            "adjudication": [{
+                "category": {"coding": [{
+                    "system": "https://bluebutton.cms.gov/resources/codesystem/adjudication",
+                    "code": "https://bluebutton.cms.gov/resources/variables/line_nch_pmt_amt",
+                    "display": "Line NCH Medicare Payment Amount",
+                }]},
+                "amount": {"value": 37.5 * seq, "system": "urn:iso:std:iso:4217", "code": "USD"},
+            }, {
+                "category": {"coding": [{
+                    "system": "https://bluebutton.cms.gov/resources/codesystem/adjudication",
+                    "code": "https://bluebutton.cms.gov/resources/variables/line_bene_ptb_ddctbl_amt",
+                    "display": "Line Beneficiary Part B Deductible Amount",
+                }]},
+                "amount": {"value": 0, "system": "urn:iso:std:iso:4217", "code": "USD"},
+            }],
+        })
+
+    return {
+        "resourceType": "ExplanationOfBenefit",
+        "id": "%s-%s" % (eob_type, claim_id),
+        "meta": {"lastUpdated": "2020-01-01T00:00:00.000+00:00"},
+        "extension": [{
+            "url": "https://bluebutton.cms.gov/resources/variables/carr_num",
+            "valueIdentifier": {
+                "system": "https://bluebutton.cms.gov/resources/variables/carr_num",
+                "value": "61026",
+            },
+        }],
+        "identifier": [{
+            "system": "https://bluebutton.cms.gov/resources/variables/clm_id",
+            "value": claim_id,
+        }, {
+            "system": "https://bluebutton.cms.gov/resources/identifier/claim-group",
+            "value": str(900 + index),
+        }],
+        "type": {"coding": [{
+            "system": "https://bluebutton.cms.gov/resources/variables/nch_clm_type_cd",
+            "code": "71",
+            "display": "Local carrier non-durable medical equipment, prosthetics, orthotics, "
+                       "and supplies (DMEPOS) claim",
+        }, {
+            "system": "https://bluebutton.cms.gov/resources/codesystem/eob-type",
+            "code": eob_type.upper(),
+        }, {
+            "system": "http://hl7.org/fhir/ex-claimtype",
+            "code": "professional",
+            "display": "Professional",
+        }]},
+        "status": "active",
+        "patient": {"reference": "Patient/%s" % fhir_id},
+        "billablePeriod": {"start": "2019-04-01", "end": "2019-04-03"},
+        "disposition": "Debit accepted",
+        "provider": {"identifier": {
+            "system": "http://hl7.org/fhir/sid/us-npi",
+            "value": "1234567890",
+        }},
+        "careTeam": [{
+            "sequence": seq,
+            "provider": {"identifier": {"system": "http://hl7.org/fhir/sid/us-npi", "value": "99999999%d" % seq}},
+            "role": {"coding": [{"system": "http://hl7.org/fhir/claimcareteamrole", "code": "primary",
+                                 "display": "Primary provider"}]},
+        } for seq in range(1, 4)],
+        "diagnosis": [{
+            "sequence": seq,
+            "diagnosisCodeableConcept": {"coding": [{"system": "http://hl7.org/fhir/sid/icd-10",
+                                                     "code": "H5%d00" % seq}]},
+        } for seq in range(1, 4)],
+        "item": items,
+        "payment": {"amount": {"value": 225.0, "system": "urn:iso:std:iso:4217", "code": "USD"}},
+        "totalCost": {"value": 250.0, "system": "urn:iso:std:iso:4217", "code": "USD"},
+        "benefitBalance": [{
+            "category": {"coding": [{"system": "http://hl7.org/fhir/benefit-category", "code": "medical",
+                                     "display": "Medical Health Coverage"}]},
+            "financial": [{
+                "type": {"coding": [{
+                    "system": "https://bluebutton.cms.gov/resources/codesystem/benefit-balance",
+                    "code": "https://bluebutton.cms.gov/resources/variables/carr_clm_cash_ddctbl_apld_amt",
+                    "display": "Carrier Claim Cash Deductible Applied Amount",
+                }]},
+                "usedMoney": {"value": 0, "system": "urn:iso:std:iso:4217", "code": "USD"},
+            }],
+        }],
+    }
+
+
+def search_bundle(base_url, resource_type, query, resources, start_index, count, total):
+    """
+    Bundle of type searchset with first/previous/next/last/self paging links.
+    """
+    def page_url(index):
+        params = dict(query)
+        params.update({"startIndex": index, "_count": count})
+        return "%s%s?%s" % (base_url, resource_type, urlencode(sorted(params.items())))
+
+    links = [{"relation": "first", "url": page_url(0)}]
+    if start_index > 0:
+        links.append({"relation": "previous", "url": page_url(max(start_index - count, 0))})
+    if count and start_index + count < total:
+        links.append({"relation": "next", "url": page_url(start_index + count)})
+        links.append({"relation": "last", "url": page_url(((total - 1) // count) * count)})
+    links.append({"relation": "self", "url": page_url(start_index)})
+
+    bundle = {
+        "resourceType": "Bundle",
+        "id": "mock-bfd-%s-%s" % (resource_type.lower(), start_index),
+        "meta": {"lastUpdated": "2020-07-07T20:40:21.347+00:00"},
+        "type": "searchset",
+        "total": total,
+        "link": links,
+    }
+    if resources:
+        bundle["entry"] = [{"resource": r} for r in resources]
+    return bundle
+
+
+def eob_bundle(fhir_id, start_index=0, count=10, total=100, base_url="http://localhost" + FHIR_PATH):
+    end = min(start_index + count, total)
+    resources = [eob_resource(fhir_id, i) for i in range(start_index, end)]
+    return search_bundle(base_url, "ExplanationOfBenefit", {"patient": fhir_id},
+                         resources, start_index, count, total)
+
+
+def capability_statement():
+    return {
+        "resourceType": "CapabilityStatement",
+        "status": "active",
+        "date": "2020-07-07T20:40:21+00:00",
+        "publisher": "Centers for Medicare & Medicaid Services",
+        "kind": "instance",
+        "software": {"name": "Blue Button API: Direct", "version": "1.0.0-SNAPSHOT"},
+        "fhirVersion": "3.0.2",
+        "acceptUnknown": "extensions",
+        "format": ["application/fhir+xml", "application/fhir+json"],
+        "rest": [{
+            "mode": "server",
+            "resource": [{
+                "type": resource_type,
+                "profile": {"reference": "http://hl7.org/fhir/Profile/%s" % resource_type},
+                "interaction": [{"code": "read"}, {"code": "search-type"}],
+            } for resource_type in ["Coverage", "ExplanationOfBenefit", "Patient", "Vision"]],
+        }],
+    }
+
+
+class MockBFDHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.request_started()
+        try:
+            # Backend GETs also carry the parameters as a form body, read it so the
+            # next request on the kept alive connection does not start with it
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            status, body = self.route()
+            content = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/fhir+json;charset=UTF-8')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            if self.server.chunk_delay:
+                # Trickle the body out like a backend generating a large Bundle
+                for i in range(0, len(content), 16 * 1024):
+                    self.wfile.write(content[i:i + 16 * 1024])
+                    self.wfile.flush()
+                    time.sleep(self.server.chunk_delay)
+            else:
+                self.wfile.write(content)
+        finally:
+            self.server.request_finished()
+
+    def route(self):
+        parsed = urlparse(self.path)
+        if not parsed.path.startswith(FHIR_PATH):
+            return 404, {}
+        query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        parts = [p for p in parsed.path[len(FHIR_PATH):].split('/') if p]
+        if not parts:
+            return 404, {}
+
+        resource_type = parts[0]
+        resource_id = parts[1] if len(parts) > 1 else None
+        start_index = int(query.get('startIndex', 0))
+        count = int(query.get('_count', 10))
+        base_url = "http://%s:%s%s" % (self.server.server_address[0], self.server.server_address[1], FHIR_PATH)
+
+        if resource_type == 'metadata':
+            return 200, capability_statement()
+
+        if resource_type == 'Patient':
+            if resource_id:
+                return 200, patient_resource(resource_id)
+            fhir_id = query.get('_id', DEFAULT_IDENTIFIER_FHIR_ID if 'identifier' in query else None)
+            if fhir_id is None:
+                return 400, {}
+            return 200, search_bundle(base_url, "Patient", {"_id": fhir_id},
+                                      [patient_resource(fhir_id)], 0, count, 1)
+
+        if resource_type == 'Coverage':
+            if resource_id:
+                part, fhir_id = resource_id.split('-', 2)[1:]
+                return 200, coverage_resource(fhir_id, part.upper())
+            fhir_id = query.get('beneficiary', '').split('/')[-1]
+            resources = [coverage_resource(fhir_id, part) for part in COVERAGE_PARTS]
+            return 200, search_bundle(base_url, "Coverage", {"beneficiary": "Patient/" + fhir_id},
+                                      resources[start_index:start_index + count],
+                                      start_index, count, len(resources))
+
+        if resource_type == 'ExplanationOfBenefit':
+            if resource_id:
+                return 200, eob_resource(self.server.read_fhir_id, 0)
+            return 200, eob_bundle(query.get('patient', ''), start_index, count,
+                                   self.server.eob_total, base_url)
+
+        return 404, {}
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockBFDServer(socketserver.ThreadingMixIn, HTTPServer):
+    """
+    Threaded stand-in server. Tracks request counts and the highest number
+    of requests in flight at once.
+    """
+    daemon_threads = True
+    # Benchmarks open many connections at once, the default backlog of 5 refuses some
+    request_queue_size = 128
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, eob_total=100,
+                 read_fhir_id=DEFAULT_IDENTIFIER_FHIR_ID, chunk_delay=0.0):
+        super().__init__(address, MockBFDHandler)
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.eob_total = eob_total
+        self.read_fhir_id = read_fhir_id
+        self.request_count = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://%s:%s%s" % (self.server_address[0], self.server_address[1], FHIR_PATH)
+
+    def request_started(self):
+        with self._lock:
+            self.request_count += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def request_finished(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,253 @@
+"""
+Load balancing of backend FHIR calls across the FHIR_SERVER endpoints.
+
+FHIR_SERVER["ENDPOINTS"] lists the backend endpoints, each a dict of
+FHIR_SERVER settings overriding the top level ones, plus a WEIGHT. For example:
+
+FHIR_SERVER = {
+    "CERT_FILE": "ca.cert.pem",
+    "KEY_FILE": "ca.key.nocrypt.pem",
+    "CLIENT_AUTH": True,
+    "ENDPOINTS": [
+        {"FHIR_URL": "https://bfd-east.example/v1/fhir/", "WEIGHT": 2},
+        {"FHIR_URL": "https://bfd-west.example/v1/fhir/", "CERT_FILE": "west.cert.pem",
+         "KEY_FILE": "west.key.nocrypt.pem"},
+    ],
+    "LOAD_BALANCER": "least_outstanding",  # or "ewma"
+    "EJECT_ERRORS": 5,         # consecutive errors that eject an endpoint
+    "EJECT_TIME": 30,          # seconds before an ejected endpoint is probed or tried again
+    "PROBE_INTERVAL": 10,      # seconds between probes of an ejected endpoint (0 = no probes)
+}
+
+Without ENDPOINTS the top level FHIR_URL is the only endpoint.
+
+least_outstanding picks the healthy endpoint with the fewest calls in
+flight per weight, ewma the one with the lowest moving average latency
+times the calls in flight per weight. BackendClient reports the start and
+outcome of every call. An endpoint is ejected after EJECT_ERRORS
+consecutive 5xx or failed calls. Once EJECT_TIME has passed, a GET of its
+PROBE_PATH restores it, or without probes it takes calls again and is
+ejected again on the next EJECT_ERRORS errors. When every endpoint is
+ejected, all of them are used.
+"""
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+
+from django.conf import settings
+
+from .settings import fhir_settings
+
+logger = logging.getLogger('hhs_server.%s' % __name__)
+
+LEAST_OUTSTANDING = 'least_outstanding'
+EWMA = 'ewma'
+
+
+class Endpoint(object):
+    """
+    A backend endpoint and its health. Settings the endpoint does not
+    override come from FHIR_SERVER.
+    """
+
+    def __init__(self, options=None):
+        self.options = {key.upper(): value for key, value in (options or {}).items()}
+        self.weight = self.options.pop('WEIGHT', 1)
+        self.outstanding = 0
+        self.ewma = None
+        self.calls = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.ejected_at = None
+        self.ejections = 0
+        self.probed_at = None
+        self.probing = False
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        try:
+            return self.options[attr.upper()]
+        except KeyError:
+            return getattr(fhir_settings, attr)
+
+    def owns(self, url):
+        return url.startswith(self.fhir_url)
+
+    def client_cert(self):
+        if not self.client_auth:
+            return (self.cert_file, self.key_file)
+        return (os.path.join(settings.FHIR_CLIENT_CERTSTORE, self.cert_file),
+                os.path.join(settings.FHIR_CLIENT_CERTSTORE, self.key_file))
+
+    def snapshot(self):
+        return {
+            "fhir_url": self.fhir_url,
+            "weight": self.weight,
+            "healthy": self.ejected_at is None,
+            "outstanding": self.outstanding,
+            "ewma_ms": round(self.ewma * 1000, 3) if self.ewma is not None else None,
+            "calls": self.calls,
+            "errors": self.errors,
+            "consecutive_errors": self.consecutive_errors,
+            "ejections": self.ejections,
+        }
+
+
+class LoadBalancer(object):
+    """
+    Thread safe choice of the endpoint for each backend call of a process.
+    """
+
+    def __init__(self, endpoints, policy=LEAST_OUTSTANDING, ewma_alpha=0.3, eject_errors=5,
+                 eject_time=30, probe_interval=10, probe_path='metadata', clock=time.monotonic):
+        self.endpoints = endpoints
+        self.policy = policy
+        self.ewma_alpha = ewma_alpha
+        self.eject_errors = eject_errors
+        self.eject_time = eject_time
+        self.probe_interval = probe_interval
+        self.probe_path = probe_path
+        self.clock = clock
+        self._lock = threading.Lock()
+
+    def choose(self):
+        if len(self.endpoints) == 1:
+            return self.endpoints[0]
+        now = self.clock()
+        with self._lock:
+            healthy = [endpoint for endpoint in self.endpoints if self._is_healthy(endpoint, now)]
+            probes = [endpoint for endpoint in self.endpoints if self._probe_due(endpoint, now)]
+            for endpoint in probes:
+                endpoint.probing = True
+                endpoint.probed_at = now
+        for endpoint in probes:
+            threading.Thread(target=self._probe, args=(endpoint,), name='backend-endpoint-probe',
+                             daemon=True).start()
+        return self._pick(healthy or self.endpoints)
+
+    def _pick(self, candidates):
+        if self.policy == EWMA:
+            def cost(endpoint):
+                return (endpoint.ewma or 0) * (endpoint.outstanding + 1) / endpoint.weight
+        else:
+            def cost(endpoint):
+                return endpoint.outstanding / endpoint.weight
+        lowest = min(cost(endpoint) for endpoint in candidates)
+        return random.choice([endpoint for endpoint in candidates if cost(endpoint) == lowest])
+
+    def _is_healthy(self, endpoint, now):
+        if endpoint.ejected_at is None:
+            return True
+        if not self.probe_interval and now - endpoint.ejected_at >= self.eject_time:
+            # No probes, the next calls tell whether it recovered
+            endpoint.ejected_at = None
+            endpoint.consecutive_errors = 0
+            return True
+        return False
+
+    def _probe_due(self, endpoint, now):
+        if endpoint.ejected_at is None or not self.probe_interval or endpoint.probing:
+            return False
+        if now - endpoint.ejected_at < self.eject_time:
+            return False
+        return endpoint.probed_at is None or now - endpoint.probed_at >= self.probe_interval
+
+    def _probe(self, endpoint):
+        healthy = False
+        try:
+            r = requests.get(endpoint.fhir_url + self.probe_path,
+                             params={'_format': 'json'},
+                             cert=endpoint.client_cert(),
+                             timeout=endpoint.wait_time,
+                             verify=endpoint.verify_server)
+            healthy = r.status_code < 500
+        except requests.RequestException as e:
+            logger.info("Backend endpoint %s probe failed: %r" % (endpoint.fhir_url, e))
+        finally:
+            with self._lock:
+                endpoint.probing = False
+                if healthy:
+                    endpoint.ejected_at = None
+                    endpoint.consecutive_errors = 0
+        if healthy:
+            logger.info("Backend endpoint %s restored" % endpoint.fhir_url)
+
+    def endpoint_for(self, url):
+        """
+        The endpoint url was built from, else None.
+        """
+        for endpoint in self.endpoints:
+            if endpoint.owns(url):
+                return endpoint
+        return None
+
+    def relative_url(self, url):
+        """
+        url without the endpoint it was built from, the same whichever
+        endpoint was chosen, e.g. for cache keys.
+        """
+        endpoint = self.endpoint_for(url)
+        if endpoint is None:
+            return url
+        return url[len(endpoint.fhir_url):]
+
+    def started(self, url):
+        endpoint = self.endpoint_for(url)
+        if endpoint is not None:
+            with self._lock:
+                endpoint.outstanding += 1
+        return endpoint
+
+    def finished(self, endpoint, elapsed, failed):
+        """
+        Record the outcome of a call to the endpoint returned by started().
+        """
+        if endpoint is None:
+            return
+        with self._lock:
+            endpoint.outstanding -= 1
+            endpoint.calls += 1
+            if endpoint.ewma is None:
+                endpoint.ewma = elapsed
+            else:
+                endpoint.ewma += self.ewma_alpha * (elapsed - endpoint.ewma)
+            if not failed:
+                endpoint.consecutive_errors = 0
+                return
+            endpoint.errors += 1
+            endpoint.consecutive_errors += 1
+            eject = (endpoint.ejected_at is None and len(self.endpoints) > 1
+                     and endpoint.consecutive_errors >= self.eject_errors)
+            if eject:
+                endpoint.ejected_at = self.clock()
+                endpoint.probed_at = None
+                endpoint.ejections += 1
+        if eject:
+            logger.warning("Backend endpoint %s ejected after %d consecutive errors"
+                           % (endpoint.fhir_url, self.eject_errors))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "policy": self.policy,
+                "endpoints": [endpoint.snapshot() for endpoint in self.endpoints],
+            }
+
+
+def build_load_balancer():
+    endpoints = [Endpoint(options) for options in fhir_settings.endpoints] or [Endpoint()]
+    return LoadBalancer(endpoints,
+                        policy=fhir_settings.load_balancer,
+                        ewma_alpha=fhir_settings.ewma_alpha,
+                        eject_errors=fhir_settings.eject_errors,
+                        eject_time=fhir_settings.eject_time,
+                        probe_interval=fhir_settings.probe_interval,
+                        probe_path=fhir_settings.probe_path)
+
+
+load_balancer = build_load_balancer()
@@ -22,6 +22,38 @@ DEFAULTS = {
     "SERVER_VERIFY": False,
     "WAIT_TIME": 30,
     "VERIFY_SERVER": False,
+    # Backend connection pool, see apps.fhir.server.client
+    "POOL_CONNECTIONS": 10,
+    "POOL_MAXSIZE": 10,
+    "POOL_BLOCK": False,
+    "POOL_TIMEOUT": 10,
+    "POOL_KEEPALIVE_TIMEOUT": 120,
+    "POOL_KEEPALIVE_MAX": 0,
+    # Share identical in flight GETs, see apps.fhir.server.client
+    "COALESCE": True,
+    # Backend circuit breaker and adaptive timeouts, see apps.fhir.server.breaker
+    "BREAKER_ENABLED": True,
+    "BREAKER_WINDOW": 60,
+    "BREAKER_MIN_CALLS": 20,
+    "BREAKER_ERROR_RATE": 0.5,
+    "BREAKER_SLOW_CALL_TIME": 10,
+    "BREAKER_SLOW_CALL_RATE": 0.8,
+    "BREAKER_OPEN_TIME": 30,
+    "BREAKER_HALF_OPEN_CALLS": 1,
+    "ADAPTIVE_TIMEOUT": True,
+    "TIMEOUT_PERCENTILE": 99,
+    "TIMEOUT_MULTIPLIER": 2.0,
+    "TIMEOUT_MIN": 5,
+    "TIMEOUT_MIN_SAMPLES": 50,
+    "TIMEOUT_SAMPLES": 1000,
+    # Backend endpoints and load balancing, see apps.fhir.server.router
+    "ENDPOINTS": [],
+    "LOAD_BALANCER": "least_outstanding",
+    "EWMA_ALPHA": 0.3,
+    "EJECT_ERRORS": 5,
+    "EJECT_TIME": 30,
+    "PROBE_INTERVAL": 10,
+    "PROBE_PATH": "metadata",
 }
 
 # List of settings that cannot be empty
@@ -0,0 +1,118 @@
+from django.test import SimpleTestCase
+from httmock import all_requests, HTTMock
+
+from apps.fhir.bluebutton.exceptions import UpstreamServerException
+from ..breaker import AdaptiveTimeouts, CircuitBreaker, CLOSED, HALF_OPEN, OPEN
+from ..client import BackendClient, resource_type_of
+
+FHIR_URL = 'https://fhir.backend.test/v1/fhir/'
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCircuitBreaker(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker('https://fhir.backend.test', window=60, min_calls=4, error_rate=0.5,
+                                      slow_call_time=10, slow_call_rate=0.8, open_time=30, clock=self.clock)
+
+    def _calls(self, outcomes, elapsed=0.1):
+        for failed in outcomes:
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record(elapsed, failed)
+
+    def test_opens_on_error_rate(self):
+        self._calls([True, True, False])
+        self.assertEqual(self.breaker.state, CLOSED)
+        with self.assertLogs('hhs_server.apps.fhir.server.breaker', 'WARNING') as logs:
+            self._calls([False])
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertIn('changed from closed to open', logs.output[0])
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.retry_after(), 30)
+        self.assertEqual(self.breaker.snapshot()['rejected'], 1)
+
+    def test_opens_on_slow_calls(self):
+        self._calls([False] * 4, elapsed=12)
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_old_calls_leave_the_window(self):
+        self._calls([True, True, True])
+        self.clock.now += 61
+        self._calls([False])
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertEqual(self.breaker.snapshot()['calls'], 1)
+
+    def test_half_open_probe(self):
+        self._calls([True] * 4)
+        self.clock.now += 31
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        # One probe at a time
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record(0.1, True)
+        self.assertEqual(self.breaker.state, OPEN)
+
+        self.clock.now += 31
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record(0.1, False)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertEqual(self.breaker.snapshot()['opened'], 2)
+
+
+class TestAdaptiveTimeouts(SimpleTestCase):
+
+    def test_timeout_from_percentile(self):
+        timeouts = AdaptiveTimeouts(percentile=99, multiplier=2.0, minimum=1, min_samples=10, samples=100)
+        for _ in range(9):
+            timeouts.record('Patient', 0.5)
+        # Not enough samples yet
+        self.assertEqual(timeouts.timeout('Patient', 30), 30)
+
+        timeouts.record('Patient', 2.0)
+        self.assertEqual(timeouts.timeout('Patient', 30), 4.0)
+        self.assertEqual(timeouts.timeout('Patient', 3), 3)
+        self.assertEqual(timeouts.timeout('Coverage', 30), 30)
+
+        for _ in range(100):
+            timeouts.record('Patient', 0.1)
+        self.assertEqual(timeouts.timeout('Patient', 30), 1)
+        self.assertEqual(timeouts.snapshot(30)['Patient']['samples'], 100)
+
+    def test_resource_type_of(self):
+        self.assertEqual(resource_type_of(FHIR_URL + 'ExplanationOfBenefit/?patient=-1'), 'ExplanationOfBenefit')
+        self.assertEqual(resource_type_of(FHIR_URL + 'Patient/-1'), 'Patient')
+        self.assertEqual(resource_type_of(FHIR_URL + 'metadata'), 'metadata')
+
+
+class TestClientBreaker(SimpleTestCase):
+
+    def test_fails_fast_while_open(self):
+        client = BackendClient(coalesce=False, breaker_enabled=True, adaptive_timeout=False)
+        calls = []
+
+        @all_requests
+        def unavailable(url, req):
+            calls.append(url)
+            return {'status_code': 503, 'content': ''}
+
+        min_calls = client.get_breaker('https://fhir.backend.test').min_calls
+        with HTTMock(unavailable):
+            for _ in range(min_calls):
+                self.assertEqual(client.get(FHIR_URL + 'Patient/').status_code, 503)
+            with self.assertRaises(UpstreamServerException):
+                client.get(FHIR_URL + 'Patient/')
+
+        self.assertEqual(len(calls), min_calls)
+        status = client.status()
+        self.assertEqual(status['endpoints']['https://fhir.backend.test']['state'], OPEN)
+        self.assertEqual(status['timeouts']['Patient']['samples'], min_calls)
+        client.close()
@@ -0,0 +1,151 @@
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from django.test import SimpleTestCase
+from requests import Request
+
+from ..client import BackendClient, get_backend_client
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'{"resourceType": "Bundle"}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Set-Cookie', 'session=bene-specific')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TestBackendClient(SimpleTestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%s/v1/fhir/Patient/' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connections_are_reused(self):
+        client = BackendClient(pool_maxsize=2, keepalive_timeout=120, keepalive_max=0)
+        for _ in range(3):
+            self.assertEqual(client.get(self.url).status_code, 200)
+
+        stats = client.stats()
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['handshakes'], 1)
+        self.assertEqual(stats['reused'], 2)
+        self.assertEqual(stats['handshakes_per_minute'], 1)
+        self.assertEqual(stats['reuse_ratio'], round(2 / 3, 4))
+        client.close()
+
+    def test_keepalive_max_recycles_connection(self):
+        client = BackendClient(keepalive_max=2)
+        for _ in range(4):
+            client.get(self.url)
+
+        stats = client.stats()
+        self.assertEqual(stats['handshakes'], 2)
+        self.assertEqual(stats['recycled'], 1)
+        client.close()
+
+    def test_cookies_are_not_kept(self):
+        client = BackendClient()
+        client.get(self.url)
+        self.assertEqual(len(client.session.cookies), 0)
+        client.close()
+
+    def test_one_client_per_process(self):
+        self.assertIs(get_backend_client(), get_backend_client())
+
+
+class SlowHandler(KeepAliveHandler):
+    release = None
+    calls = 0
+
+    def do_GET(self):
+        SlowHandler.calls += 1
+        self.release.wait(5)
+        super().do_GET()
+
+
+class TestCoalescing(SimpleTestCase):
+
+    def setUp(self):
+        SlowHandler.release = threading.Event()
+        SlowHandler.calls = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), SlowHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%s/v1/fhir/Patient/' % self.server.server_port
+
+    def tearDown(self):
+        SlowHandler.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _send_all(self, client, requests_, wait_for_followers):
+        responses = [None] * len(requests_)
+
+        def send(i, req):
+            prepped = client.prepare_request(req)
+            responses[i] = (prepped, client.send(prepped, cert=('', ''), verify=False, timeout=5))
+
+        threads = [threading.Thread(target=send, args=(i, req)) for i, req in enumerate(requests_)]
+        for thread in threads:
+            thread.start()
+        # Let the calls pile up behind the first one before the backend answers
+        deadline = time.monotonic() + 5
+        while client.single_flight.snapshot()['coalesce_saved'] < wait_for_followers:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        SlowHandler.release.set()
+        for thread in threads:
+            thread.join(5)
+        return responses
+
+    def test_identical_requests_share_one_call(self):
+        client = BackendClient(coalesce=True)
+        requests_ = [Request('GET', self.url, params={'_id': '-1'}, headers={'BlueButton-OriginalQueryId': str(i)})
+                     for i in range(4)]
+        responses = self._send_all(client, requests_, 3)
+
+        self.assertEqual(SlowHandler.calls, 1)
+        for prepped, response in responses:
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), {"resourceType": "Bundle"})
+            # Each caller sees its own request
+            self.assertIs(response.request, prepped)
+        self.assertEqual(sum(1 for _, r in responses if getattr(r, 'coalesced', False)), 3)
+
+        stats = client.stats()
+        self.assertEqual((stats['coalesce_calls'], stats['coalesce_saved']), (4, 3))
+        self.assertEqual(stats['coalesce_saved_ratio'], 0.75)
+        self.assertEqual(stats['coalesce_in_flight'], 0)
+        client.close()
+
+    def test_other_parameters_are_sent(self):
+        client = BackendClient(coalesce=True)
+        requests_ = [Request('GET', self.url, params={'_id': str(i)}) for i in range(2)]
+        self._send_all(client, requests_, 0)
+
+        self.assertEqual(SlowHandler.calls, 2)
+        self.assertEqual(client.stats()['coalesce_saved'], 0)
+        client.close()
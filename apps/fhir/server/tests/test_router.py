@@ -0,0 +1,90 @@
+from django.test import SimpleTestCase
+from httmock import all_requests, HTTMock
+
+from apps.fhir.bluebutton.utils import FhirServerAuth, get_resourcerouter
+from ..router import Endpoint, EWMA, LoadBalancer
+from .test_breaker import FakeClock
+
+EAST_URL = 'https://bfd-east.test/v1/fhir/'
+WEST_URL = 'https://bfd-west.test/v1/fhir/'
+
+
+class TestLoadBalancer(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.east = Endpoint({'FHIR_URL': EAST_URL, 'WEIGHT': 2})
+        self.west = Endpoint({'FHIR_URL': WEST_URL, 'CERT_FILE': 'west.cert.pem', 'KEY_FILE': 'west.key.pem'})
+        self.balancer = LoadBalancer([self.east, self.west], eject_errors=2, eject_time=30,
+                                     probe_interval=0, clock=self.clock)
+
+    def test_endpoint_settings(self):
+        self.assertEqual(self.east.weight, 2)
+        self.assertEqual(self.west.cert_file, 'west.cert.pem')
+        # Not overridden, from FHIR_SERVER
+        self.assertEqual(self.east.cert_file, Endpoint().cert_file)
+        self.assertIs(self.balancer.endpoint_for(WEST_URL + 'Patient/-1/'), self.west)
+        self.assertIsNone(self.balancer.endpoint_for('https://other.test/v1/fhir/Patient/'))
+
+    def test_relative_url(self):
+        self.assertEqual(self.balancer.relative_url(EAST_URL + 'Patient/-1'), 'Patient/-1')
+        self.assertEqual(self.balancer.relative_url(WEST_URL + 'Patient/-1'), 'Patient/-1')
+        self.assertEqual(self.balancer.relative_url('https://other.test/v1/fhir/Patient/'),
+                         'https://other.test/v1/fhir/Patient/')
+
+    def test_least_outstanding_by_weight(self):
+        self.balancer.started(WEST_URL + 'Patient/')
+        self.assertIs(self.balancer.choose(), self.east)
+        for _ in range(3):
+            self.balancer.started(EAST_URL + 'Patient/')
+        # 3 calls in flight at weight 2 cost more than 1 at weight 1
+        self.assertIs(self.balancer.choose(), self.west)
+
+    def test_ewma(self):
+        self.balancer.policy = EWMA
+        self.balancer.finished(self.balancer.started(EAST_URL), 2.0, False)
+        self.balancer.finished(self.balancer.started(WEST_URL), 0.1, False)
+        self.assertIs(self.balancer.choose(), self.west)
+
+    def test_ejected_after_consecutive_errors(self):
+        for failed in (True, False, True):
+            self.balancer.finished(self.balancer.started(WEST_URL), 0.1, failed)
+        self.assertIsNone(self.west.ejected_at)
+        with self.assertLogs('hhs_server.apps.fhir.server.router', 'WARNING'):
+            self.balancer.finished(self.balancer.started(WEST_URL), 0.1, True)
+        self.assertFalse(self.balancer.snapshot()['endpoints'][1]['healthy'])
+        self.balancer.started(EAST_URL)
+        self.balancer.started(EAST_URL)
+        self.assertIs(self.balancer.choose(), self.east)
+
+        # Tried again once the ejection time passed
+        self.clock.now += 31
+        self.assertIs(self.balancer.choose(), self.west)
+
+    def test_all_ejected(self):
+        for endpoint in (self.east, self.west):
+            endpoint.ejected_at = self.clock.now
+        self.assertIn(self.balancer.choose(), (self.east, self.west))
+
+    def test_probe_restores(self):
+        self.balancer.probe_interval = 10
+        self.west.ejected_at = self.clock.now
+        self.clock.now += 31
+        self.assertTrue(self.balancer._probe_due(self.west, self.clock.now))
+
+        @all_requests
+        def metadata(url, req):
+            self.assertEqual(url.path, '/v1/fhir/metadata')
+            return {'status_code': 200, 'content': '{}'}
+
+        with HTTMock(metadata):
+            self.balancer._probe(self.west)
+        self.assertIsNone(self.west.ejected_at)
+
+
+class TestResourceRouter(SimpleTestCase):
+
+    def test_single_endpoint(self):
+        resource_router = get_resourcerouter()
+        self.assertIs(get_resourcerouter(url=resource_router.fhir_url + 'Patient/'), resource_router)
+        self.assertEqual(FhirServerAuth(url=resource_router.fhir_url)['client_auth'], resource_router.client_auth)
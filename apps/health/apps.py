@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+from django.conf import settings
+
+
+class HealthConfig(AppConfig):
+    name = 'apps.health'
+    label = 'health'
+    verbose_name = "Health"
+
+    def ready(self):
+        if getattr(settings, 'WARMUP_ON_READY', False):
+            from .warmup import warmup
+            warmup.start()
@@ -6,6 +6,7 @@ from django.db import connection
 
 from apps.fhir.bluebutton.utils import get_resourcerouter
 from apps.fhir.server import connection as backend_connection
+from apps.fhir.server.client import get_backend_client
 from apps.mymedicare_cb.authorization import OAuth2ConfigSLSx
 
 
@@ -20,10 +21,10 @@ def django_rds_database():
 def bfd_fhir_dataserver():
     resource_router = get_resourcerouter()
     target_url = resource_router.fhir_url + "metadata"
-    r = requests.get(target_url,
-                     params={"_format": "json"},
-                     cert=backend_connection.certs(),
-                     verify=False)
+    r = get_backend_client().get(target_url,
+                                 params={"_format": "json"},
+                                 cert=backend_connection.certs(url=target_url),
+                                 verify=False)
     try:
         r.raise_for_status()
     except Exception:
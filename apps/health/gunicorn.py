@@ -0,0 +1,15 @@
+"""
+gunicorn server hooks. To warm each worker up before it accepts requests,
+add to the gunicorn configuration file (gunicorn.conf.py does):
+
+from apps.health.gunicorn import post_worker_init  # noqa
+
+The hook runs once the worker has loaded hhs_oauth_server.wsgi, so the
+settings see the same .env and New Relic setup as the application.
+"""
+
+
+def post_worker_init(worker):
+    # Importable only once the application, and so Django, is loaded
+    from .warmup import warmup
+    warmup.run()
@@ -0,0 +1,50 @@
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+from httmock import all_requests, HTTMock
+from unittest.mock import patch
+
+from .warmup import READY, warm_backend_connections, Warmup, WARMING
+
+
+class TestWarmup(TestCase):
+
+    def test_steps(self):
+        def failing():
+            raise ValueError("backend down")
+
+        warmup = Warmup(steps=(('failing', failing), ('counted', lambda: 3)))
+        self.assertFalse(warmup.is_ready())
+        with self.assertLogs('hhs_server.apps.health.warmup', 'WARNING'):
+            warmup.run()
+        self.assertTrue(warmup.is_ready())
+        stats = warmup.stats()
+        self.assertEqual(stats['state'], READY)
+        self.assertFalse(stats['steps']['failing']['ok'])
+        self.assertEqual(stats['steps']['counted']['result'], 3)
+
+    @override_settings(WARMUP_BACKEND_CONNECTIONS=3)
+    def test_backend_connections(self):
+        paths = []
+
+        @all_requests
+        def metadata(url, req):
+            paths.append(url.path)
+            return {'status_code': 200, 'content': '{}'}
+
+        with HTTMock(metadata):
+            self.assertEqual(warm_backend_connections(), 3)
+        self.assertEqual(len(paths), 3)
+        self.assertTrue(all(path.endswith('/metadata') for path in paths))
+
+    def test_ready_check(self):
+        client = Client()
+        warmup = Warmup(steps=())
+        with patch('apps.health.views.warmup', warmup):
+            self.assertEqual(client.get('/health/ready').status_code, 503)
+            warmup.state = WARMING
+            self.assertEqual(client.get('/health/ready').status_code, 503)
+            warmup.state = READY
+            response = client.get('/health/ready')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['warmup']['state'], READY)
@@ -2,9 +2,11 @@ from django.conf.urls import url
 from .views import (
     CheckInternal,
     CheckExternal,
+    CheckReady,
 )
 
 urlpatterns = [
     url(r'external', CheckExternal.as_view()),
+    url(r'ready', CheckReady.as_view()),
     url(r'', CheckInternal.as_view()),
 ]
@@ -7,6 +7,7 @@ from .checks import (
     internal_services,
     external_services,
 )
+from .warmup import warmup
 
 logger = logging.getLogger('hhs_server.%s' % __name__)
 
@@ -47,3 +48,15 @@ class CheckInternal(Check):
 
 class CheckExternal(Check):
     services = external_services
+
+
+class CheckReady(APIView):
+    """
+    Readiness of the worker process, 503 until its warm-up finished,
+    see apps.health.warmup.
+    """
+
+    def get(self, request, format=None):
+        if not warmup.is_ready():
+            raise ServiceUnavailable(detail="Warming up, try again later.")
+        return Response({'message': 'ready', 'warmup': warmup.stats()})
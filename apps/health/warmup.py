@@ -0,0 +1,159 @@
+"""
+Worker warm-up before serving traffic.
+
+Warmup.run() opens WARMUP_BACKEND_CONNECTIONS pooled connections to each
+backend endpoint, fetches the CapabilityStatement, builds the
+ProtectedCapability routing table and loads the waffle switches and flags
+into their caches. A failing step is logged and the warm-up goes on, so a backend
+outage does not keep the worker out of service.
+
+It runs synchronously from the gunicorn post_worker_init hook (see
+apps.health.gunicorn), so a worker accepts no request before it is warm,
+or in a background thread started by HealthConfig.ready() when
+WARMUP_ON_READY is set. /health/ready answers 503 until a warm-up has
+finished, and so always in a process that never runs one.
+"""
+import logging
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from waffle import get_waffle_flag_model
+from waffle.models import Switch
+
+from apps.capabilities.routes import route_table
+from apps.fhir.bluebutton import capability
+from apps.fhir.bluebutton.capability import capability_statement
+from apps.fhir.bluebutton.utils import FhirServerVerify
+from apps.fhir.server import connection as backend_connection
+from apps.fhir.server.client import get_backend_client
+from apps.fhir.server.router import load_balancer
+
+logger = logging.getLogger('hhs_server.%s' % __name__)
+
+COLD = 'cold'
+WARMING = 'warming'
+READY = 'ready'
+
+
+def warm_backend_connections():
+    """
+    Open the connections with concurrent metadata GETs, as sequential
+    ones would all reuse the first connection.
+    """
+    client = get_backend_client()
+    count = min(getattr(settings, 'WARMUP_BACKEND_CONNECTIONS', 4), client.pool_maxsize)
+    if count < 1:
+        return 0
+
+    def fetch(url, endpoint):
+        # Not coalesced, each GET must take its own connection
+        return client.get(url,
+                          params={'_format': 'json'},
+                          cert=backend_connection.certs(url=url),
+                          timeout=endpoint.wait_time,
+                          verify=FhirServerVerify(url=url),
+                          coalesce=False)
+
+    opened = 0
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        for endpoint in load_balancer.endpoints:
+            url = endpoint.fhir_url + 'metadata'
+            for future in [executor.submit(fetch, url, endpoint) for _ in range(count)]:
+                future.result().close()
+                opened += 1
+    return opened
+
+
+def prime_capability_statement():
+    if not capability.is_enabled():
+        return False
+    capability_statement.refresh()
+    return True
+
+
+def prime_protected_capabilities():
+    return route_table.build()
+
+
+def prime_waffle():
+    """
+    Load every switch and flag into the waffle cache, each by name as
+    switch_is_active() and flag_is_active() look them up.
+    """
+    count = 0
+    for model in (Switch, get_waffle_flag_model()):
+        for item in model.get_all():
+            model.get(item.name)
+            count += 1
+    return count
+
+
+STEPS = (
+    ('backend_connections', warm_backend_connections),
+    ('capability_statement', prime_capability_statement),
+    ('protected_capabilities', prime_protected_capabilities),
+    ('waffle', prime_waffle),
+)
+
+
+class Warmup(object):
+    """
+    Warm-up state of the process.
+    """
+
+    def __init__(self, steps=STEPS):
+        self.steps = steps
+        self._lock = threading.Lock()
+        self.state = COLD
+        self.results = {}
+        self.seconds = None
+
+    def is_ready(self):
+        # Not before a warm-up ran, e.g. a worker without the gunicorn hook or WARMUP_ON_READY
+        return self.state == READY
+
+    def run(self):
+        with self._lock:
+            if self.state != COLD:
+                return
+            self.state = WARMING
+        self._run()
+
+    def start(self):
+        """
+        Run the warm-up in a background thread.
+        """
+        with self._lock:
+            if self.state != COLD:
+                return
+            self.state = WARMING
+        threading.Thread(target=self._run, name='warmup', daemon=True).start()
+
+    def _run(self):
+        start = time.monotonic()
+        for name, step in self.steps:
+            step_start = time.monotonic()
+            try:
+                result = {"ok": True, "result": step()}
+            except Exception as e:
+                logger.warning("Warm-up step %s failed: %r" % (name, e))
+                result = {"ok": False, "error": repr(e)}
+            result["seconds"] = round(time.monotonic() - step_start, 3)
+            self.results[name] = result
+        self.seconds = round(time.monotonic() - start, 3)
+        with self._lock:
+            self.state = READY
+        logger.info("Warm-up finished in %.3f seconds" % self.seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "seconds": self.seconds,
+                "steps": dict(self.results),
+            }
+
+
+warmup = Warmup()
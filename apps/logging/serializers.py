@@ -130,7 +130,9 @@ class SLSRequest(Request):
 
 
 class FHIRRequest(Request):
-    def __init__(self, request):
+    def __init__(self, request, hedge=None):
+        # Attempt details of a hedged request, see apps.fhir.bluebutton.hedging
+        self.hedge = hedge
         super().__init__(request)
 
     def includeAddressFields(self):
@@ -164,8 +166,12 @@ class FHIRRequest(Request):
     def path(self):
         return self.req.headers.get('BlueButton-OriginalUrl')
 
+    def prefetch_of(self):
+        # Query id of the request a prefetch followed, see apps.fhir.bluebutton.prefetch
+        return self.req.headers.get('BlueButton-PrefetchOf')
+
     def to_dict(self):
-        return {
+        result = {
             "type": "fhir_pre_fetch",
             "uuid": self.uuid(),
             "fhir_id": self.fhir_id(),
@@ -175,6 +181,11 @@ class FHIRRequest(Request):
             "path": self.path(),
             "start_time": self.start_time(),
         }
+        if self.hedge:
+            result["hedge"] = self.hedge
+        if self.prefetch_of() is not None:
+            result["prefetch_of"] = self.prefetch_of()
+        return result
 
 
 class FHIRRequestForAuth(Request):
@@ -219,7 +230,9 @@ class Response:
         return self.resp.status_code
 
     def size(self):
-        return len(self.resp.content)
+        # Streamed responses record the size forwarded, their content is not kept
+        streamed_size = getattr(self.resp, 'streamed_size', None)
+        return len(self.resp.content) if streamed_size is None else streamed_size
 
     def elapsed(self):
         return self.resp.elapsed.total_seconds()
@@ -242,13 +255,16 @@ class Response:
 class FHIRResponse(Response):
     request_class = FHIRRequest
 
-    def __init__(self, response):
+    def __init__(self, response, hedge=None):
+        self.hedge = hedge
         super().__init__(response)
 
     def to_dict(self):
         super_dict = super().to_dict()
         # over write type
         super_dict.update({"type": "fhir_post_fetch"})
+        if self.hedge:
+            super_dict["hedge"] = self.hedge
         return super_dict
 
 
@@ -13,6 +13,7 @@ from apps.authorization.models import DataAccessGrant
 from apps.dot_ext.admin import MyAccessToken
 from apps.dot_ext.loggers import get_session_auth_flow_trace
 from apps.dot_ext.signals import beneficiary_authorized_application
+from apps.fhir.bluebutton import backend_metrics
 from apps.fhir.bluebutton.signals import (
     pre_fetch,
     post_fetch
@@ -99,15 +100,29 @@ def log_grant_removed(sender, instance=None, **kwargs):
 
 @receiver(pre_fetch, sender=FhirDataView)
 @receiver(pre_fetch, sender=FhirServerAuth)
-def fetching_data(sender, request=None, auth_flow_dict=None, **kwargs):
-    fhir_logger.info(get_event(FHIRRequest(request) if sender == FhirDataView else FHIRRequestForAuth(request, auth_flow_dict)))
+def fetching_data(sender, request=None, auth_flow_dict=None, hedge=None, **kwargs):
+    if sender == FhirDataView:
+        event = FHIRRequest(request, hedge)
+    else:
+        event = FHIRRequestForAuth(request, auth_flow_dict)
+    fhir_logger.info(get_event(event))
 
 
 @receiver(post_fetch, sender=FhirDataView)
 @receiver(post_fetch, sender=FhirServerAuth)
-def fetched_data(sender, request=None, response=None, auth_flow_dict=None, **kwargs):
-    fhir_logger.info(get_event(FHIRResponse(response) if sender == FhirDataView else FHIRResponseForAuth(response,
-                                                                                                         auth_flow_dict)))
+def fetched_data(sender, request=None, response=None, auth_flow_dict=None, hedge=None, **kwargs):
+    fhir_logger.info(get_event(FHIRResponse(response, hedge) if sender == FhirDataView else FHIRResponseForAuth(response,
+                                                                                                                auth_flow_dict)))
+
+
+@receiver(post_fetch, sender=FhirDataView)
+def record_backend_metrics(sender, response=None, **kwargs):
+    if not backend_metrics.is_enabled():
+        return
+    try:
+        backend_metrics.registry.observe_response(response)
+    except Exception:
+        fhir_logger.exception("Failed to record the backend response metrics")
 
 
 def sls_hook(sender, response=None, auth_flow_dict=None, **kwargs):
@@ -0,0 +1,30 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from unittest.mock import patch
+
+from . import views
+
+
+class TestStatsView(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def test_stats_sources(self):
+        self.client.force_login(self.admin)
+        with patch.dict(views.STATS_SOURCES, {name: lambda name=name: {"source": name} for name in views.STATS_SOURCES}):
+            for name in views.STATS_SOURCES:
+                response = self.client.get(reverse('stats', kwargs={'name': name}))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), {"source": name})
+
+    def test_admin_only(self):
+        self.client.force_login(User.objects.create_user('user', password='password'))
+        response = self.client.get(reverse('stats', kwargs={'name': 'fhir/hedging'}))
+        self.assertEqual(response.status_code, 403)
+
+    def test_unknown_name(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('stats', kwargs={'name': 'fhir/prefetch'}) + 'x')
+        self.assertEqual(response.status_code, 404)
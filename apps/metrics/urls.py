@@ -1,3 +1,5 @@
+import re
+
 from django.conf.urls import include, url
 from django.contrib import admin
 from .views import (
@@ -12,6 +14,8 @@ from .views import (
     ArchivedDataAccessGrantView,
     CheckDataAccessGrantsView,
     CheckCrosswalksView,
+    StatsView,
+    STATS_SOURCES,
 )
 
 admin.autodiscover()
@@ -21,6 +25,8 @@ urlpatterns = [
     url(r'^applications/(?P<pk>\d+)$', AppMetricsDetailView.as_view(), name='applications-detail'),
     url(r'^applications/$', AppMetricsView.as_view(), name='applications'),
     url(r'^crosswalks/check$', CheckCrosswalksView.as_view(), name='check-crosswalks'),
+    url(r'^(?P<name>%s)$' % '|'.join(re.escape(name) for name in STATS_SOURCES),
+        StatsView.as_view(), name='stats'),
     url(r'^developers/$', DevelopersView.as_view(), name='developers'),
     url(r'^tokens$', TokenMetricsView.as_view(), name='tokens'),
     url(r'^tokens/archive$', ArchivedTokenView.as_view(), name='archived-tokens'),
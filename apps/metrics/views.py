@@ -13,7 +13,7 @@ from rest_framework_csv.renderers import PaginatedCSVRenderer, CSVStreamingRende
 from rest_framework.generics import ListAPIView
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
-from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
 from rest_framework.serializers import (
     ModelSerializer,
@@ -31,10 +31,24 @@ from apps.authorization.models import (
     ArchivedDataAccessGrant,
     check_grants,
     update_grants)
+from apps.authorization.grant_index import grant_index
+from apps.capabilities.routes import route_table
+from apps.dot_ext.activity import application_activity
 from apps.dot_ext.models import Application, ArchivedToken
+from apps.fhir.renderers import FastJSONRenderer
 from apps.fhir.bluebutton.models import (
     Crosswalk,
+    ExportJob,
     check_crosswalks)
+from apps.fhir.bluebutton import backend_metrics
+from apps.fhir.bluebutton.cache import cache_stats
+from apps.fhir.bluebutton.capability import capability_statement
+from apps.fhir.bluebutton.conditional import conditional_stats
+from apps.fhir.bluebutton.export import export_queue
+from apps.fhir.bluebutton.hedging import hedger
+from apps.fhir.bluebutton.prefetch import prefetcher
+from apps.fhir.bluebutton.projection import projection_stats
+from apps.fhir.server.client import get_backend_client
 
 
 log = logging.getLogger('hhs_server.%s' % __name__)
@@ -195,7 +209,7 @@ class BeneMetricsView(APIView):
         IsAdminUser,
     )
 
-    renderer_classes = (JSONRenderer, )
+    renderer_classes = (FastJSONRenderer, )
 
     def get(self, request, format=None):
         content = {
@@ -231,7 +245,7 @@ class ArchivedTokenView(ListAPIView):
         IsAdminUser,
     ]
 
-    renderer_classes = (JSONRenderer, BrowsableAPIRenderer, PaginatedCSVRenderer)
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer, PaginatedCSVRenderer)
     serializer_class = ArchivedTokenSerializer
     pagination_class = MetricsPagination
     filter_backends = (filters.DjangoFilterBackend,)
@@ -270,7 +284,7 @@ class ArchivedDataAccessGrantView(ListAPIView):
         IsAdminUser,
     ]
 
-    renderer_classes = (JSONRenderer, BrowsableAPIRenderer, PaginatedCSVRenderer)
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer, PaginatedCSVRenderer)
     serializer_class = ArchivedDataAccessGrantSerializer
     pagination_class = MetricsPagination
     filter_backends = (filters.DjangoFilterBackend,)
@@ -308,7 +322,7 @@ class DataAccessGrantView(ListAPIView):
         IsAdminUser,
     ]
 
-    renderer_classes = (JSONRenderer, BrowsableAPIRenderer, PaginatedCSVRenderer)
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer, PaginatedCSVRenderer)
     serializer_class = DataAccessGrantSerializer
     pagination_class = MetricsPagination
     filter_backends = (filters.DjangoFilterBackend,)
@@ -345,6 +359,63 @@ class CheckCrosswalksView(APIView):
         return Response(check_crosswalks())
 
 
+def export_jobs_stats():
+    counts = ExportJob.objects.values('status').annotate(count=Count('id'))
+    return {
+        "jobs": {row['status']: row['count'] for row in counts},
+        "workers": export_queue.stats(),
+    }
+
+
+# Stats by URL path, of the worker process serving the request unless noted
+STATS_SOURCES = {
+    # Backend FHIR server connection pool
+    'backend/pool': lambda: get_backend_client().stats(),
+    # Backend FHIR server circuit breaker state and timeouts
+    'backend/status': lambda: get_backend_client().status(),
+    # Backend latency and response size histograms by resource type, interaction,
+    # application and status, of the processes that wrote within FHIR_BACKEND_METRICS_TTL
+    'backend/histograms': backend_metrics.aggregate,
+    # FHIR response cache per resource type
+    'fhir/cache': cache_stats.snapshot,
+    # 304 Not Modified rate of FHIR responses per resource type
+    'fhir/conditional': conditional_stats.snapshot,
+    # _elements and _summary projection byte savings per application
+    'fhir/projection': projection_stats.snapshot,
+    # ExplanationOfBenefit next page prefetches
+    'fhir/prefetch': prefetcher.stats,
+    # Hedged backend requests and retry budget
+    'fhir/hedging': hedger.stats,
+    # Age and refreshes of the metadata CapabilityStatement
+    'fhir/metadata': capability_statement.stats,
+    # Bulk Data export jobs by status, of all processes, and the export workers
+    'fhir/export': export_jobs_stats,
+    # Pending and written Application first_active and last_active updates
+    'applications/activity': application_activity.stats,
+    # DataAccessGrant lookup cache
+    'grants/index': grant_index.stats,
+    # ProtectedCapability routing table
+    'capabilities/routes': route_table.stats,
+}
+
+
+class StatsView(APIView):
+    """
+    View to provide the stats of STATS_SOURCES named by the URL path.
+
+    * Only admin users are able to access this view.
+    """
+    permission_classes = [
+        IsAuthenticated,
+        IsAdminUser,
+    ]
+
+    renderer_classes = (FastJSONRenderer, )
+
+    def get(self, request, name, format=None):
+        return Response(STATS_SOURCES[name]())
+
+
 class AppMetricsView(ListAPIView):
     """
     View to provide application metrics.
@@ -359,7 +430,7 @@ class AppMetricsView(ListAPIView):
         IsAdminUser,
     ]
 
-    renderer_classes = (JSONRenderer, BrowsableAPIRenderer, PaginatedCSVRenderer)
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer, PaginatedCSVRenderer)
     serializer_class = AppMetricsSerializer
     pagination_class = MetricsPagination
 
@@ -382,7 +453,7 @@ class AppMetricsDetailView(APIView):
         IsAdminUser,
     ]
 
-    renderer_classes = (JSONRenderer, BrowsableAPIRenderer)
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer)
 
     def get(self, request, pk, format=None):
 
@@ -403,7 +474,7 @@ class TokenMetricsView(APIView):
         IsAdminUser,
     )
 
-    renderer_classes = (JSONRenderer, )
+    renderer_classes = (FastJSONRenderer, )
 
     def get(self, request, format=None):
         content = {
@@ -483,7 +554,7 @@ class DevelopersView(ListAPIView):
     serializer_class = DevUserSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filterset_class = DeveloperFilter
-    renderer_classes = (JSONRenderer, BrowsableAPIRenderer, PaginatedCSVRenderer)
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer, PaginatedCSVRenderer)
     pagination_class = MetricsPagination
 
 
@@ -0,0 +1,27 @@
+"""
+gunicorn settings of the application, read from the working directory
+(or with -c gunicorn.conf.py), e.g.:
+
+gunicorn hhs_oauth_server.wsgi:application --bind 0.0.0.0:8000
+
+Requests mostly wait on the backend FHIR server, so each worker process
+serves GUNICORN_THREADS requests at once with gthread workers. Compared
+with sync workers by `manage.py benchmark_wsgi_workers`: with 2 workers,
+100ms of backend latency and 32 concurrent clients (one CPU, SQLite),
+about 12 req/s with sync workers and 30 to 35 req/s with 8 threads per
+worker.
+
+Each thread holds its own database connection, and the backend connection
+pool (FHIR_SERVER POOL_MAXSIZE, 10 by default) should not be smaller than
+GUNICORN_THREADS.
+"""
+import os
+
+# Warm each worker up before it accepts requests, see apps.health.warmup
+from apps.health.gunicorn import post_worker_init  # noqa: F401
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
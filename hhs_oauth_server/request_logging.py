@@ -5,13 +5,13 @@ import hashlib
 import json
 from django.core.exceptions import ObjectDoesNotExist
 from django.utils.deprecation import MiddlewareMixin
-from oauth2_provider.models import AccessToken
 from apps.dot_ext.loggers import (SESSION_AUTH_FLOW_TRACE_KEYS,
                                   get_session_auth_flow_trace,
                                   is_path_part_of_auth_flow_trace)
+from apps.fhir.bluebutton.identity import get_identity
 from apps.fhir.bluebutton.utils import (get_ip_from_request,
                                         get_user_from_request,
-                                        get_access_token_from_request)
+                                        get_access_token)
 
 
 audit = logging.getLogger('audit.%s' % __name__)
@@ -75,17 +75,19 @@ class RequestResponseLog(object):
 
         log_msg['ip_addr'] = get_ip_from_request(self.request)
 
-        access_token = getattr(self.request, 'auth', get_access_token_from_request(self.request))
+        identity = get_identity(self.request)
+        at = identity.access_token if identity is not None else get_access_token(self.request)
 
-        if AccessToken.objects.filter(token=access_token).exists():
-            at = AccessToken.objects.get(token=access_token)
+        if at is not None:
             try:
-                log_msg['app_name'] = at.application.name
-                log_msg['app_id'] = at.application.id
-                log_msg['app_require_demographic_scopes'] = str(getattr(at.application, 'require_demographic_scopes', ""))
-                log_msg['dev_id'] = at.application.user.id
-                log_msg['dev_name'] = str(at.application.user)
-                log_msg['access_token_hash'] = hashlib.sha256(str(access_token).encode('utf-8')).hexdigest()
+                application = at.application
+                developer = identity.developer if identity is not None else application.user
+                log_msg['app_name'] = application.name
+                log_msg['app_id'] = application.id
+                log_msg['app_require_demographic_scopes'] = str(getattr(application, 'require_demographic_scopes', ""))
+                log_msg['dev_id'] = developer.id
+                log_msg['dev_name'] = str(developer)
+                log_msg['access_token_hash'] = hashlib.sha256(str(at.token).encode('utf-8')).hexdigest()
                 log_msg['access_token_scopes'] = ' '.join([s for s in at.scopes])
             except ObjectDoesNotExist:
                 pass
@@ -100,13 +102,17 @@ class RequestResponseLog(object):
                         log_msg[k] = auth_flow_dict.get(k, None)
 
         # Get FHIR_ID if available.
-        user = get_user_from_request(self.request)
-        if user:
-            log_msg['user'] = str(user)
-            try:
-                log_msg['fhir_id'] = str(user.crosswalk.fhir_id)
-            except ObjectDoesNotExist:
-                pass
+        if identity is not None:
+            log_msg['user'] = str(identity.beneficiary)
+            log_msg['fhir_id'] = str(identity.fhir_id)
+        else:
+            user = get_user_from_request(self.request)
+            if user:
+                log_msg['user'] = str(user)
+                try:
+                    log_msg['fhir_id'] = str(user.crosswalk.fhir_id)
+                except ObjectDoesNotExist:
+                    pass
 
         return(json.dumps(log_msg))
 
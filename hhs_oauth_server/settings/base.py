@@ -197,6 +197,7 @@ if env('OPTIONAL_INSTALLED_APPS', False):
 MIDDLEWARE = [
     # Middleware that adds headers to the resposne
     'django.middleware.security.SecurityMiddleware',
+    'apps.fhir.bluebutton.compression.FhirCompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'hhs_oauth_server.request_logging.RequestTimeLoggingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -507,6 +508,118 @@ FHIR_SERVER = {
     "CLIENT_AUTH": True,
 }
 
+# Opt-in cache of FHIR responses per beneficiary, see apps.fhir.bluebutton.cache
+# TTL is in seconds per resource type, a resource type without a TTL is not cached.
+FHIR_RESPONSE_CACHE_ENABLED = bool_env(env('FHIR_RESPONSE_CACHE_ENABLED', False))
+FHIR_RESPONSE_CACHE_ALIAS = env('FHIR_RESPONSE_CACHE_ALIAS', 'default')
+FHIR_RESPONSE_CACHE_TTL = {
+    'Patient': int_env(env('FHIR_RESPONSE_CACHE_TTL_PATIENT', 300)),
+    'Coverage': int_env(env('FHIR_RESPONSE_CACHE_TTL_COVERAGE', 300)),
+    'ExplanationOfBenefit': int_env(env('FHIR_RESPONSE_CACHE_TTL_EOB', 60)),
+}
+
+# Forward large backend search Bundles (ExplanationOfBenefit) to the client as
+# they arrive instead of loading and re-rendering them, see apps.fhir.bluebutton.streaming
+FHIR_STREAMING_ENABLED = bool_env(env('FHIR_STREAMING_ENABLED', False))
+
+# ETag on FHIR read and search responses, and 304 Not Modified for matching
+# If-None-Match/If-Modified-Since requests, see apps.fhir.bluebutton.conditional
+FHIR_CONDITIONAL_GET_ENABLED = bool_env(env('FHIR_CONDITIONAL_GET_ENABLED', True))
+
+# Negotiated gzip/brotli compression of FHIR responses, see apps.fhir.bluebutton.compression.
+# Brotli needs the brotli package. Levels are gzip 1-9 and brotli 0-11.
+FHIR_COMPRESSION_ENABLED = bool_env(env('FHIR_COMPRESSION_ENABLED', True))
+FHIR_COMPRESSION_PATHS = ['/v1/fhir/']
+FHIR_COMPRESSION_MIN_SIZE = int_env(env('FHIR_COMPRESSION_MIN_SIZE', 1024))
+FHIR_COMPRESSION_GZIP_LEVEL = int_env(env('FHIR_COMPRESSION_GZIP_LEVEL', 6))
+FHIR_COMPRESSION_BROTLI_LEVEL = int_env(env('FHIR_COMPRESSION_BROTLI_LEVEL', 4))
+
+# Fetch the next ExplanationOfBenefit search page in the background after serving one,
+# see apps.fhir.bluebutton.prefetch. TTL in seconds, limits are per process.
+FHIR_EOB_PREFETCH_ENABLED = bool_env(env('FHIR_EOB_PREFETCH_ENABLED', False))
+FHIR_EOB_PREFETCH_TTL = int_env(env('FHIR_EOB_PREFETCH_TTL', 30))
+FHIR_EOB_PREFETCH_MAX_WORKERS = int_env(env('FHIR_EOB_PREFETCH_MAX_WORKERS', 4))
+FHIR_EOB_PREFETCH_MAX_BYTES = int_env(env('FHIR_EOB_PREFETCH_MAX_BYTES', 32 * 1024 * 1024))
+
+# Backend searches of the Patient summary running at once per process, shared by
+# its requests, see apps.fhir.bluebutton.views.summary.
+FHIR_SUMMARY_MAX_WORKERS = int_env(env('FHIR_SUMMARY_MAX_WORKERS', 12))
+
+# Send a second backend request for FHIR reads and searches slower than the FHIR_HEDGING_PERCENTILE
+# latency of their resource type, see apps.fhir.bluebutton.hedging. Hedges are limited to
+# FHIR_RETRY_BUDGET_PERCENT of the requests, limits are per process.
+FHIR_HEDGING_ENABLED = bool_env(env('FHIR_HEDGING_ENABLED', False))
+FHIR_HEDGING_PERCENTILE = int_env(env('FHIR_HEDGING_PERCENTILE', 95))
+FHIR_HEDGING_MIN_DELAY_MS = int_env(env('FHIR_HEDGING_MIN_DELAY_MS', 200))
+FHIR_HEDGING_MIN_SAMPLES = int_env(env('FHIR_HEDGING_MIN_SAMPLES', 50))
+FHIR_HEDGING_MAX_WORKERS = int_env(env('FHIR_HEDGING_MAX_WORKERS', 8))
+FHIR_HEDGING_MAX_HEDGES = int_env(env('FHIR_HEDGING_MAX_HEDGES', 4))
+FHIR_RETRY_BUDGET_PERCENT = int_env(env('FHIR_RETRY_BUDGET_PERCENT', 10))
+FHIR_RETRY_BUDGET_MAX = int_env(env('FHIR_RETRY_BUDGET_MAX', 10))
+
+# FHIR _elements and _summary parameters also sent to the backend (e.g. ['_elements', '_summary']),
+# the read and search views apply both either way, see apps.fhir.bluebutton.projection
+FHIR_PROJECTION_BACKEND_PARAMETERS = []
+# Projected responses of an application measured for the admin metrics, one in that many
+FHIR_PROJECTION_STATS_SAMPLE_EVERY = int_env(env('FHIR_PROJECTION_STATS_SAMPLE_EVERY', 100))
+
+# Filtered CapabilityStatement for /v1/fhir/metadata kept per process, see
+# apps.fhir.bluebutton.capability. Times are in seconds.
+FHIR_METADATA_CACHE_ENABLED = bool_env(env('FHIR_METADATA_CACHE_ENABLED', True))
+FHIR_METADATA_REFRESH_INTERVAL = int_env(env('FHIR_METADATA_REFRESH_INTERVAL', 60 * 60))
+FHIR_METADATA_RETRY_INTERVAL = int_env(env('FHIR_METADATA_RETRY_INTERVAL', 30))
+FHIR_METADATA_MAX_AGE = int_env(env('FHIR_METADATA_MAX_AGE', 5 * 60))
+
+# Backend latency and response size histograms, a thread of each process writes its counts to the
+# FHIR_BACKEND_METRICS_CACHE_ALIAS cache, see apps.fhir.bluebutton.backend_metrics. Times are in seconds.
+# Use a memory cache alias, not the database cache.
+FHIR_BACKEND_METRICS_ENABLED = bool_env(env('FHIR_BACKEND_METRICS_ENABLED', False))
+FHIR_BACKEND_METRICS_CACHE_ALIAS = env('FHIR_BACKEND_METRICS_CACHE_ALIAS', 'default')
+FHIR_BACKEND_METRICS_FLUSH_INTERVAL = int_env(env('FHIR_BACKEND_METRICS_FLUSH_INTERVAL', 10))
+FHIR_BACKEND_METRICS_TTL = int_env(env('FHIR_BACKEND_METRICS_TTL', 24 * 60 * 60))
+
+# Warm each worker up (backend connections per endpoint, CapabilityStatement, scopes and
+# waffle caches) from HealthConfig.ready(), or use the apps.health.gunicorn post_worker_init hook.
+# /health/ready answers 503 until the warm-up finished, see apps.health.warmup
+WARMUP_ON_READY = bool_env(env('WARMUP_ON_READY', False))
+WARMUP_BACKEND_CONNECTIONS = int_env(env('WARMUP_BACKEND_CONNECTIONS', 4))
+
+# Seconds the Application first_active/last_active updates of a process are batched
+# before they are written (0 = written on every call), see apps.dot_ext.activity
+APPLICATION_ACTIVITY_FLUSH_INTERVAL = int_env(env('APPLICATION_ACTIVITY_FLUSH_INTERVAL', 10))
+
+# Opt-in cache of resolved FHIR API bearer tokens, see apps.dot_ext.token_cache.
+# TTL is in seconds, capped at the token expiry. Use a memory cache alias, not the database cache.
+TOKEN_CACHE_ENABLED = bool_env(env('TOKEN_CACHE_ENABLED', False))
+TOKEN_CACHE_ALIAS = env('TOKEN_CACHE_ALIAS', 'default')
+TOKEN_CACHE_TTL = int_env(env('TOKEN_CACHE_TTL', 5 * 60))
+
+# Opt-in cache of the DataAccessGrant lookups of the FHIR API permission check, see
+# apps.authorization.grant_index. TTLs are in seconds. A revoked grant is honored by other processes
+# REVOCATION_BOUND seconds at most. Use a memory cache alias, on the database cache a miss costs more
+# queries than the grant query it replaces.
+DATA_ACCESS_GRANT_CACHE_ENABLED = bool_env(env('DATA_ACCESS_GRANT_CACHE_ENABLED', False))
+DATA_ACCESS_GRANT_CACHE_ALIAS = env('DATA_ACCESS_GRANT_CACHE_ALIAS', 'default')
+DATA_ACCESS_GRANT_CACHE_SIZE = int_env(env('DATA_ACCESS_GRANT_CACHE_SIZE', 10000))
+DATA_ACCESS_GRANT_POSITIVE_TTL = int_env(env('DATA_ACCESS_GRANT_POSITIVE_TTL', 5 * 60))
+DATA_ACCESS_GRANT_NEGATIVE_TTL = int_env(env('DATA_ACCESS_GRANT_NEGATIVE_TTL', 30))
+DATA_ACCESS_GRANT_REVOCATION_BOUND = int_env(env('DATA_ACCESS_GRANT_REVOCATION_BOUND', 10))
+
+# Compiled ProtectedCapability routing table, see apps.capabilities.routes. Other processes
+# see a saved or deleted ProtectedCapability within CHECK_INTERVAL seconds.
+CAPABILITY_ROUTES_CACHE_ENABLED = bool_env(env('CAPABILITY_ROUTES_CACHE_ENABLED', True))
+CAPABILITY_ROUTES_CACHE_ALIAS = env('CAPABILITY_ROUTES_CACHE_ALIAS', 'default')
+CAPABILITY_ROUTES_CHECK_INTERVAL = int_env(env('CAPABILITY_ROUTES_CHECK_INTERVAL', 30))
+
+# FHIR Bulk Data Patient/$export jobs, see apps.fhir.bluebutton.export. Jobs run in up to
+# FHIR_EXPORT_MAX_WORKERS threads per process, or only in the run_export_jobs command with 0.
+# Times are in seconds.
+FHIR_EXPORT_MAX_WORKERS = int_env(env('FHIR_EXPORT_MAX_WORKERS', 2))
+FHIR_EXPORT_FILE_MAX_RESOURCES = int_env(env('FHIR_EXPORT_FILE_MAX_RESOURCES', 1000))
+FHIR_EXPORT_RETRIES = int_env(env('FHIR_EXPORT_RETRIES', 2))
+FHIR_EXPORT_STALE_AFTER = int_env(env('FHIR_EXPORT_STALE_AFTER', 10 * 60))
+FHIR_EXPORT_RETENTION = int_env(env('FHIR_EXPORT_RETENTION', 24 * 60 * 60))
+
 '''
     FHIR URL search query parameters for backend /Patient resource
     See FHIR and/or BFD specs for "identifier" and "_format" params.
@@ -12,6 +12,16 @@ REQUEST_CALL_TIMEOUT = (5, 120)
 
 OFFLINE = True
 
+# Mocked backend errors must not open the backend circuit breaker for the tests that follow
+FHIR_SERVER = dict(FHIR_SERVER, BREAKER_ENABLED=False)
+
+# Timer threads would not see the test transaction, write the activity on each call
+APPLICATION_ACTIVITY_FLUSH_INTERVAL = 0
+
+# Rolled back test transactions send no signals, cached grants and routes would leak across tests
+DATA_ACCESS_GRANT_CACHE_ENABLED = False
+CAPABILITY_ROUTES_CACHE_ENABLED = False
+
 # Should be set to True in production and False in all other dev and test environments
 # Replace with BLOCK_HTTP_REDIRECT_URIS per CBBP-845 to support mobile apps
 # REQUIRE_HTTPS_REDIRECT_URIS = True